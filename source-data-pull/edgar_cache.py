@@ -0,0 +1,199 @@
+import gzip
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+from typing import BinaryIO, Dict, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, fall back to gzip
+    zstandard = None
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'edgar-cache')
+DEFAULT_CACHE_MAX_BYTES = 20 * 1024 ** 3
+# Evict down to this fraction of max_bytes so eviction doesn't run on every put once the cache is full
+EVICT_TO_FRACTION = 0.9
+
+
+def cache_key(url: str) -> str:
+    """Normalize an EDGAR url or path to a cache key, e.g. 'www.sec.gov/Archives/edgar/data/...'."""
+    key = url.split('://', 1)[-1]
+    if key.startswith('/'):
+        key = 'www.sec.gov' + key
+    while '//' in key:
+        key = key.replace('//', '/')
+    return key
+
+
+class FilingCache:
+    """
+    Size-bounded, compressed on-disk cache of EDGAR responses shared by all the downloaders.
+
+    Bodies are stored zstd-compressed (gzip if zstandard isn't installed) in files named by the sha256 of their key,
+    with fetch time, last access, ETag and sizes kept in a sqlite index. Once the stored size goes over `max_bytes`
+    the least recently used entries are evicted. The index is safe to share between threads and between processes
+    running side by side.
+    """
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIRECTORY, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.codec = 'zst' if zstandard is not None else 'gz'
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(directory, 'index.sqlite'), timeout=60, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute('''CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                file TEXT NOT NULL,
+                codec TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                etag TEXT,
+                size INTEGER NOT NULL,
+                stored_size INTEGER NOT NULL)''')
+            self.db.execute('CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)')
+
+    def metadata(self, key: str) -> Optional[Dict]:
+        with self.lock:
+            row = self.db.execute('SELECT file, codec, fetched_at, accessed_at, etag, size, stored_size '
+                                  'FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(['file', 'codec', 'fetched_at', 'accessed_at', 'etag', 'size', 'stored_size'], row))
+
+    def open(self, key: str, max_age_seconds: float = None) -> Optional[BinaryIO]:
+        """Return a decompressing binary stream over the cached body, or None on a miss or if older than max_age."""
+        meta = self.metadata(key)
+        if meta is None or (max_age_seconds is not None and time.time() - meta['fetched_at'] > max_age_seconds):
+            return None
+        try:
+            stream = self._reader(os.path.join(self.directory, meta['file']), meta['codec'])
+        except FileNotFoundError:
+            self.delete(key)
+            return None
+        with self.lock, self.db:
+            self.db.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (time.time(), key))
+        return stream
+
+    def get(self, key: str, max_age_seconds: float = None) -> Optional[bytes]:
+        stream = self.open(key, max_age_seconds)
+        if stream is None:
+            return None
+        with stream:
+            return stream.read()
+
+    def put(self, key: str, data: bytes, etag: str = None):
+        with self.writer(key, etag) as file:
+            file.write(data)
+
+    def writer(self, key: str, etag: str = None) -> 'CacheWriter':
+        """Return a file-like object that compresses what is written and adds it to the cache when closed."""
+        return CacheWriter(self, key, etag)
+
+    def delete(self, key: str):
+        with self.lock, self.db:
+            row = self.db.execute('SELECT file FROM entries WHERE key = ?', (key,)).fetchone()
+            self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+        if row is not None:
+            self._remove_file(row[0])
+
+    def total_bytes(self) -> int:
+        with self.lock:
+            return self.db.execute('SELECT COALESCE(SUM(stored_size), 0) FROM entries').fetchone()[0]
+
+    def evict(self):
+        """Remove least recently used entries until the cache is back under its size limit."""
+        target = self.max_bytes * EVICT_TO_FRACTION
+        with self.lock, self.db:
+            total = self.db.execute('SELECT COALESCE(SUM(stored_size), 0) FROM entries').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            evicted = []
+            for key, file, stored_size in self.db.execute(
+                    'SELECT key, file, stored_size FROM entries ORDER BY accessed_at'):
+                if total <= target:
+                    break
+                evicted.append((key, file))
+                total -= stored_size
+            self.db.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key, file in evicted])
+        for key, file in evicted:
+            self._remove_file(file)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _commit(self, key: str, tmp_path: str, etag: Optional[str], size: int):
+        file = self._file_name(key)
+        path = os.path.join(self.directory, file)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            (key, file, self.codec, now, now, etag, size, os.path.getsize(path)))
+        self.evict()
+
+    def _file_name(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(digest[:2], f'{digest}.{self.codec}')
+
+    def _remove_file(self, file: str):
+        try:
+            os.remove(os.path.join(self.directory, file))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _reader(path: str, codec: str) -> BinaryIO:
+        if codec == 'gz':
+            return gzip.open(path, 'rb')
+        if zstandard is None:
+            raise RuntimeError(f'zstandard is required to read {path}')
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+
+
+class CacheWriter:
+    """Compressing writer for one cache entry, committed to the index on close() or discarded by abort()."""
+
+    def __init__(self, cache: FilingCache, key: str, etag: str = None):
+        self.cache = cache
+        self.key = key
+        self.etag = etag
+        self.size = 0
+        self.closed = False
+        self.tmp_path = os.path.join(cache.directory, f'.tmp-{os.getpid()}-{threading.get_ident()}-{id(self)}')
+        if cache.codec == 'gz':
+            self.stream = gzip.open(self.tmp_path, 'wb')
+        else:
+            self.stream = zstandard.ZstdCompressor().stream_writer(open(self.tmp_path, 'wb'), closefd=True)
+
+    def write(self, data: bytes) -> int:
+        self.stream.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.stream.close()
+            self.cache._commit(self.key, self.tmp_path, self.etag, self.size)
+
+    def abort(self):
+        if not self.closed:
+            self.closed = True
+            self.stream.close()
+            os.remove(self.tmp_path)
+
+    def __enter__(self) -> 'CacheWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,197 @@
+import contextlib
+import email.utils
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Iterator, List, Optional
+from urllib.parse import urlsplit
+
+try:
+    import fcntl
+except ImportError:  # e.g. Windows, where the governor only paces the threads of one process
+    fcntl = None
+
+from metrics import METRICS
+
+# SEC fair access allows 10 requests per second per user across www.sec.gov and data.sec.gov
+DEFAULT_REQUESTS_PER_SECOND = 10
+DEFAULT_RETRIES = 4
+THROTTLE_STATUSES = {429, 503}
+# A throttled response halves the rate. Successful responses win it back quickly up to RECOVERY_SHARE of the rate
+# that was refused, probe slowly up to that rate and faster past it, in case the refusal was not down to the rate.
+# Each is the share of the maximum rate added per second of requests
+DECREASE_FACTOR = 0.5
+RECOVERY_SHARE = 0.9
+RECOVER_INCREASE_SHARE = 0.5
+PROBE_INCREASE_SHARE = 0.003
+BEYOND_INCREASE_SHARE = 0.1
+BASE_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+# A state file untouched for this long is left over from an earlier run, which starts again at the full rate
+IDLE_RESET_SECONDS = 60.0
+
+# next token due, rate, refused rate, blocked until, last decrease and strikes, as doubles in a fixed 48 bytes
+STATE = struct.Struct('<6d')
+NEXT_TOKEN, RATE, REFUSED_RATE, BLOCKED_UNTIL, LAST_DECREASE, STRIKES = range(6)
+
+
+class RateGovernor:
+    """
+    Token bucket shared by every thread and process sending requests to one server. The bucket is kept in a small
+    state file under an exclusive file lock, so scripts run side by side, e.g. by run-pipeline.py, and all of their
+    workers together stay under `per_second`. Tokens refill at the current rate up to `burst`. The bucket is kept as
+    the time the next token is due, so a request reserves that token and sleeps until then, and a change of rate only
+    spaces out the requests that come after it.
+
+    The rate adapts like TCP congestion control. A 429 or 503 halves it, at most once a second so a burst of refused
+    requests counts once, and pauses every caller until the response's Retry-After, or an exponential backoff if it
+    has none, has passed. Successful responses then win back most of the refused rate within a second or two and
+    slowly probe up to it, so the rate settles just under the server's limit rather than on it, where the jitter of
+    arrival times alone gets requests refused. A new bucket likewise starts just under `per_second`. Past the refused
+    rate the probing speeds up again, since refusals that were not down to the rate would otherwise ratchet it down.
+    """
+
+    def __init__(self, per_second: float = DEFAULT_REQUESTS_PER_SECOND, state_path: str = None, burst: float = 1.0,
+                 min_per_second: float = 0.5, retries: int = DEFAULT_RETRIES):
+        self.max_rate = per_second
+        self.min_rate = min(min_per_second, per_second)
+        self.burst = burst
+        self.retries = retries
+        self.state_path = state_path if fcntl is not None else None
+        self.lock = threading.Lock()
+        self.fd = None
+        self.state = None
+
+    def initial_state(self, now: float) -> List[float]:
+        # Start just under the cap and probe up to it, as if the cap had been refused
+        return [now, RECOVERY_SHARE * self.max_rate, self.max_rate, 0.0, 0.0, 0.0]
+
+    @contextlib.contextmanager
+    def locked_state(self) -> Iterator[List[float]]:
+        # The thread lock comes first since a file lock is held per open file, not per thread
+        with self.lock:
+            if self.state_path is None:
+                if self.state is None:
+                    self.state = self.initial_state(time.time())
+                yield self.state
+                return
+            if self.fd is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+                self.fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o666)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                data = os.pread(self.fd, STATE.size, 0)
+                now = time.time()
+                state = list(STATE.unpack(data)) if len(data) == STATE.size else None
+                if state is None or now - max(state[NEXT_TOKEN], state[BLOCKED_UNTIL]) > IDLE_RESET_SECONDS:
+                    state = self.initial_state(now)
+                yield state
+                os.pwrite(self.fd, STATE.pack(*state), 0)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def acquire(self):
+        """Wait until the next request may be sent."""
+        start = time.perf_counter()
+        while True:
+            with self.locked_state() as state:
+                now = time.time()
+                # Other processes may have a higher cap, this one never goes over its own
+                rate = state[RATE] = min(state[RATE], self.max_rate)
+                # Up to `burst` tokens build up while no requests are sent
+                due = max(state[NEXT_TOKEN], now - (self.burst - 1) / rate, state[BLOCKED_UNTIL])
+                state[NEXT_TOKEN] = due + 1 / rate
+                blocked_until = state[BLOCKED_UNTIL]
+            if due <= now:
+                break
+            time.sleep(due - now)
+            # A throttled response while asleep cancels every reservation, so check this one still stands
+            with self.locked_state() as state:
+                if state[BLOCKED_UNTIL] == blocked_until:
+                    break
+        METRICS.add_time('rate_limit_wait', time.perf_counter() - start)
+
+    def throttled(self, status: int, retry_after: Optional[str] = None) -> bool:
+        """Adapt the rate to a response. True if the server refused it for going too fast, so it should be retried."""
+        with self.locked_state() as state:
+            now = time.time()
+            if status not in THROTTLE_STATUSES:
+                if state[RATE] < self.max_rate:
+                    # Each response adds a share of the rate divided by the rate, so the increase per second of
+                    # requests is the same however fast they are sent
+                    if state[RATE] < RECOVERY_SHARE * state[REFUSED_RATE]:
+                        share = RECOVER_INCREASE_SHARE
+                    elif state[RATE] < state[REFUSED_RATE]:
+                        share = PROBE_INCREASE_SHARE
+                    else:
+                        share = BEYOND_INCREASE_SHARE
+                    state[RATE] = min(self.max_rate, state[RATE] + share * self.max_rate / state[RATE])
+                state[STRIKES] = 0.0
+                return False
+            METRICS.count('throttled_responses')
+            if now - state[LAST_DECREASE] >= 1.0:
+                state[REFUSED_RATE] = state[RATE]
+                state[RATE] = max(self.min_rate, state[RATE] * DECREASE_FACTOR)
+                state[LAST_DECREASE] = now
+                state[STRIKES] += 1
+            pause = retry_after_seconds(retry_after)
+            if pause is None:
+                pause = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** (state[STRIKES] - 1))
+            state[BLOCKED_UNTIL] = max(state[BLOCKED_UNTIL], now + pause)
+            # Callers already waiting for a token will wait again, so their reservations are dropped
+            state[NEXT_TOKEN] = state[BLOCKED_UNTIL]
+            return True
+
+    @property
+    def rate(self) -> float:
+        with self.locked_state() as state:
+            return min(state[RATE], self.max_rate)
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def default_state_path(url: str) -> str:
+    # All of sec.gov shares one limit, any other server, e.g. a local mock, gets its own bucket
+    parts = urlsplit(url)
+    host = parts.hostname or 'localhost'
+    if host == 'sec.gov' or host.endswith('.sec.gov'):
+        name = 'sec.gov'
+    else:
+        name = f'{host}-{parts.port}' if parts.port else host
+    return os.path.join(tempfile.gettempdir(), f'edgar-rate-{name}.state')
+
+
+def add_rate_arguments(parser):
+    parser.add_argument('-r', '--requests-per-second', type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help='Cap on requests per second to SEC EDGAR, shared by all workers and by every script '
+                             'running at once through the rate state file')
+    parser.add_argument('-rs', '--rate-state-file', required=False,
+                        help='File holding the shared request budget. Defaults to one per server in the temp '
+                             'directory')
+    parser.add_argument('-rr', '--retries', type=int, default=DEFAULT_RETRIES,
+                        help='Times to retry a request refused with 429 or 503, after waiting out its Retry-After')
+
+
+def governor_from_args(args, url: str) -> RateGovernor:
+    return RateGovernor(args.requests_per_second, args.rate_state_file or default_state_path(url),
+                        retries=args.retries)
@@ -0,0 +1,36 @@
+import http.client
+import os
+from urllib.parse import urlsplit
+
+# Every downloader can be pointed at another server, e.g. mock-edgar-server.py, with --edgar-url and --data-url or
+# for all scripts at once with these environment variables
+DEFAULT_EDGAR_URL = os.environ.get('EDGAR_URL', 'https://www.sec.gov').rstrip('/')
+DEFAULT_DATA_URL = os.environ.get('EDGAR_DATA_URL', 'https://data.sec.gov').rstrip('/')
+
+
+def add_url_arguments(parser, data_url: bool = False):
+    parser.add_argument('-eu', '--edgar-url', default=DEFAULT_EDGAR_URL,
+                        help='Base url of EDGAR filings and indexes, e.g. http://localhost:8000 for '
+                             'mock-edgar-server.py. Defaults to $EDGAR_URL if set')
+    if data_url:
+        parser.add_argument('-du', '--data-url', default=DEFAULT_DATA_URL,
+                            help='Base url of the EDGAR submissions API. Defaults to $EDGAR_DATA_URL if set')
+
+
+def rebase(url: str, base_url: str) -> str:
+    """Point an EDGAR url at another server, keeping its path, e.g. to fetch a real filing url from a mock server."""
+    parts = urlsplit(url)
+    return base_url.rstrip('/') + parts.path + ('?' + parts.query if parts.query else '')
+
+
+def request_target(url: str) -> str:
+    parts = urlsplit(url)
+    return (parts.path or '/') + ('?' + parts.query if parts.query else '')
+
+
+def connect(url: str, timeout: float = None) -> http.client.HTTPConnection:
+    """A connection to the server of `url`, over https unless the url is http, e.g. a local mock server."""
+    parts = urlsplit(url)
+    if parts.scheme == 'http':
+        return http.client.HTTPConnection(parts.netloc, timeout=timeout)
+    return http.client.HTTPSConnection(parts.netloc, timeout=timeout)
@@ -0,0 +1,186 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List, Sequence
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'embedding-cache.sqlite')
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_DIMENSIONS = 1536
+# Keys looked up per SELECT, under sqlite's limit on bound parameters
+LOOKUP_BATCH_SIZE = 500
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def embedding_key(model: str, text: str) -> str:
+    """Cache key of a text's embedding, the sha256 of the model name and the text."""
+    return hashlib.sha256(f'{model}\n{text}'.encode('utf-8')).hexdigest()
+
+
+class EmbeddingProvider:
+    """
+    Interface of an embedding model. `model` names the model and is part of every cache key, so embeddings from
+    different models or dimensions never mix. embed_documents() has the signature of langchain's Embeddings.
+    """
+
+    model = None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+
+class LangchainProvider(EmbeddingProvider):
+    """Wraps a langchain Embeddings object, e.g. the OpenAIEmbeddings() used in the notebooks."""
+
+    def __init__(self, embeddings, model: str = None):
+        self.embeddings = embeddings
+        self.model = model or getattr(embeddings, 'model', None) or type(embeddings).__name__
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+
+class HashEmbeddingProvider(EmbeddingProvider):
+    """
+    Deterministic local stand-in for a real model. Each word is hashed to a signed position in a `dimensions` long
+    vector, which is then L2 normalized, so texts sharing words get a positive cosine similarity. No network, no
+    randomness, and the same text always gives the same vector.
+    """
+
+    def __init__(self, dimensions: int = DEFAULT_DIMENSIONS):
+        self.dimensions = dimensions
+        self.model = f'local-hash-{dimensions}'
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed(text).tolist() for text in texts]
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        hashes = np.array([zlib.crc32(x.encode('utf-8')) for x in TOKEN_PATTERN.findall(text.lower())],
+                          dtype=np.int64)
+        if hashes.size:
+            np.add.at(vector, hashes % self.dimensions, np.where(hashes & 1 << 31, -1.0, 1.0).astype(np.float32))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+
+def make_provider(name: str, model: str = None, dimensions: int = DEFAULT_DIMENSIONS) -> EmbeddingProvider:
+    if name == 'hash':
+        return HashEmbeddingProvider(dimensions)
+    if name == 'openai':
+        from langchain.embeddings import OpenAIEmbeddings
+        return LangchainProvider(OpenAIEmbeddings(model=model) if model else OpenAIEmbeddings())
+    raise ValueError(f'Unknown embedding provider {name!r}')
+
+
+class EmbeddingCache:
+    """
+    Persistent embeddings keyed by embedding_key(), stored as float32 blobs in a sqlite file. Like the filing cache
+    it is safe to share between threads and between processes running side by side.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute('''CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                dimensions INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL)''')
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        keys = list(keys)
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), LOOKUP_BATCH_SIZE):
+                batch = keys[i:i + LOOKUP_BATCH_SIZE]
+                placeholders = ','.join('?' * len(batch))
+                rows = self.db.execute(f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', batch)
+                found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+        return found
+
+    def put_many(self, model: str, entries: Dict[str, np.ndarray]):
+        now = time.time()
+        with self.lock, self.db:
+            self.db.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)',
+                                [(key, model, vector.shape[0], vector.astype(np.float32).tobytes(), now)
+                                 for key, vector in entries.items()])
+
+    def count(self, model: str = None) -> int:
+        with self.lock:
+            if model is None:
+                return self.db.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+            return self.db.execute('SELECT COUNT(*) FROM embeddings WHERE model = ?', (model,)).fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class Embedder:
+    """
+    Embeds texts through the cache. Only texts missing from the cache are sent to the provider, each distinct text
+    once, in batches of `batch_size` with at most `max_in_flight` requests outstanding. Every batch is written to the
+    cache as soon as it returns, so an interrupted run keeps what it already paid for.
+    """
+
+    def __init__(self, provider: EmbeddingProvider, cache: EmbeddingCache = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT):
+        self.provider = provider
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self.max_in_flight = max(1, max_in_flight)
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Return a float32 matrix with one row per text, in the order given."""
+        model = self.provider.model
+        keys = [embedding_key(model, text) for text in texts]
+        found = self.cache.get_many(set(keys)) if self.cache is not None else {}
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        self.hits += len(keys) - sum(1 for key in keys if key in missing)
+        self.misses += len(missing)
+        found.update(self.fetch(list(missing.items())))
+        if not keys:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([found[key] for key in keys]).astype(np.float32, copy=False)
+
+    def fetch(self, items: List) -> Dict[str, np.ndarray]:
+        # A batch is only submitted once fewer than max_in_flight are outstanding, so the provider never sees more
+        # concurrent requests than that
+        fetched = {}
+        pending = set()
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            for i in range(0, len(items), self.batch_size):
+                if len(pending) >= self.max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        fetched.update(future.result())
+                pending.add(executor.submit(self.fetch_batch, items[i:i + self.batch_size]))
+                self.requests += 1
+            for future in pending:
+                fetched.update(future.result())
+        return fetched
+
+    def fetch_batch(self, batch: List) -> Dict[str, np.ndarray]:
+        vectors = self.provider.embed_documents([text for key, text in batch])
+        entries = {key: np.asarray(vector, dtype=np.float32) for (key, text), vector in zip(batch, vectors)}
+        if self.cache is not None:
+            self.cache.put_many(self.provider.model, entries)
+        return entries
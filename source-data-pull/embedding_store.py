@@ -0,0 +1,175 @@
+import os
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+from neo4j_loader import DEFAULT_BATCH_SIZE, DEFAULT_WORKERS, LoadStats, Neo4jLoader
+
+VECTORS_FILE = 'embeddings.npy'
+IDS_FILE = 'chunk-ids.txt'
+DEFAULT_SEARCH_BATCH_SIZE = 2048
+# Same query as the notebooks use to set Chunk embeddings for the form_10k_chunks vector index
+SET_VECTOR_QUERY = '''UNWIND $recs AS rec
+MATCH(n:Chunk {chunkId: rec.chunkId})
+CALL db.create.setNodeVectorProperty(n, "textEmbedding", rec.textEmbedding)
+RETURN count(n) AS propertySetCount'''
+
+
+class StoreWriter:
+    """
+    Writes an embedding store of `rows` vectors. The float32 matrix is created as a memory-mapped .npy file on the
+    first write, once the vector length is known, and rows are written into it in place as they come.
+    """
+
+    def __init__(self, directory: str, rows: int):
+        self.directory = directory
+        self.rows = rows
+        self.row = 0
+        self.matrix = None
+        os.makedirs(directory, exist_ok=True)
+        self.ids_file = open(os.path.join(directory, IDS_FILE + '.part'), 'w', encoding='utf-8')
+
+    def write(self, chunk_ids: Sequence[str], vectors: np.ndarray):
+        if len(chunk_ids) == 0:
+            return
+        if self.matrix is None:
+            self.matrix = np.lib.format.open_memmap(os.path.join(self.directory, VECTORS_FILE + '.part'), mode='w+',
+                                                    dtype=np.float32, shape=(self.rows, vectors.shape[1]))
+        self.matrix[self.row:self.row + len(chunk_ids)] = vectors
+        self.row += len(chunk_ids)
+        self.ids_file.writelines(x + '\n' for x in chunk_ids)
+
+    def close(self):
+        if self.row != self.rows:
+            raise ValueError(f'Wrote {self.row:,} of the {self.rows:,} rows of {self.directory}')
+        self.ids_file.close()
+        if self.matrix is None:
+            self.matrix = np.lib.format.open_memmap(os.path.join(self.directory, VECTORS_FILE + '.part'), mode='w+',
+                                                    dtype=np.float32, shape=(0, 0))
+        self.matrix.flush()
+        del self.matrix
+        for file_name in [VECTORS_FILE, IDS_FILE]:
+            os.replace(os.path.join(self.directory, file_name + '.part'), os.path.join(self.directory, file_name))
+
+
+class EmbeddingStore:
+    """
+    Chunk embeddings on disk: a contiguous float32 .npy matrix, opened memory-mapped so only the rows touched are
+    read, and the chunkId of each row. Searches run over the matrix in blocks of rows, so memory stays bounded by
+    one block of scores however large the store is.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.matrix = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode='r')
+        with open(os.path.join(directory, IDS_FILE), encoding='utf-8') as file:
+            self.ids = [line.rstrip('\n') for line in file]
+        if len(self.ids) != self.matrix.shape[0]:
+            raise ValueError(f'{directory} has {len(self.ids):,} chunk ids for {self.matrix.shape[0]:,} vectors')
+        self.index = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self._norms = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def dimensions(self) -> int:
+        return self.matrix.shape[1]
+
+    @property
+    def norms(self) -> np.ndarray:
+        if self._norms is None:
+            self._norms = np.concatenate([np.linalg.norm(block, axis=1) for block in self.blocks()]) \
+                if len(self) else np.zeros(0, dtype=np.float32)
+        return self._norms
+
+    def rows(self, chunk_ids: Sequence[str]) -> np.ndarray:
+        return np.array([self.index[x] for x in chunk_ids], dtype=np.int64)
+
+    def vectors(self, chunk_ids: Sequence[str]) -> np.ndarray:
+        return np.asarray(self.matrix[self.rows(chunk_ids)], dtype=np.float32)
+
+    def blocks(self, batch_size: int = DEFAULT_SEARCH_BATCH_SIZE) -> Iterator[np.ndarray]:
+        for start in range(0, len(self), batch_size):
+            yield np.asarray(self.matrix[start:start + batch_size], dtype=np.float32)
+
+    def search(self, queries: np.ndarray, k: int = 10, batch_size: int = DEFAULT_SEARCH_BATCH_SIZE,
+               exclude_rows: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Cosine top-k of each query vector against the whole store. Returns (scores, rows), each of shape
+        (len(queries), k) and sorted by descending score. exclude_rows gives one store row per query to leave out of
+        its results, e.g. the query's own row.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        k = min(k, len(self) - (exclude_rows is not None))
+        best_scores = np.full((queries.shape[0], max(k, 0)), -np.inf, dtype=np.float32)
+        best_rows = np.full((queries.shape[0], max(k, 0)), -1, dtype=np.int64)
+        if k <= 0:
+            return best_scores, best_rows
+        norms = self.norms
+        for start, block in zip(range(0, len(self), batch_size), self.blocks(batch_size)):
+            scores = queries @ block.T / np.maximum(norms[start:start + block.shape[0]], 1e-12)
+            if exclude_rows is not None:
+                own = (exclude_rows >= start) & (exclude_rows < start + block.shape[0])
+                scores[own, exclude_rows[own] - start] = -np.inf
+            # Take this block's top k, then keep the best k of those and the running top k
+            block_rows = np.broadcast_to(np.arange(start, start + block.shape[0]), scores.shape)
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+                block_rows = top + start
+            candidate_scores = np.concatenate([best_scores, scores], axis=1)
+            candidate_rows = np.concatenate([best_rows, block_rows], axis=1)
+            top = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(candidate_scores, top, axis=1)
+            best_rows = np.take_along_axis(candidate_rows, top, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_rows, order, axis=1)
+
+    def top_k(self, query: np.ndarray, k: int = 10) -> List[Tuple[str, float]]:
+        scores, rows = self.search(query, k)
+        return [(self.ids[row], float(score)) for row, score in zip(rows[0], scores[0])]
+
+    def similar_pairs(self, k: int = 5, min_score: float = None,
+                      batch_size: int = DEFAULT_SEARCH_BATCH_SIZE) -> Iterator[Tuple[str, str, float]]:
+        """(chunkId, chunkId, score) of each chunk's k most similar other chunks, e.g. for SIMILAR_TO relationships."""
+        for start, block in zip(range(0, len(self), batch_size), self.blocks(batch_size)):
+            own_rows = np.arange(start, start + block.shape[0])
+            scores, rows = self.search(block, k, batch_size, exclude_rows=own_rows)
+            for source, target_rows, target_scores in zip(own_rows, rows, scores):
+                for target, score in zip(target_rows, target_scores):
+                    if min_score is None or score >= min_score:
+                        yield self.ids[source], self.ids[target], float(score)
+
+    def pair_scores(self, pairs: Sequence[Tuple[str, str]]) -> np.ndarray:
+        """Cosine similarity of given (chunkId, chunkId) pairs, e.g. to weight NEXT relationships."""
+        if len(pairs) == 0:
+            return np.zeros(0, dtype=np.float32)
+        sources = self.rows([x[0] for x in pairs])
+        targets = self.rows([x[1] for x in pairs])
+        dots = np.einsum('ij,ij->i', np.asarray(self.matrix[sources]), np.asarray(self.matrix[targets]))
+        return dots / np.maximum(self.norms[sources] * self.norms[targets], 1e-12)
+
+    def iter_vector_records(self, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[Dict]]:
+        for start, block in zip(range(0, len(self), batch_size), self.blocks(batch_size)):
+            yield [{'chunkId': chunk_id, 'textEmbedding': vector.tolist()}
+                   for chunk_id, vector in zip(self.ids[start:start + batch_size], block)]
+
+
+def load_embeddings(driver, store: EmbeddingStore, batch_size: int = DEFAULT_BATCH_SIZE,
+                    workers: int = DEFAULT_WORKERS, database: str = 'neo4j') -> LoadStats:
+    """Set the textEmbedding vector property of existing Chunk nodes from the store, `workers` batches at a time."""
+    loader = Neo4jLoader(driver, database, batch_size, workers)
+    print('======  loading Chunk text embeddings  ======')
+    stats = LoadStats('text embeddings', len(store))
+    group = []
+    for recs in store.iter_vector_records(batch_size):
+        group.append(recs)
+        if len(group) == workers:
+            loader.run_batches(SET_VECTOR_QUERY, [group], stats)
+            group = []
+    if group:
+        loader.run_batches(SET_VECTOR_QUERY, [group], stats)
+    print(stats)
+    return stats
@@ -1,5 +1,5 @@
 import argparse
-from typing import Dict, List
+from typing import Dict, Iterator, List
 import datetime
 import os
 import re
@@ -7,16 +7,38 @@ import pandas as pd
 from bs4 import BeautifulSoup
 from pandas import DataFrame
 
+from metrics import METRICS, add_metrics_arguments, run_with_metrics, timed
+
+# Columns of the form 13 data used by the join, only these are read from a parquet dataset
+FORM13_COLUMNS = ["source", "managerCik", "managerAddress", "managerName", "reportCalendarOrQuarter", "cusip6",
+                  "cusip", "companyName", "value", "shares"]
+# Read cusips as text, as the parquet dataset stores them, so all-digit ones keep their leading zeros and join
+CUSIP_DTYPES = {"cusip6": str, "cusip": str}
+FORM10_COLUMNS = ["cusip6", "cik", "names", "cusip", "form10KUrls"]
+DEFAULT_CHUNK_ROWS = 1_000_000
+
 
 def main() -> int:
     args = parse_args()
+    return run_with_metrics('f10k-f13-subset', args, run, args)
 
+
+def run(args) -> int:
     form10_df = get_form10_df(args.left_10k)
-    form13_df = get_form13_df(args.right_13)
+    if args.join_mode == 'stream':
+        print(f'Found {form10_df.shape[0]:,} form 10k listings in {args.left_10k}')
+        stream_join(form10_df, args.right_13, args.left_10k + '.joined.csv',
+                    args.right_13.rstrip('/') + '.joined.csv', args.report_periods, args.chunk_rows)
+        return 0
+    form13_df = get_form13_df(args.right_13, args.report_periods)
 
     print(f'Found {form10_df.shape[0]:,} form 10k listings in {args.left_10k}')
     print(f'Found {form13_df.shape[0]:,} form 13 listings in {args.right_13}')
+    merge_join(form10_df, form13_df, args.left_10k + '.joined.csv', args.right_13.rstrip('/') + '.joined.csv')
+    return 0
 
+@timed()
+def merge_join(form10_df: DataFrame, form13_df: DataFrame, form10_output: str, form13_output: str):
     # Left join
     leftjoin = pd.merge(form10_df, form13_df,  
                    on='cusip6',  
@@ -36,7 +58,7 @@ def main() -> int:
     reduced_form10.rename(columns={"cusip_x": "cusip"}, inplace=True)
     print(reduced_form10.head(5)[["cusip6","cik","names","cusip","form10KUrls"]])
 
-    reduced_form10.to_csv(args.left_10k + '.joined.csv', index=False)
+    reduced_form10.to_csv(form10_output, index=False)
 
     # Right join
 
@@ -58,20 +80,97 @@ def main() -> int:
     reduced_form13.rename(columns={"cusip_y": "cusip"}, inplace=True)
     print(reduced_form13.head(5)[["source","managerCik","managerAddress","managerName","reportCalendarOrQuarter","cusip6","cusip","companyName","value","shares"]])
 
-    reduced_form13.to_csv(args.right_13 + '.joined.csv', index=False)
-
-    return 0
+    reduced_form13.to_csv(form13_output, index=False)
 
+@timed()
 def get_form10_df(formatted_data_path: str) -> DataFrame:
-    res = pd.read_csv(formatted_data_path)
+    res = pd.read_csv(formatted_data_path, dtype=CUSIP_DTYPES)
     # res.cik = res.cik.astype(str)
     return res
 
-def get_form13_df(formatted_data_path: str) -> DataFrame:
-    res = pd.read_csv(formatted_data_path)
+@timed()
+def get_form13_df(formatted_data_path: str, report_periods: List[str] = None) -> DataFrame:
+    if os.path.isdir(formatted_data_path):
+        return get_form13_parquet_df(formatted_data_path, report_periods)
+    res = pd.read_csv(formatted_data_path, dtype=CUSIP_DTYPES)
+    if report_periods:
+        res = res[res['reportCalendarOrQuarter'].isin(report_periods)]
     # res.cik = res.cik.astype(str)
     return res
 
+def form13_dataset(dataset_path: str, report_periods: List[str] = None):
+    # Parquet dataset written by f13-parse-and-format.py --output-format parquet, and the filter that opens only the
+    # reportCalendarOrQuarter=... partitions of report_periods. pyarrow is only needed for parquet input, so it is
+    # imported on first use
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    partitioning = ds.partitioning(pa.schema([("reportCalendarOrQuarter", pa.date32())]), flavor="hive")
+    dataset = ds.dataset(dataset_path, format="parquet", partitioning=partitioning)
+    row_filter = None
+    if report_periods:
+        periods = [datetime.date.fromisoformat(period) for period in report_periods]
+        row_filter = ds.field("reportCalendarOrQuarter").isin(pa.array(periods, pa.date32()))
+    return dataset, row_filter
+
+def get_form13_parquet_df(dataset_path: str, report_periods: List[str] = None) -> DataFrame:
+    # Only the join columns are read
+    dataset, row_filter = form13_dataset(dataset_path, report_periods)
+    return dataset.to_table(columns=FORM13_COLUMNS, filter=row_filter).to_pandas()
+
+def iter_form13_chunks(formatted_data_path: str, report_periods: List[str] = None,
+                       chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[DataFrame]:
+    # Same rows as get_form13_df, read `chunk_rows` at a time
+    if os.path.isdir(formatted_data_path):
+        dataset, row_filter = form13_dataset(formatted_data_path, report_periods)
+        for batch in dataset.to_batches(columns=FORM13_COLUMNS, filter=row_filter, batch_size=chunk_rows):
+            yield batch.to_pandas()
+        return
+    for chunk in pd.read_csv(formatted_data_path, dtype=CUSIP_DTYPES, chunksize=chunk_rows):
+        if report_periods:
+            chunk = chunk[chunk['reportCalendarOrQuarter'].isin(report_periods)]
+        yield chunk
+
+@timed()
+def stream_join(form10_df: DataFrame, form13_path: str, form10_output: str, form13_output: str,
+                report_periods: List[str] = None, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+    """
+    Produce the same two reduced csvs as the merge join in main, holding only the form 10k data and one chunk of
+    form 13 rows in memory. Form 13 chunks are probed against the cusip6 values of the 10k data, matching rows are
+    expanded by the ciks sharing their cusip6, and only the first row per (managerCik, cik) pair is appended to the
+    output. The 10k side keeps its first row for every cusip6 that any manager holds.
+    """
+    # cusip6 -> cik pairs for the right join, in 10k order so expanded rows keep the merge join's order
+    cik_pairs = form10_df.loc[form10_df['cik'].notna(), ['cusip6', 'cik']].drop_duplicates()
+    form10_cusip6s = pd.Index(form10_df['cusip6'].unique())
+    held_cusip6s = set()
+    seen_pairs = set()
+    form13_rows = 0
+    written_rows = 0
+    with open(form13_output, 'w', newline='') as file:
+        DataFrame(columns=FORM13_COLUMNS).to_csv(file, index=False)
+        for chunk in iter_form13_chunks(form13_path, report_periods, chunk_rows):
+            form13_rows += chunk.shape[0]
+            METRICS.count('form13_rows_read', chunk.shape[0])
+            chunk = chunk[chunk['cusip6'].isin(form10_cusip6s)]
+            held_cusip6s.update(chunk.loc[chunk['managerCik'].notna(), 'cusip6'].unique())
+
+            matched = chunk[FORM13_COLUMNS].merge(cik_pairs, on='cusip6', how='left')
+            matched = matched[matched['cik'].notna()]
+            pair_keys = matched['managerCik'].astype(str) + '|' + matched['cik'].astype(str)
+            first = ~pair_keys.duplicated() & ~pair_keys.isin(seen_pairs)
+            seen_pairs.update(pair_keys[first])
+            matched[first][FORM13_COLUMNS].to_csv(file, index=False, header=False)
+            written_rows += int(first.sum())
+            print(f'--- Streamed {form13_rows:,} form 13 rows, {written_rows:,} joined rows written')
+
+    print(f'Found {form13_rows:,} form 13 listings in {form13_path}')
+    reduced_form10 = form10_df[form10_df['cusip6'].isin(held_cusip6s)].drop_duplicates(subset=['cusip6'])
+    reduced_form10 = reduced_form10[FORM10_COLUMNS]
+    print(f'Kept {reduced_form10.shape[0]:,} form 10k rows held by form 13 managers')
+    print(f'Kept {written_rows:,} form 13 rows, one per form 13 manager and form 10k company')
+    reduced_form10.to_csv(form10_output, index=False)
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description='find matching form 10ks and 13s for a subset of companies in the 10k data set and save reduced csvs',
@@ -80,7 +179,16 @@ def parse_args():
                         help='Formatted file with 10K Urls and ciks')
     
     parser.add_argument('-r', '--right-13', required=False, default='form13/data/form13.csv',
-                        help='Formatted file with form 13 data')
+                        help='Formatted file with form 13 data, or directory of a form 13 parquet dataset')
+    parser.add_argument('-q', '--report-periods', required=False, nargs='+',
+                        help='Only join form 13 holdings from these report quarters, e.g. 2023-06-30. Parquet '
+                             'datasets skip the other quarters without reading them')
+    parser.add_argument('-j', '--join-mode', choices=['merge', 'stream'], default='merge',
+                        help='merge loads both data sets into memory. stream reads the form 13 data in chunks '
+                             'against an index of the 10k cusip6 values, with memory bounded by --chunk-rows')
+    parser.add_argument('-cr', '--chunk-rows', required=False, type=int, default=DEFAULT_CHUNK_ROWS,
+                        help='Number of form 13 rows per chunk in stream join mode')
+    add_metrics_arguments(parser)
     args = parser.parse_args()
     return args
 
@@ -0,0 +1,72 @@
+import argparse
+import importlib.util
+import os
+import time
+from typing import Dict
+
+
+def load_f10k_module():
+    # The download script's name is not a valid module name, so load it by path
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'f10k-download-parse-format.py')
+    spec = importlib.util.spec_from_file_location('f10k_download_parse_format', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main() -> int:
+    args = parse_args()
+    f10k = load_f10k_module()
+    engines = list(f10k.TEXT_ENGINES)
+    seconds = {engine: 0.0 for engine in engines}
+    doc_bytes = 0
+    mismatches = []
+
+    file_names = sorted(x for x in os.listdir(args.input_directory) if x.endswith('.txt'))
+    if args.limit is not None:
+        file_names = file_names[:args.limit]
+    print(f'=== Benchmarking text engines {engines} on {len(file_names):,} filings ===')
+    for file_name in file_names:
+        with open(os.path.join(args.input_directory, file_name), 'rb') as file:
+            doc = f10k.stream_10_k(file)
+        if doc is None:
+            print(f'--- Skipping {file_name}, no 10-K document found')
+            continue
+        doc_bytes += len(doc)
+        results: Dict[str, Dict[str, str]] = {}
+        for engine in engines:
+            start = time.perf_counter()
+            try:
+                results[engine] = f10k.extract_section_text(doc, engine)
+            except Exception as e:
+                print(f'--- {engine} failed on {file_name}: {e!r}')
+                results[engine] = None
+            seconds[engine] += time.perf_counter() - start
+        if any(results[engine] != results[engines[0]] for engine in engines[1:]):
+            mismatches.append(file_name)
+        print(f'--- {file_name}: ' + ', '.join(f'{engine} {seconds[engine]:,.2f}s' for engine in engines))
+
+    print(f'=== {doc_bytes / 1e6:,.1f} MB of 10-K documents ===')
+    for engine in engines:
+        print(f'{engine}: {seconds[engine]:,.2f}s, {doc_bytes / 1e6 / max(seconds[engine], 1e-9):,.2f} MB/s, '
+              f'{seconds[engines[-1]] / max(seconds[engine], 1e-9):,.2f}x vs {engines[-1]}')
+    print(f'===== Had {len(mismatches)} filings with differing text ====')
+    for file_name in mismatches:
+        print(file_name)
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='compare the speed and output of the 10k html to text engines on raw filings',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--input-directory', required=False, default='data/temp-10k',
+                        help='Directory of raw SEC 10K files, e.g. saved with f10k-download-parse-format.py --keep-raw')
+    parser.add_argument('-n', '--limit', required=False, type=int,
+                        help='Only benchmark the first `n` filings')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,47 +1,271 @@
 import argparse
+import contextlib
+import functools
 import http.client
-import io
 import json
-from typing import Dict, List
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import BinaryIO, Dict, List, Optional, Tuple
 import datetime
 import os
 import re
+import sys
 import pandas as pd
 from bs4 import BeautifulSoup
+from lxml import etree
 from pandas import DataFrame
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from edgar_cache import DEFAULT_CACHE_DIRECTORY, FilingCache, cache_key
+from edgar_rate import RateGovernor, add_rate_arguments, governor_from_args
+from edgar_urls import add_url_arguments, connect, rebase, request_target
+from metrics import METRICS, RETRY_EXIT_CODE, add_metrics_arguments, run_with_metrics, timed
+
+STREAM_CHUNK_BYTES = 1 << 16
+MIN_CHUNK_BYTES = 64
+DRAIN_LIMIT_BYTES = 1 << 20
+DEFAULT_TEXT_ENGINE = 'lxml'
+DEFAULT_SECTION_ITEMS = ['item1', 'item1a', 'item7', 'item7a']
+# Every Item heading of a 10-K. All of them are located so each section ends at the heading that follows it
+SECTION_ITEMS = ['item1', 'item1a', 'item1b', 'item1c', 'item2', 'item3', 'item4', 'item5', 'item6', 'item7',
+                 'item7a', 'item8', 'item9', 'item9a', 'item9b', 'item9c', 'item10', 'item11', 'item12', 'item13',
+                 'item14', 'item15', 'item16']
+ITEM_NUMBER_PATTERNS = {'1': r'1\.'}
+
 
 def main() -> int:
     args = parse_args()
-    temp_dir = args.temp_directory
+    return run_with_metrics('f10k-download-parse-format', args, run, args)
+
+
+def run(args) -> int:
+    temp_dir = args.temp_directory if args.keep_raw else None
     output_dir = args.output_directory
     user_email = args.user_email
     user_name = args.user_name
 
     print('Pulling urls...')
     url_df = get_cik_url_df(args.input_file)
+    # Filings are fetched and cached under the server they come from, so a mock server's never mix with EDGAR's
+    url_df['form10KUrls'] = url_df.form10KUrls.map(lambda x: rebase(x, args.edgar_url))
 
     print(f'Found {url_df.shape[0]:,} companies to pull filings for')
-    if not os.path.exists(temp_dir):
+    if temp_dir is not None and not os.path.exists(temp_dir):
         os.makedirs(temp_dir)
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    count = 0
+    user_agent = f'{user_name} {user_email}'
+    total = url_df.shape[0]
+    print(f'=== Downloading {total:,} 10K filings with {args.workers} worker(s) ===')
+    governor = governor_from_args(args, args.edgar_url)
+    pool = ConnectionPool(args.edgar_url)
+    cache = None if args.no_cache else FilingCache(args.cache_directory, int(args.cache_max_gb * 1024 ** 3))
+    failures = []
+    if args.pipeline:
+        print(f'=== Pipelining with {args.parse_workers} parse worker(s) and a queue of {args.queue_size} ===')
+        failures = run_pipeline(url_df, user_agent, temp_dir, output_dir, pool, governor,
+                                args.workers, args.parse_workers, args.queue_size,
+                                args.text_engine, args.items, cache)
+    elif args.workers > 1:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = {executor.submit(process_filing, row, user_agent, temp_dir, output_dir, pool, governor,
+                                           args.text_engine, args.items, cache): row
+                       for ind, row in url_df.iterrows()}
+            count = 0
+            for future in as_completed(futures):
+                count += 1
+                row = futures[future]
+                error = future.result()
+                print(f'--- Finished {count:,} of {total:,} 10K filings for {toList(row.names)}')
+                if error is not None:
+                    failures.append((row.form10KUrls, error))
+    else:
+        count = 0
+        for ind, row in url_df.iterrows():
+            count += 1
+            print(f'--- Downloading {count:,} of {total:,} 10K filings for {toList(row.names)}')
+            error = process_filing(row, user_agent, temp_dir, output_dir, pool, governor, args.text_engine,
+                                   args.items, cache)
+            if error is not None:
+                failures.append((row.form10KUrls, error))
+    pool.close_all()
+    governor.close()
+    if cache is not None:
+        cache.close()
+    print(f'===== Had {len(failures)} failed filings ====')
+    for url, error in failures:
+        print(f'{url}: {error}')
+    # Submissions without a 10-K parse the same way every time, so only downloads are worth trying again. Exiting
+    # with RETRY_EXIT_CODE has run-pipeline.py run the stage again rather than treat its output as current
+    retryable = [url for url, error in failures if error.startswith('download error')]
+    return RETRY_EXIT_CODE if retryable else 0
+
+
+def process_filing(row: pd.Series, user_agent: str, temp_dir: Optional[str], output_dir: str,
+                   pool: 'ConnectionPool' = None, governor: 'RateGovernor' = None,
+                   text_engine: str = DEFAULT_TEXT_ENGINE, items: List[str] = DEFAULT_SECTION_ITEMS,
+                   cache: FilingCache = None) -> Optional[str]:
+    # Download, parse and save a single filing. Returns None on success, otherwise a description of the failure
+    url = row.form10KUrls
+    file_id = url[url.rindex('/') + 1:url.rindex('.')]
+    raw_file_path = None if temp_dir is None else os.path.join(temp_dir, 'raw_' + file_id + '.txt')
+    start = time.perf_counter()
+    try:
+        doc = download_10_k(url, user_agent, pool, governor, raw_file_path, cache)
+    except Exception as e:
+        return f'download error: {e!r}'
+    if doc is None:
+        return 'no 10-K document found in submission'
+    METRICS.observe('filing_downloads', url, time.perf_counter() - start)
+    output_file_path = os.path.join(output_dir, file_id + '.json')
+    start = time.perf_counter()
+    try:
+        parse_save(doc, output_file_path, row.cik, row.cusip6, url, toList(row.cusip), toList(row.names), text_engine,
+                   items)
+    except Exception as e:
+        return f'parse error: {e!r}'
+    METRICS.observe('filing_parses', url, time.perf_counter() - start)
+    return None
+
+
+class StageStats:
+    """Thread-safe item, byte and busy-time counters for one pipeline stage."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.items = 0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+
+    def add(self, seconds: float, num_bytes: int = 0):
+        with self.lock:
+            self.items += 1
+            self.bytes += num_bytes
+            self.busy_seconds += seconds
+
+    def report(self, wall_seconds: float) -> str:
+        return (f'{self.name}: {self.items:,} filings, {self.items / max(wall_seconds, 1e-9):,.2f} filings/s, '
+                f'{self.bytes / 1e6 / max(wall_seconds, 1e-9):,.2f} MB/s, {self.busy_seconds:,.1f}s busy')
+
+
+def parse_sections(doc: str, text_engine: str = DEFAULT_TEXT_ENGINE,
+                   items: List[str] = DEFAULT_SECTION_ITEMS) -> Tuple[Dict[str, str], float, Dict]:
+    # Runs in a parse worker process, so it returns its own timing for the stage stats and its metrics to merge
+    start = time.perf_counter()
+    sections = extract_section_text(doc, text_engine, items)
+    return sections, time.perf_counter() - start, METRICS.drain()
+
+
+def run_pipeline(url_df: DataFrame, user_agent: str, temp_dir: Optional[str], output_dir: str, pool: 'ConnectionPool',
+                 governor: 'RateGovernor', download_workers: int, parse_workers: int,
+                 queue_size: int, text_engine: str = DEFAULT_TEXT_ENGINE,
+                 items: List[str] = DEFAULT_SECTION_ITEMS, cache: FilingCache = None) -> List[Tuple[str, str]]:
+    """
+    Download, parse and write filings as three overlapping stages. Download threads feed a bounded queue of 10-K
+    documents, which blocks them when parsing falls behind, a process pool parses the documents on all cores and a
+    writer thread saves the JSON. At most `queue_size` documents wait to be parsed and at most `parse_workers` * 2 are
+    being parsed or written at any time, so memory stays flat however many filings there are.
+    """
     total = url_df.shape[0]
-    print(f'=== Downloading {total:,} 10K filings ===')
-    for ind, row in url_df.iterrows():
-        count += 1
-        print(f'--- Downloading {count:,} of {total:,} 10K filings for {toList(row.names)}')
-        raw_file_path, file_id = download_filing(row.form10KUrls, f'{user_name} {user_email}', temp_dir)
-        if len(raw_file_path) > 0:
-            output_file_path = os.path.join(output_dir, file_id + '.json')
+    doc_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue()
+    in_flight = threading.BoundedSemaphore(parse_workers * 2)
+    failures = []
+    stats = {name: StageStats(name) for name in ['download', 'parse', 'write']}
+    done = object()
+
+    def download(row: pd.Series):
+        url = row.form10KUrls
+        file_id = url[url.rindex('/') + 1:url.rindex('.')]
+        raw_file_path = None if temp_dir is None else os.path.join(temp_dir, 'raw_' + file_id + '.txt')
+        start = time.perf_counter()
+        try:
+            doc = download_10_k(url, user_agent, pool, governor, raw_file_path, cache)
+        except Exception as e:
+            failures.append((url, f'download error: {e!r}'))
+            return
+        if doc is None:
+            failures.append((url, 'no 10-K document found in submission'))
+            return
+        stats['download'].add(time.perf_counter() - start, len(doc))
+        METRICS.observe('filing_downloads', url, time.perf_counter() - start)
+        doc_queue.put((row, file_id, doc))
+
+    def produce():
+        try:
+            with ThreadPoolExecutor(max_workers=download_workers) as download_executor:
+                futures = {download_executor.submit(download, row): row.form10KUrls for ind, row in url_df.iterrows()}
+            # download records the errors it expects, anything else it raised would be lost with its future
+            for future, url in futures.items():
+                if future.exception() is not None:
+                    failures.append((url, f'download error: {future.exception()!r}'))
+        finally:
+            doc_queue.put(done)
+
+    def write():
+        count = 0
+        while True:
+            item = write_queue.get()
+            if item is done:
+                return
+            row, file_id, future, doc_bytes = item
+            count += 1
             try:
-                load_parse_save(raw_file_path, output_file_path, row.cik, row.cusip6, row.form10KUrls, toList(row.cusip), toList(row.names))
-                os.remove(raw_file_path)
+                sections, parse_seconds, parse_metrics = future.result()
+                stats['parse'].add(parse_seconds, doc_bytes)
+                METRICS.merge(parse_metrics)
+                METRICS.observe('filing_parses', row.form10KUrls, parse_seconds)
+                start = time.perf_counter()
+                output_file_path = os.path.join(output_dir, file_id + '.json')
+                save_sections(sections, output_file_path, row.cik, row.cusip6, row.form10KUrls,
+                              toList(row.cusip), toList(row.names))
+                stats['write'].add(time.perf_counter() - start, os.path.getsize(output_file_path))
             except Exception as e:
-                print(e)
-    return 0
+                failures.append((row.form10KUrls, f'parse error: {e!r}'))
+            finally:
+                in_flight.release()
+            print(f'--- Finished {count:,} of {total:,} 10K filings for {toList(row.names)}')
+
+    wall_start = time.perf_counter()
+    producer = threading.Thread(target=produce, daemon=True)
+    writer = threading.Thread(target=write, daemon=True)
+    producer.start()
+    writer.start()
+    # Spawn rather than fork the parse workers since the download and writer threads are already running
+    try:
+        with ProcessPoolExecutor(max_workers=parse_workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as parse_executor:
+            while True:
+                item = doc_queue.get()
+                if item is done:
+                    break
+                row, file_id, doc = item
+                in_flight.acquire()
+                try:
+                    future = parse_executor.submit(parse_sections, doc, text_engine, items)
+                except BrokenProcessPool as e:
+                    # A parse worker died, e.g. killed for running out of memory. Keep taking documents so the
+                    # downloads finish, and fail each one rather than leave the download threads blocked on the queue
+                    in_flight.release()
+                    failures.append((row.form10KUrls, f'parse error: {e!r}'))
+                    continue
+                # Hand the future to the writer right away, it waits on each one in submission order
+                write_queue.put((row, file_id, future, len(doc)))
+    finally:
+        write_queue.put(done)
+    producer.join()
+    writer.join()
+    wall_seconds = time.perf_counter() - wall_start
+    print(f'=== Pipeline finished in {wall_seconds:,.1f}s ===')
+    for stage in stats.values():
+        print(stage.report(wall_seconds))
+    return failures
 
 
 def stripSingleQuotesAndSpaces(s: str) -> str:
@@ -61,7 +285,9 @@ def parse_args():
         description='download 10k filings and pull text from sections 1,1A, 7, and 7A from 10-ks and save as json',
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-t', '--temp-directory', required=False, default='data/temp-10k',
-                        help='Directory to temporarily store raw SEC 10K files')
+                        help='Directory to store raw SEC 10K files when --keep-raw is set')
+    parser.add_argument('-k', '--keep-raw', action='store_true',
+                        help='Also save each full raw submission to the temp directory while streaming it')
     parser.add_argument('-o', '--output-directory', required=False, default='data/form10k-clean',
                         help='Local path to write formatted text to')
     parser.add_argument('-un', '--user-name', default='Neo4j',
@@ -70,31 +296,225 @@ def parse_args():
                         help='Email address to use for user agent in SEC EDGAR calls')
     parser.add_argument('-i', '--input-file', required=False, default='data/cik-10k-urls.csv',
                         help='Formatted File with 10K Urls and ciks')
+    parser.add_argument('-c', '--cache-directory', default=DEFAULT_CACHE_DIRECTORY,
+                        help='Directory of the compressed EDGAR filing cache shared by the downloaders')
+    parser.add_argument('-cg', '--cache-max-gb', type=float, default=20,
+                        help='Size limit of the filing cache, least recently used filings are evicted past it')
+    parser.add_argument('-nc', '--no-cache', action='store_true',
+                        help='Always download filings from EDGAR and do not cache them')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Number of concurrent download workers')
+    parser.add_argument('-te', '--text-engine', choices=list(TEXT_ENGINES), default=DEFAULT_TEXT_ENGINE,
+                        help='HTML to text engine, lxml parse events (fast) or a full BeautifulSoup tree')
+    parser.add_argument('-it', '--items', nargs='+', choices=SECTION_ITEMS, default=DEFAULT_SECTION_ITEMS,
+                        metavar='ITEM', help='10K items to extract, any of item1 to item16, e.g. item1 item1a '
+                                             'item2 item7 item7a item8')
+    parser.add_argument('-p', '--pipeline', action='store_true',
+                        help='Overlap downloading with parsing in a pool of parse processes')
+    parser.add_argument('-pw', '--parse-workers', type=int, default=os.cpu_count(),
+                        help='Number of parse processes in pipeline mode')
+    parser.add_argument('-q', '--queue-size', type=int, default=16,
+                        help='Max downloaded 10-K documents waiting to be parsed in pipeline mode')
+    add_url_arguments(parser)
+    add_rate_arguments(parser)
+    add_metrics_arguments(parser)
     args = parser.parse_args()
     return args
 
 
-def download_filing(url: str, user_agent: str, temp_dir: str) -> tuple:
-    conn = http.client.HTTPSConnection('www.sec.gov')
-    conn.request('GET', url, headers={'User-Agent': user_agent})
-    response = conn.getresponse()
-    data = response.read()
-    conn.close()
+class ConnectionPool:
+    """Keeps one keep-alive HTTPS connection per worker thread so connections are reused across filings."""
 
-    if response.status == 200 and response.reason == 'OK':
-        text = data.decode('utf-8')
-        file = io.StringIO(text)
-        contents = file.read()
-        file.close()
-        file_id = url[url.rindex('/') + 1:url.rindex('.')]
-        file_path = os.path.join(temp_dir, 'raw_' + file_id + '.txt')
-        with open(file_path, 'w') as file:
-            file.write(contents)
-        return file_path, file_id
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.conns = []
+
+    def get(self) -> http.client.HTTPSConnection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = connect(self.base_url)
+            self.local.conn = conn
+            with self.lock:
+                self.conns.append(conn)
+        return conn
+
+    def reset(self):
+        # Drop this thread's connection, e.g. after the server closed it
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+            with self.lock:
+                self.conns.remove(conn)
+
+    def close_all(self):
+        with self.lock:
+            for conn in self.conns:
+                conn.close()
+            self.conns = []
+
+
+@timed('http_request')
+def open_filing(url: str, user_agent: str, pool: ConnectionPool = None,
+                governor: RateGovernor = None) -> Tuple[http.client.HTTPSConnection, http.client.HTTPResponse]:
+    # Send the request and return the response unread so the body can be streamed. Responses refused with 429 or
+    # 503 are retried once the governor has backed off
+    attempt = 0
+    while True:
+        if governor is not None:
+            governor.acquire()
+        conn, response = send_request(url, user_agent, pool)
+        if governor is None:
+            return conn, response
+        if not governor.throttled(response.status, response.getheader('Retry-After')) or attempt >= governor.retries:
+            return conn, response
+        release_filing(conn, response, pool)
+        attempt += 1
+        METRICS.count('retries')
+
+
+def send_request(url: str, user_agent: str,
+                 pool: ConnectionPool = None) -> Tuple[http.client.HTTPSConnection, http.client.HTTPResponse]:
+    if pool is None:
+        conn = connect(url)
+        conn.request('GET', request_target(url), headers={'User-Agent': user_agent})
+        return conn, conn.getresponse()
+    # A pooled connection may have been closed by the server while idle, so retry once on a fresh one
+    for attempt in range(2):
+        conn = pool.get()
+        try:
+            conn.request('GET', request_target(url), headers={'User-Agent': user_agent, 'Connection': 'keep-alive'})
+            return conn, conn.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            pool.reset()
+            if attempt > 0:
+                raise
+
+
+def release_filing(conn: http.client.HTTPSConnection, response: http.client.HTTPResponse, pool: ConnectionPool = None):
+    # Hand the connection back for reuse. A partly read body is drained if small, otherwise the connection is
+    # dropped since reconnecting is cheaper than downloading exhibits we don't need
+    if pool is None:
+        conn.close()
+    elif not response.isclosed() and (response.length is None or response.length > DRAIN_LIMIT_BYTES):
+        pool.reset()
     else:
-        print('Download failed for form13 file.')
-        print(response.status, response.reason)
-        return '', ''
+        response.read()
+        if response.will_close:
+            pool.reset()
+
+
+def download_10_k(url: str, user_agent: str, pool: ConnectionPool = None, governor: RateGovernor = None,
+                  raw_file_path: str = None, cache: FilingCache = None) -> Optional[str]:
+    with contextlib.ExitStack() as stack:
+        sinks = []
+        if raw_file_path is not None:
+            sinks.append(stack.enter_context(open(raw_file_path, 'wb')))
+        key = cache_key(url)
+        cached = None if cache is None else cache.open(key)
+        if cached is not None:
+            METRICS.count('cache_hits')
+            reader = CountingReader(cached)
+            try:
+                with cached:
+                    return stream_10_k(reader, sinks)
+            finally:
+                METRICS.count('cache_bytes_read', reader.bytes)
+        conn, response = open_filing(url, user_agent, pool, governor)
+        reader = CountingReader(response)
+        try:
+            if response.status != 200:
+                raise http.client.HTTPException(f'Download failed for 10K file: {response.status} {response.reason}')
+            writer = None
+            if cache is not None:
+                # Submissions are immutable, so the full body is cached as it streams past
+                writer = stack.enter_context(cache.writer(key, response.getheader('ETag')))
+                sinks.append(writer)
+            doc = stream_10_k(reader, sinks)
+            if (sinks or doc is None) and response.length:
+                # The body was read to its end, but a connection dropped part way through reads as an early end of
+                # file rather than raising. Raising discards the cache entry so the next run downloads it again
+                raise http.client.IncompleteRead(b'', response.length)
+            if doc is None and writer is not None:
+                writer.abort()
+            return doc
+        finally:
+            METRICS.count('bytes_downloaded', reader.bytes)
+            release_filing(conn, response, pool)
+
+
+class CountingReader:
+    """Counts the bytes read through a binary stream, totalled locally so reading stays lock free."""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.bytes = 0
+
+    def readline(self, size: int = -1) -> bytes:
+        line = self.stream.readline(size)
+        self.bytes += len(line)
+        return line
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.bytes += len(data)
+        return data
+
+
+@timed()
+def stream_10_k(stream: BinaryIO, sinks: List[BinaryIO] = (), chunk_size: int = STREAM_CHUNK_BYTES) -> Optional[str]:
+    """
+    Scan an EDGAR submission incrementally and return only the primary 10-K document, equivalent to
+    `extract_10_k(stream.read())`. Exhibits, graphics and other attachments are skipped as they stream past, so
+    memory is bounded by the size of the 10-K document rather than the whole submission. If `sinks` are given every
+    chunk read is also written to them and the stream is consumed to the end.
+    """
+    # EDGAR writes the <DOCUMENT>, <TYPE> and </DOCUMENT> tags at the start of their own lines, so they are only
+    # looked for at line starts, where a read of at least MIN_CHUNK_BYTES can never split them
+    chunk_size = max(chunk_size, MIN_CHUNK_BYTES)
+    doc_parts = []
+    in_doc = False
+    doc_type = None
+    at_line_start = True
+    while True:
+        # Read at most chunk_size bytes at a time so very long lines (e.g. uuencoded binaries) stay bounded
+        line = stream.readline(chunk_size)
+        if not line:
+            break
+        for sink in sinks:
+            sink.write(line)
+        line_start = at_line_start
+        at_line_start = line.endswith(b'\n')
+        if not line_start:
+            if in_doc and doc_type in (None, b'10-K'):
+                doc_parts.append(line)
+            continue
+        if not in_doc:
+            if line.startswith(b'<DOCUMENT>'):
+                in_doc = True
+                doc_type = None
+                doc_parts = [line[len(b'<DOCUMENT>'):]]
+            continue
+        if line.startswith(b'</DOCUMENT>'):
+            in_doc = False
+            if doc_type == b'10-K':
+                if sinks:
+                    for rest in iter(lambda: stream.read(chunk_size), b''):
+                        for sink in sinks:
+                            sink.write(rest)
+                return b''.join(doc_parts).decode('utf-8')
+            doc_parts = []
+            continue
+        if doc_type is None and line.startswith(b'<TYPE>'):
+            doc_type = line[len(b'<TYPE>'):].strip()
+            if doc_type != b'10-K':
+                # Not the 10-K, discard what was buffered before the type was known
+                doc_parts = []
+        if doc_type in (None, b'10-K'):
+            doc_parts.append(line)
+    return None
 
 
 def extract_10_k(txt: str) -> str:
@@ -124,52 +544,154 @@ def extract_10_k(txt: str) -> str:
 
 
 # Extract text using position dataframe and beautiful soup
-def beautify_text(txt: str) -> str:
+def bs4_text(txt: str) -> str:
     stg_txt = BeautifulSoup(txt, 'lxml')
     return stg_txt.get_text('\n')
 
 
-def extract_text(row: pd.Series, txt: str):
-    section_txt = txt[row.start:row.sectionEnd].replace('Error! Bookmark not defined.', '')
-    return beautify_text(section_txt)
-
-
-def extract_section_text(doc: str) -> Dict[str, str]:
-    # Write the regex
-    regex = re.compile(r'(>(Item|ITEM)(\s|&#160;|&nbsp;)(1A|1B|1\.|7A|7|8)\.{0,1})|(ITEM\s(1A|1B|1\.|7A|7|8))')
-    # Use finditer to math the regex
-    matches = regex.finditer(doc)
-    # Write a for loop to print the matches
-    # Create the dataframe
-    item_df = pd.DataFrame([(x.group(), x.start(), x.end()) for x in matches])
-    item_df.columns = ['item', 'start', 'end']
-    item_df['item'] = item_df.item.str.lower()
-
-    item_df.replace('&#160;', ' ', regex=True, inplace=True)
-    item_df.replace('&nbsp;', ' ', regex=True, inplace=True)
-    item_df.replace(' ', '', regex=True, inplace=True)
-    item_df.replace('\.', '', regex=True, inplace=True)
-    item_df.replace('>', '', regex=True, inplace=True)
-
-    all_pos_df = item_df.sort_values('start', ascending=True).drop_duplicates(subset=['item'], keep='last').set_index(
-        'item')
-    # Add section end using start of next section
-    all_pos_df['sectionEnd'] = all_pos_df.start.iloc[1:].tolist() + [len(doc)]
-    # filter to just the sections we care about
-    pos_df = all_pos_df.loc[['item1', 'item1a', 'item7', 'item7a'], :]
+class TextCollector:
+    """
+    lxml parser target that collects text as it streams past, without building a tree. Mirrors how BeautifulSoup
+    groups and filters strings so that joining them gives the same result as `get_text`: adjacent data is merged
+    until the next tag or comment, whitespace-only strings collapse to a single space or newline outside <pre> and
+    <textarea>, and script, style, template and ruby annotation contents are dropped.
+    """
+    ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+    SKIP_TAGS = {'script', 'style', 'template', 'rt', 'rp'}
+    PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+
+    def __init__(self):
+        self.strings = []
+        self.pending = []
+        self.skip_depth = 0
+        self.preserve_depth = 0
+
+    def flush(self):
+        if self.pending:
+            text = ''.join(self.pending)
+            self.pending = []
+            if self.skip_depth > 0:
+                return
+            if self.preserve_depth == 0 and not text.strip(self.ASCII_SPACES):
+                text = '\n' if '\n' in text else ' '
+            self.strings.append(text)
+
+    def start(self, tag, attrib):
+        self.flush()
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        if tag in self.PRESERVE_WHITESPACE_TAGS:
+            self.preserve_depth += 1
+
+    def end(self, tag):
+        self.flush()
+        if tag in self.SKIP_TAGS:
+            self.skip_depth -= 1
+        if tag in self.PRESERVE_WHITESPACE_TAGS:
+            self.preserve_depth -= 1
+
+    def data(self, data):
+        self.pending.append(data)
+
+    def comment(self, text):
+        self.flush()
+
+    def pi(self, target, data=None):
+        self.flush()
+
+    def doctype(self, *args):
+        self.flush()
+
+    def close(self) -> List[str]:
+        self.flush()
+        return self.strings
+
+
+# Extract text with lxml parse events. Same text as bs4_text, entities such as &#160; and &nbsp; included, but
+# several times faster on iXBRL since no tree is built
+def lxml_text(txt: str) -> str:
+    parser = etree.HTMLParser(target=TextCollector(), recover=True)
+    parser.feed(txt)
+    return '\n'.join(parser.close())
+
+
+TEXT_ENGINES = {
+    'lxml': lxml_text,
+    'bs4': bs4_text,
+}
+
+
+@timed()
+def beautify_text(txt: str, text_engine: str = DEFAULT_TEXT_ENGINE) -> str:
+    return TEXT_ENGINES[text_engine](txt)
+
+
+def extract_text(txt: str, start: int, end: int, text_engine: str = DEFAULT_TEXT_ENGINE):
+    section_txt = txt[start:end].replace('Error! Bookmark not defined.', '')
+    return beautify_text(section_txt, text_engine)
+
+
+@functools.lru_cache()
+def section_regex(item_numbers: Tuple[str, ...]) -> re.Pattern:
+    # Longer numbers first so e.g. 7A is matched before 7. Item 1 needs its trailing dot to not match Items 10-16
+    alternatives = '|'.join(ITEM_NUMBER_PATTERNS.get(x, re.escape(x))
+                            for x in sorted(item_numbers, key=lambda x: (-len(x), x)))
+    return re.compile(rf'(>(Item|ITEM)(\s|&#160;|&nbsp;)({alternatives})\.{{0,1}})|(ITEM\s({alternatives}))')
+
+
+def normalize_item_label(match: str) -> str:
+    # e.g. '>Item&#160;1A.' -> 'item1a'
+    label = match.lower()
+    for token in ['&#160;', '&nbsp;', ' ', '.', '>']:
+        label = label.replace(token, '')
+    return label
+
+
+@timed()
+def index_sections(doc: str, items: List[str] = DEFAULT_SECTION_ITEMS) -> List[Tuple[str, int, int]]:
+    """
+    Find every Item heading in one scan of `doc` and return (item, start, end) offsets, in document order, for the
+    last occurrence of each of the requested `items`, which skips past the table of contents. Each section ends
+    where the next heading of any item in SECTION_ITEMS starts.
+    """
+    last_starts = dict()
+    for match in section_regex(tuple(x[len('item'):].upper() for x in SECTION_ITEMS)).finditer(doc):
+        last_starts[normalize_item_label(match.group())] = match.start()
+    positions = sorted((start, item) for item, start in last_starts.items())
+    ends = [start for start, item in positions[1:]] + [len(doc)]
+    return [(item, start, end) for (start, item), end in zip(positions, ends) if item in items]
+
+
+def extract_section_text(doc: str, text_engine: str = DEFAULT_TEXT_ENGINE,
+                         items: List[str] = DEFAULT_SECTION_ITEMS) -> Dict[str, str]:
+    offsets = {item: (start, end) for item, start, end in index_sections(doc, items)}
     res = dict()
-    for i, row in pos_df.iterrows():
-        res[i] = extract_text(row, doc)
+    for item in items:
+        if item in offsets:
+            res[item] = extract_text(doc, *offsets[item], text_engine)
+        else:
+            # Keep the rest of the filing, an absent section is left empty
+            print(f'No {item} section found')
+            res[item] = ''
     return res
 
 
 def load_parse_save(input_file_path: str, output_file_path: str, cik: str, cusip6: str, url: str, cusip:List[str], names: List[str]):
-    with open(input_file_path, 'r') as file:
-        raw_txt = file.read()
-    print('Extracting 10-K')
-    doc = extract_10_k(raw_txt)
+    with open(input_file_path, 'rb') as file:
+        print('Extracting 10-K')
+        doc = stream_10_k(file)
+    parse_save(doc, output_file_path, cik, cusip6, url, cusip, names)
+
+
+def parse_save(doc: str, output_file_path: str, cik: str, cusip6: str, url: str, cusip: List[str], names: List[str],
+               text_engine: str = DEFAULT_TEXT_ENGINE, items: List[str] = DEFAULT_SECTION_ITEMS):
     print('Parsing relevant sections')
-    cleaned_json_txt = extract_section_text(doc)
+    save_sections(extract_section_text(doc, text_engine, items), output_file_path, cik, cusip6, url, cusip, names)
+
+
+@timed()
+def save_sections(cleaned_json_txt: Dict[str, str], output_file_path: str, cik: str, cusip6: str, url: str,
+                  cusip: List[str], names: List[str]):
     cleaned_json_txt['cik'] = cik
     cleaned_json_txt['cusip6'] = cusip6
     cleaned_json_txt['cusip'] = cusip
@@ -178,6 +700,7 @@ def load_parse_save(input_file_path: str, output_file_path: str, cik: str, cusip
     print('Writing clean text to json')
     with open(output_file_path, 'w') as json_file:
         json.dump(cleaned_json_txt, json_file, indent=4)
+    METRICS.count('bytes_written', os.path.getsize(output_file_path))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,109 @@
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from embedding_cache import (DEFAULT_BATCH_SIZE, DEFAULT_CACHE_PATH, DEFAULT_DIMENSIONS, DEFAULT_MAX_IN_FLIGHT,
+                             EmbeddingCache, Embedder, make_provider)
+from embedding_store import StoreWriter
+from metrics import METRICS, add_metrics_arguments, path_bytes, run_with_metrics
+
+
+def main() -> int:
+    args = parse_args()
+    return run_with_metrics('f10k-embed', args, run, args)
+
+
+def run(args) -> int:
+    file_names = sorted(x for x in os.listdir(args.input_directory) if x.endswith('.jsonl'))
+    os.makedirs(args.output_directory, exist_ok=True)
+    provider = make_provider(args.provider, args.model, args.dimensions)
+    cache = None if args.no_cache else EmbeddingCache(args.cache_path)
+    embedder = Embedder(provider, cache, args.batch_size, args.max_in_flight)
+    print(f'=== Embedding {len(file_names):,} chunk shards with {provider.model} ===')
+
+    start = time.perf_counter()
+    store = None
+    if args.output_format == 'npy':
+        store = StoreWriter(args.output_directory, sum(count_chunks(os.path.join(args.input_directory, x))
+                                                       for x in file_names))
+    chunk_count = 0
+    for i, file_name in enumerate(file_names, 1):
+        chunks = read_chunks(os.path.join(args.input_directory, file_name))
+        embeddings = embedder.embed([chunk['text'] for chunk in chunks])
+        if store is not None:
+            store.write([chunk['chunkId'] for chunk in chunks], embeddings)
+        else:
+            write_embeddings(os.path.join(args.output_directory, file_name.replace('chunks-', 'embeddings-')),
+                             chunks, embeddings)
+        chunk_count += len(chunks)
+        print(f'--- Embedded {i:,} of {len(file_names):,} shards, {chunk_count:,} chunks, '
+              f'{embedder.hits:,} cached, {embedder.misses:,} sent in {embedder.requests:,} requests')
+    if store is not None:
+        store.close()
+    if cache is not None:
+        cache.close()
+    METRICS.count('cache_hits', embedder.hits)
+    METRICS.count('embedding_requests', embedder.requests)
+    METRICS.count('bytes_written', path_bytes(args.output_directory))
+
+    seconds = time.perf_counter() - start
+    print(f'=== Embedded {chunk_count:,} chunks in {seconds:,.1f}s ({chunk_count / max(seconds, 1e-9):,.0f} chunks/s), '
+          f'{embedder.hits:,} from the cache ===')
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='embed 10k chunks through a persistent cache, sending only new texts to the embedding model',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--input-directory', required=False, default='data/form10k-chunks',
+                        help='Directory of chunk jsonl shards from f10k-chunk.py')
+    parser.add_argument('-o', '--output-directory', required=False, default='data/form10k-embeddings',
+                        help='Directory to write the embedding store, or the jsonl shards, to')
+    parser.add_argument('-f', '--output-format', required=False, choices=['npy', 'jsonl'], default='npy',
+                        help='npy writes an embedding store of one float32 matrix and its chunk ids, jsonl writes '
+                             'embeddings-NNNNN.jsonl shards of chunkId and textEmbedding')
+    parser.add_argument('-p', '--provider', required=False, choices=['openai', 'hash'], default='openai',
+                        help='openai embeds through langchain\'s OpenAIEmbeddings like the notebooks, hash is a '
+                             'deterministic local stand-in for testing and benchmarking offline')
+    parser.add_argument('-m', '--model', required=False,
+                        help='Embedding model name passed to the provider, its default model if not given')
+    parser.add_argument('-d', '--dimensions', required=False, type=int, default=DEFAULT_DIMENSIONS,
+                        help='Vector length of the hash provider')
+    parser.add_argument('-c', '--cache-path', required=False, default=DEFAULT_CACHE_PATH,
+                        help='sqlite file of cached embeddings, keyed by a hash of the model and text')
+    parser.add_argument('-nc', '--no-cache', action='store_true',
+                        help='Embed every chunk and do not cache the embeddings')
+    parser.add_argument('-bs', '--batch-size', required=False, type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Number of texts sent per embedding request')
+    parser.add_argument('-w', '--max-in-flight', required=False, type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help='Maximum number of concurrent embedding requests')
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+
+def read_chunks(path: str) -> List[Dict]:
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def count_chunks(path: str) -> int:
+    with open(path) as file:
+        return sum(1 for line in file if line.strip())
+
+
+def write_embeddings(path: str, chunks: List[Dict], embeddings):
+    # Records as staged for db.create.setNodeVectorProperty in the notebooks
+    with open(path + '.part', 'w', encoding='utf-8') as file:
+        for chunk, embedding in zip(chunks, embeddings):
+            file.write(json.dumps({'chunkId': chunk['chunkId'], 'textEmbedding': embedding.tolist()}) + '\n')
+    os.replace(path + '.part', path)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,18 +1,29 @@
 import argparse
 import http.client
 import json
+import os
+import sys
+import zipfile
 from pathlib import Path
 from time import sleep
-from typing import Dict, List
+from typing import Dict, List, Optional
 import datetime
 import pandas as pd
 from pandas import DataFrame
 
-BASE_URL = 'https://www.sec.gov'
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from edgar_cache import DEFAULT_CACHE_DIRECTORY, FilingCache, cache_key
+from edgar_rate import RateGovernor, add_rate_arguments, governor_from_args
+from edgar_urls import DEFAULT_DATA_URL, DEFAULT_EDGAR_URL, add_url_arguments, connect, request_target
+from metrics import METRICS, RETRY_EXIT_CODE, add_metrics_arguments, run_with_metrics
 
 
 def main() -> int:
     args = parse_args()
+    return run_with_metrics('f10k-get-urls', args, run, args)
+
+
+def run(args) -> int:
     start_date = datetime.datetime.strptime(args.start_date, '%Y-%m-%d').date()
     end_date = datetime.datetime.strptime(args.end_date, '%Y-%m-%d').date()
     user_email = args.user_email
@@ -26,22 +37,49 @@ def main() -> int:
 
     print(f'Found {cik_df.shape[0]:,} companies to pull filings for')
 
+    if args.submissions_zip is not None:
+        print(f'Reading filing histories from {args.submissions_zip}')
+        accessors = get_filing_accessors_from_zip(args.submissions_zip, cik_df.cik.tolist(), start_date, end_date)
+        cik_df['form10KUrls'] = [[format_url(cik, f, args.edgar_url) for f in accessors.get(cik, [])]
+                                 for cik in cik_df.cik]
+        write_urls(cik_df, output_file, output_dir)
+        return 0
+
     urls_list = []
+    failed_ciks = []
 
     counter = 0
-    conn = http.client.HTTPSConnection('www.sec.gov')
+    cache = None if args.no_cache else FilingCache(args.cache_directory, int(args.cache_max_gb * 1024 ** 3))
+    cache_max_age_seconds = args.cache_max_age_hours * 3600
+    conn = connect(args.data_url)
+    governor = governor_from_args(args, args.data_url)
     for ind, row in cik_df.iterrows():
         counter += 1
         print(f'pulling 10k urls for cik: {row.cik}, {counter} of {cik_df.shape[0]} ciks')
-        urls = get_urls(conn, row.cik, start_date, end_date, f'{user_name} {user_email}')
+        urls = get_urls(conn, row.cik, start_date, end_date, f'{user_name} {user_email}', cache, cache_max_age_seconds,
+                        args.edgar_url, args.data_url, governor)
+        if urls is None:
+            failed_ciks.append(row.cik)
+            urls = []
         print(f'{row.cik}: {urls}')
         urls_list.append(urls)
     conn.close()
+    governor.close()
+    if cache is not None:
+        cache.close()
     cik_df['form10KUrls'] = urls_list
+    write_urls(cik_df, output_file, output_dir)
+    print(f'===== Had {len(failed_ciks)} failed filing history downloads ====')
+    for cik in failed_ciks:
+        print(cik)
+    # So run-pipeline.py runs the stage again rather than treating its output as current
+    return RETRY_EXIT_CODE if failed_ciks else 0
+
+
+def write_urls(cik_df: DataFrame, output_file: str, output_dir: str):
     urls_df = cik_df[cik_df.form10KUrls.map(len) > 0].explode(column='form10KUrls')
     Path(output_dir).mkdir(parents=True, exist_ok=True)
-    urls_df.to_csv(args.output_file, index=False)
-    return 0
+    urls_df.to_csv(output_file, index=False)
 
 
 def parse_args():
@@ -58,18 +96,43 @@ def parse_args():
                         help='Name to use for user agent in SEC EDGAR calls')
     parser.add_argument('-ue', '--user-email', default='sales@neo4j.com',
                         help='Email address to use for user agent in SEC EDGAR calls')
+    parser.add_argument('-z', '--submissions-zip', required=False,
+                        help='Local copy of the SEC nightly bulk submissions.zip to read filing histories from '
+                             'instead of calling the submissions API once per cik')
+    parser.add_argument('-c', '--cache-directory', default=DEFAULT_CACHE_DIRECTORY,
+                        help='Directory of the compressed EDGAR filing cache shared by the downloaders')
+    parser.add_argument('-cg', '--cache-max-gb', type=float, default=20,
+                        help='Size limit of the filing cache, least recently used filings are evicted past it')
+    parser.add_argument('-ca', '--cache-max-age-hours', type=float, default=24,
+                        help='Re-download cached filing histories older than this, since they change as companies file')
+    parser.add_argument('-nc', '--no-cache', action='store_true',
+                        help='Always download filing histories from EDGAR and do not cache them')
+    add_url_arguments(parser, data_url=True)
+    add_rate_arguments(parser)
+    add_metrics_arguments(parser)
     args = parser.parse_args()
     return args
 
 
-def get_urls(conn: http.client.HTTPSConnection, cik: str, start_date: datetime.date, end_date: datetime.date, user_agent: str):
-    filing_accessors = get_filing_accessors(conn, cik, start_date, end_date, user_agent)
-    return [format_url(cik, f) for f in filing_accessors]
+def get_urls(conn: http.client.HTTPSConnection, cik: str, start_date: datetime.date, end_date: datetime.date, user_agent: str,
+             cache: FilingCache = None, cache_max_age_seconds: float = None, base_url: str = DEFAULT_EDGAR_URL,
+             data_url: str = DEFAULT_DATA_URL, governor: RateGovernor = None):
+    filing_accessors = get_filing_accessors(conn, cik, start_date, end_date, user_agent, cache, cache_max_age_seconds,
+                                            data_url, governor)
+    if filing_accessors is None:
+        return None
+    return [format_url(cik, f, base_url) for f in filing_accessors]
 
 
 def get_filing_accessors(conn: http.client.HTTPSConnection, cik: str, start_date: datetime.date,
-                         end_date: datetime.date, user_agent: str) -> List[str]:
-    history = get_filing_history(conn, cik, user_agent, 4)
+                         end_date: datetime.date, user_agent: str, cache: FilingCache = None,
+                         cache_max_age_seconds: float = None, data_url: str = DEFAULT_DATA_URL,
+                         governor: RateGovernor = None) -> Optional[List[str]]:
+    retry_limit = 4 if governor is None else governor.retries
+    history = get_filing_history(conn, cik, user_agent, retry_limit, cache=cache,
+                                 cache_max_age_seconds=cache_max_age_seconds, data_url=data_url, governor=governor)
+    if history is None:
+        return None
     if not history:  # if dict is empty
         return []
     history_df = pd.DataFrame.from_dict(history['filings']['recent'])
@@ -80,27 +143,92 @@ def get_filing_accessors(conn: http.client.HTTPSConnection, cik: str, start_date
     return filtered_df.accessionNumber.tolist()
 
 
-def get_filing_history(conn: http.client.HTTPSConnection, cik: str, user_agent: str, retry_limit: int = 0, retry_sleep_sec: int = 2) -> Dict:
-    url = f'https://data.sec.gov//submissions/CIK{int(cik):010d}.json'
+def get_filing_history(conn: http.client.HTTPSConnection, cik: str, user_agent: str, retry_limit: int = 0, retry_sleep_sec: int = 2,
+                       cache: FilingCache = None, cache_max_age_seconds: float = None,
+                       data_url: str = DEFAULT_DATA_URL, governor: RateGovernor = None) -> Optional[Dict]:
+    url = f'{data_url}/submissions/CIK{int(cik):010d}.json'
+    key = cache_key(url)
+    if cache is not None:
+        cached = cache.get(key, cache_max_age_seconds)
+        if cached is not None:
+            print(f'Using cached filing history for cik: {cik}')
+            METRICS.count('cache_hits')
+            return json.loads(cached.decode('utf-8'))
     print(f'Downloading filing history for cik: {cik}')
+    throttled = False
     for i in range(retry_limit + 1):
         if i > 0:
             print('Retrying...')
-            sleep(retry_sleep_sec)
-        conn.request('GET', url, headers={'User-Agent': user_agent})
-        response = conn.getresponse()
+            METRICS.count('retries')
+            if not throttled:
+                # Throttled requests are instead held back by the governor until the server accepts them again
+                with METRICS.timer('retry_sleep'):
+                    sleep(retry_sleep_sec)
+        with METRICS.timer('http_request'):
+            if governor is not None:
+                governor.acquire()
+            try:
+                conn.request('GET', request_target(url), headers={'User-Agent': user_agent})
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                # e.g. a body cut short or a dropped keep-alive connection. A closed connection reconnects on the
+                # next request
+                print(f'Download failed for cik: {cik} filings: {e!r}')
+                conn.close()
+                throttled = False
+                continue
         print(response.status, response.reason)
-        data = response.read()
+        METRICS.count('bytes_downloaded', len(data))
+        throttled = governor is not None and governor.throttled(response.status, response.getheader('Retry-After'))
+        if response.status == 404:
+            # No submissions for this cik, e.g. a wrong one in the mapping file. Retrying won't change that
+            print(f'No filings found for cik: {cik}')
+            return dict()
         if response.status == 200 and response.reason == 'OK':
+            if cache is not None:
+                cache.put(key, data, response.getheader('ETag'))
             res = data.decode('utf-8')
             return json.loads(res)
         else:
             print(f'Download failed for cik: {cik} filings.')
-    return dict()
-
-
-def format_url(cik: str, filing_accessor: str):
-    return BASE_URL + f'/Archives/edgar/data/{int(cik)}/{filing_accessor.replace("-", "")}/{filing_accessor}.txt'
+    # None rather than an empty history, so the cik is reported as failed instead of having no 10Ks
+    return None
+
+
+def get_filing_accessors_from_zip(zip_path: str, ciks: List[str], start_date: datetime.date,
+                                  end_date: datetime.date) -> Dict[str, List[str]]:
+    """
+    Read 10-K accession numbers for `ciks` from the bulk submissions.zip, newest first, keyed by cik. Each cik has a
+    CIK##########.json member with its latest filings under filings.recent and, for long histories, older filings in
+    CIK##########-submissions-###.json members, so both are read. Members are streamed one at a time and only 10-K
+    rows are kept, then the date range is filtered across all ciks at once.
+    """
+    wanted = {f'CIK{int(cik):010d}': cik for cik in ciks}
+    columns = {'cik': [], 'accessionNumber': [], 'filingDate': []}
+    with zipfile.ZipFile(zip_path) as zip_file:
+        for name in zip_file.namelist():
+            cik = wanted.get(name[:len('CIK0000000000')])
+            if cik is None:
+                continue
+            with zip_file.open(name) as member:
+                submissions = json.load(member)
+            filings = submissions['filings']['recent'] if 'filings' in submissions else submissions
+            for form, accession, filing_date in zip(filings['form'], filings['accessionNumber'], filings['filingDate']):
+                if form == '10-K':
+                    columns['cik'].append(cik)
+                    columns['accessionNumber'].append(accession)
+                    columns['filingDate'].append(filing_date)
+    filings_df = pd.DataFrame(columns)
+    filings_df['filingDate'] = pd.to_datetime(filings_df.filingDate)
+    filtered_df = filings_df[(filings_df.filingDate <= pd.Timestamp(end_date)) &
+                             (filings_df.filingDate >= pd.Timestamp(start_date))]
+    filtered_df = filtered_df.sort_values(['cik', 'filingDate'], ascending=[True, False])
+    return filtered_df.groupby('cik').accessionNumber.agg(list).to_dict()
+
+
+def format_url(cik: str, filing_accessor: str, base_url: str = DEFAULT_EDGAR_URL):
+    return base_url + f'/Archives/edgar/data/{int(cik)}/{filing_accessor.replace("-", "")}/{filing_accessor}.txt'
 
 
 def get_cik_df(formatted_data_path: str) -> DataFrame:
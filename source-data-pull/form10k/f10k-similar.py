@@ -0,0 +1,59 @@
+import argparse
+import csv
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from embedding_store import DEFAULT_SEARCH_BATCH_SIZE, EmbeddingStore
+from metrics import METRICS, add_metrics_arguments, path_bytes, run_with_metrics
+
+# Same typed header style as neo4j-bulk-export.py, so the file can be passed as --relationships=SIMILAR_TO=...
+SIMILAR_TO_HEADER = [':START_ID(Chunk)', ':END_ID(Chunk)', 'score:double']
+
+
+def main() -> int:
+    args = parse_args()
+    return run_with_metrics('f10k-similar', args, run, args)
+
+
+def run(args) -> int:
+    store = EmbeddingStore(args.embedding_directory)
+    print(f'=== Finding the {args.top_k} most similar chunks of {len(store):,} chunks ({store.dimensions} dims) ===')
+    start = time.perf_counter()
+    count = 0
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(SIMILAR_TO_HEADER)
+        for source, target, score in store.similar_pairs(args.top_k, args.min_score, args.batch_size):
+            writer.writerow([source, target, f'{score:.6f}'])
+            count += 1
+    METRICS.count('bytes_written', path_bytes(args.output))
+    seconds = time.perf_counter() - start
+    print(f'=== Wrote {count:,} SIMILAR_TO relationships to {args.output} in {seconds:,.1f}s '
+          f'({len(store) / max(seconds, 1e-9):,.0f} chunks/s) ===')
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='precompute SIMILAR_TO relationships between 10k chunks from an embedding store',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-e', '--embedding-directory', required=False, default='data/form10k-embeddings',
+                        help='Embedding store written by f10k-embed.py')
+    parser.add_argument('-o', '--output', required=False, default='data/neo4j-import/similar-to.csv',
+                        help='Relationship csv to write')
+    parser.add_argument('-k', '--top-k', required=False, type=int, default=5,
+                        help='Number of most similar other chunks linked from each chunk')
+    parser.add_argument('-ms', '--min-score', required=False, type=float,
+                        help='Only link chunks with at least this cosine similarity')
+    parser.add_argument('-bs', '--batch-size', required=False, type=int, default=DEFAULT_SEARCH_BATCH_SIZE,
+                        help='Number of chunks compared at a time, bounds memory to batch-size squared scores')
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
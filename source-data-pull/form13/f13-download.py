@@ -5,23 +5,257 @@ import os
 import math
 import csv
 import argparse
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
-from requests_ratelimiter import LimiterSession
+import requests
 
-session = LimiterSession(per_second=10)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from edgar_cache import DEFAULT_CACHE_DIRECTORY, FilingCache, cache_key
+from edgar_rate import RateGovernor, add_rate_arguments, governor_from_args
+from edgar_urls import DEFAULT_EDGAR_URL, add_url_arguments
+from metrics import METRICS, RETRY_EXIT_CODE, add_metrics_arguments, run_with_metrics, timed
+
+session = requests.Session()
+# Set by run() from the --requests-per-second and --rate-state-file arguments
+governor = RateGovernor()
+
+MANIFEST_FILE_NAME = 'manifest.sqlite'
+# EDGAR publishes a day's index some time after the day ends, so an index only counts as missing for good once the
+# day is this far in the past. Until then it is recorded as unpublished and read again on the next run
+PUBLISH_DELAY_DAYS = 3
+# A filing that failed this many times is given up on, like one EDGAR answers with 404
+MAX_FILING_ATTEMPTS = 5
 
 def main() -> int:
     args = parse_args()
+    return run_with_metrics('f13-download', args, run, args)
+
+
+def run(args) -> int:
+    global governor
+    governor = governor_from_args(args, args.edgar_url)
     start_date = datetime.datetime.strptime(args.start_date, '%Y-%m-%d').date()
-    date = datetime.datetime.strptime(args.end_date, '%Y-%m-%d').date()
+    end_date = datetime.datetime.strptime(args.end_date, '%Y-%m-%d').date()
     output_dir = args.output_directory
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
+    cache = None if args.no_cache else FilingCache(args.cache_directory, int(args.cache_max_gb * 1024 ** 3))
+    manifest = DownloadManifest(os.path.join(output_dir, MANIFEST_FILE_NAME))
+    if args.index_mode == 'quarterly':
+        download_quarterly_indexes(start_date, end_date, manifest, args.workers, args.index_directory, cache,
+                                   args.edgar_url)
+    else:
+        download_indexes(business_dates(start_date, end_date), manifest, args.workers, cache, args.edgar_url)
+    download_filings(manifest, output_dir, args.workers, cache, args.edgar_url)
+    print(f'===== Filings by status: {manifest.summary()} ====')
+    failures = manifest.failures()
+    retryable = manifest.retryable()
+    print(f'===== Had {len(failures)} failed downloads, {retryable:,} indexes and filings left to retry ====')
+    for path, error in failures:
+        print(f'{path}: {error}')
+    manifest.close()
+    governor.close()
+    if cache is not None:
+        cache.close()
+    return RETRY_EXIT_CODE if retryable else 0
+
+
+class DownloadManifest:
+    """
+    sqlite record of which daily indexes and 13F filings have been downloaded. An index is only marked done together
+    with the filing paths it lists, and a filing only once its file is fully written, so a crashed or interrupted run
+    resumes exactly where it stopped.
+    """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute('''CREATE TABLE IF NOT EXISTS indexes (
+                name TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                filing_count INTEGER,
+                updated_at REAL NOT NULL)''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS filings (
+                path TEXT PRIMARY KEY,
+                date TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at REAL NOT NULL)''')
+
+    def pending_indexes(self, names: List[str]) -> List[str]:
+        with self.lock:
+            done = {x for x, in self.db.execute("SELECT name FROM indexes WHERE status IN ('done', 'missing')")}
+        return [name for name in names if name not in done]
+
+    def record_index(self, name: str, filings: Optional[List[Tuple[str, str]]], status: str):
+        # filings are (path, date filed) pairs
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO indexes VALUES (?, ?, ?, ?)',
+                            (name, status, None if filings is None else len(filings), now))
+            if filings:
+                self.db.executemany("INSERT OR IGNORE INTO filings (path, date, status, updated_at) "
+                                    "VALUES (?, ?, 'pending', ?)", [(path, date, now) for path, date in filings])
+
+    def pending_filings(self) -> List[str]:
+        # Filings EDGAR does not have, or that failed too often, are final like done ones
+        with self.lock:
+            return [x for x, in self.db.execute("SELECT path FROM filings WHERE status IN ('pending', 'failed') "
+                                                "AND attempts < ? ORDER BY date DESC", (MAX_FILING_ATTEMPTS,))]
+
+    def record_filing(self, path: str, status: str, error: str = None):
+        with self.lock, self.db:
+            self.db.execute('UPDATE filings SET status = ?, error = ?, attempts = attempts + 1, updated_at = ? '
+                            'WHERE path = ?', (status, error, time.time(), path))
+
+    def summary(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.db.execute('SELECT status, count(*) FROM filings GROUP BY status').fetchall())
+
+    def failures(self) -> List[Tuple[str, str]]:
+        with self.lock:
+            index_failures = self.db.execute(
+                "SELECT 'index ' || name, 'download failed' FROM indexes WHERE status = 'failed'").fetchall()
+            return index_failures + self.db.execute(
+                "SELECT path, error || CASE WHEN status = 'missing' THEN ', not retried' "
+                "WHEN attempts >= ? THEN ', gave up after ' || attempts || ' attempts' ELSE '' END "
+                "FROM filings WHERE status IN ('failed', 'missing') ORDER BY date DESC",
+                (MAX_FILING_ATTEMPTS,)).fetchall()
+
+    def retryable(self) -> int:
+        # Failed or not yet published indexes, and filings a later run will try again
+        with self.lock:
+            indexes, = self.db.execute(
+                "SELECT count(*) FROM indexes WHERE status IN ('failed', 'unpublished')").fetchone()
+            filings, = self.db.execute("SELECT count(*) FROM filings WHERE status IN ('pending', 'failed') "
+                                       "AND attempts < ?", (MAX_FILING_ATTEMPTS,)).fetchone()
+        return indexes + filings
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def business_dates(start_date: datetime.date, end_date: datetime.date) -> List[datetime.date]:
+    # Daily indexes are only published for weekdays. Newest first, like the original day by day walk
+    dates = []
+    date = end_date
     while date >= start_date:
-        print(date)
-        download_date(date, output_dir)
+        if date.weekday() < 5:
+            dates.append(date)
         date = date - datetime.timedelta(days=1)
-    return 0
+    return dates
+
+
+def download_indexes(dates: List[datetime.date], manifest: DownloadManifest, workers: int, cache: FilingCache = None,
+                     base_url: str = DEFAULT_EDGAR_URL):
+    names = manifest.pending_indexes([date.isoformat() for date in dates])
+    print(f'=== Downloading {len(names):,} of {len(dates):,} daily indexes with {workers} worker(s) ===')
+
+    def download_index(name: str):
+        date = datetime.date.fromisoformat(name)
+        try:
+            form13_paths = get_form13_urls(date, cache, base_url)
+        except Exception as e:
+            print(f'Download failed for master file {date}: {e!r}')
+            form13_paths = None
+        if form13_paths is None:
+            manifest.record_index(name, None, 'failed')
+        elif len(form13_paths) == 0:
+            # Holidays have no index, but neither do days not yet published
+            manifest.record_index(name, [], 'missing' if published(date) else 'unpublished')
+        else:
+            print('We have ' + str(len(form13_paths)) + ' Form 13 URLs for the date ' + str(date))
+            manifest.record_index(name, [(path, name) for path in form13_paths], 'done')
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(download_index, names))
+
+
+def published(date: datetime.date) -> bool:
+    return date < datetime.date.today() - datetime.timedelta(days=PUBLISH_DELAY_DAYS)
+
+
+def quarters(start_date: datetime.date, end_date: datetime.date) -> List[Tuple[int, int]]:
+    # (year, quarter) pairs covering the date range, newest first
+    res = []
+    year, quarter = end_date.year, math.ceil(end_date.month / 3)
+    while (year, quarter) >= (start_date.year, math.ceil(start_date.month / 3)):
+        res.append((year, quarter))
+        year, quarter = (year, quarter - 1) if quarter > 1 else (year - 1, 4)
+    return res
+
+
+def download_quarterly_indexes(start_date: datetime.date, end_date: datetime.date, manifest: DownloadManifest,
+                               workers: int, index_directory: str = None, cache: FilingCache = None,
+                               base_url: str = DEFAULT_EDGAR_URL):
+    # An unfinished quarter's index still grows every day, so only finished quarters are skipped once done
+    finished, unfinished = [], []
+    for year, quarter in quarters(start_date, end_date):
+        name = f'{year}-QTR{quarter}'
+        first_day, last_day = datetime.date(year, quarter * 3 - 2, 1), quarter_end(year, quarter)
+        if start_date > first_day or end_date < last_day:
+            # Only part of the quarter was read, so a wider date range later must read it again
+            name += f' {max(start_date, first_day)}..{min(end_date, last_day)}'
+        (finished if published(last_day) else unfinished).append(name)
+    pending = unfinished + manifest.pending_indexes(finished)
+    print(f'=== Reading {len(pending):,} quarterly form indexes with {workers} worker(s) ===')
+
+    def read_index(name: str):
+        year, quarter = int(name[:4]), int(name[len('YYYY-QTR')])
+        try:
+            filings = get_quarterly_form13_filings(year, quarter, start_date, end_date, index_directory, cache,
+                                                   base_url)
+        except Exception as e:
+            print(f'Reading form index failed for {name}: {e!r}')
+            filings = None
+        if filings is None:
+            manifest.record_index(name, None, 'failed')
+        else:
+            print(f'We have {len(filings):,} Form 13 URLs for {name}')
+            manifest.record_index(name, filings, 'done' if len(filings) > 0 else 'missing')
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(read_index, pending))
+
+
+def download_filings(manifest: DownloadManifest, output_dir: str, workers: int, cache: FilingCache = None,
+                     base_url: str = DEFAULT_EDGAR_URL):
+    pending = manifest.pending_filings()
+    print(f'=== Downloading {len(pending):,} Form 13 filings with {workers} worker(s) ===')
+
+    def download_filing(path: str):
+        start = time.perf_counter()
+        try:
+            filings = download_form13(path, cache, base_url)
+            if filings is None:
+                manifest.record_filing(path, 'failed', 'download failed')
+                return
+            if filings == '':
+                manifest.record_filing(path, 'missing', 'not found')
+                return
+            # Write to a temp file first so an interrupted write is never mistaken for a finished download
+            file_path = os.path.join(output_dir, path.replace('/', '_'))
+            with open(file_path + '.part', 'w') as file:
+                file.write(filings)
+            os.replace(file_path + '.part', file_path)
+            METRICS.count('bytes_written', os.path.getsize(file_path))
+            manifest.record_filing(path, 'done')
+        except Exception as e:
+            print(e)
+            manifest.record_filing(path, 'failed', repr(e))
+        finally:
+            METRICS.observe('filing_downloads', path, time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(download_filing, pending))
 
 
 def parse_args():
@@ -30,50 +264,68 @@ def parse_args():
     parser.add_argument('-s', '--start-date', default='2022-12-31', help='Start date in the format yyyy-mm-dd')
     parser.add_argument('-e', '--end-date', default='2023-12-22', help='End date in the format yyyy-mm-dd')
     parser.add_argument('-o', '--output-directory', default='data/form13-raw/',
-                        help='Local directory to write forms to')
+                        help='Local directory to write forms to, along with a manifest of completed downloads')
+    parser.add_argument('-m', '--index-mode', choices=['daily', 'quarterly'], default='daily',
+                        help='Find 13F-HR filings from one daily master index per weekday, or from one quarterly '
+                             'full-index form.idx per quarter')
+    parser.add_argument('-x', '--index-directory', required=False,
+                        help='Local copy of EDGAR full-index laid out as YYYY/QTRn/form.idx, read instead of '
+                             'downloading quarterly indexes')
+    parser.add_argument('-w', '--workers', type=int, default=8,
+                        help='Number of concurrent downloads, all sharing the --requests-per-second cap')
+    parser.add_argument('-c', '--cache-directory', default=DEFAULT_CACHE_DIRECTORY,
+                        help='Directory of the compressed EDGAR filing cache shared by the downloaders')
+    parser.add_argument('-cg', '--cache-max-gb', type=float, default=20,
+                        help='Size limit of the filing cache, least recently used filings are evicted past it')
+    parser.add_argument('-nc', '--no-cache', action='store_true',
+                        help='Always download indexes and filings from EDGAR and do not cache them')
+    add_url_arguments(parser)
+    add_rate_arguments(parser)
+    add_metrics_arguments(parser)
     args = parser.parse_args()
     return args
 
 
-def download_date(date, output_dir):
-    form13_paths = get_form13_urls(date)
-    # Download each Form 13
-    print('We have ' + str(len(form13_paths)) + ' Form 13 URLs for the date ' + str(date))
-    for path in form13_paths:
-        try:
-            filings = download_form13(path)
-            with open(os.path.join(output_dir, path.replace('/', '_')), 'w') as file:
-                file.write(filings)
-        except Exception as e:
-            print(e)
-
-
-def get_form13_urls(date):
+def get_form13_urls(date, cache: FilingCache = None, base_url: str = DEFAULT_EDGAR_URL):
     print('Composing the URL of the master file...')
     year = str(date.year)
     quarter = 'QTR' + str(math.ceil(date.month / 3))
     date = date.strftime('%Y%m%d')
     path = '/Archives/edgar/daily-index/' + year + '/' + quarter + '/master.' + date + '.idx'
-    url = 'https://www.sec.gov' + path
+    url = base_url + path
     print('The URL of the master file is ' + url)
 
+    if cache is not None:
+        # Daily indexes are only published once the day is complete, so a cached copy never goes stale
+        cached = cache.get(cache_key(url))
+        if cached is not None:
+            print('Using cached master file')
+            METRICS.count('cache_hits')
+            return parse_master_file(cached.decode('utf-8', errors='replace'))
+
     print('Downloading the master file...')
     # conn = http.client.HTTPSConnection('www.sec.gov')
     # conn.request('GET', path, headers={'User-Agent': 'Neo4j Ben.Lackey@Neo4j.com'})
     # response = conn.getresponse()
     #data = response.read()
     # conn.close()
-    response = session.get('https://www.sec.gov/' + path, headers={'User-Agent': 'Neo4j andreas.kollegger@neo4j.com'})
+    response = edgar_get(url)
     print(response.status_code)
     
-    if response.status_code == 200: # and response.reason == 'OK':
+    if response.status_code == 404:
+        # No index is published on holidays
+        print('No master file for this date.')
+        return []
+    elif response.status_code == 200: # and response.reason == 'OK':
         # text = data.decode('windows-1252')
         text = response.text
+        if cache is not None:
+            cache.put(cache_key(url), response.content, response.headers.get('ETag'))
         form4_paths = parse_master_file(text)
         return form4_paths
     else:
         print('Download failed for master file.', response.status_code)
-        return []
+        return None
 
 
 def parse_master_file(text):
@@ -92,25 +344,135 @@ def parse_master_file(text):
     return form4_paths
 
 
-def download_form13(path):
+def quarter_end(year: int, quarter: int) -> datetime.date:
+    if quarter == 4:
+        return datetime.date(year, 12, 31)
+    return datetime.date(year, quarter * 3 + 1, 1) - datetime.timedelta(days=1)
+
+
+def get_quarterly_form13_filings(year: int, quarter: int, start_date: datetime.date, end_date: datetime.date,
+                                 index_directory: str = None, cache: FilingCache = None,
+                                 base_url: str = DEFAULT_EDGAR_URL) -> Optional[List[Tuple[str, str]]]:
+    # Returns (path, date filed) for the quarter's 13F-HR filings within the date range, None if the index is unavailable
+    path = f'/Archives/edgar/full-index/{year}/QTR{quarter}/form.idx'
+    url = base_url + path
+    if index_directory is not None:
+        local_path = os.path.join(index_directory, str(year), f'QTR{quarter}', 'form.idx')
+        print(f'Reading form index {local_path}')
+        with open(local_path, 'rb') as file:
+            data = file.read()
+    else:
+        data = None
+        finished = published(quarter_end(year, quarter))
+        if cache is not None:
+            data = cache.get(cache_key(url), None if finished else 24 * 3600)
+            if data is not None:
+                METRICS.count('cache_hits')
+        if data is None:
+            print('Downloading the form index ' + url)
+            response = edgar_get(url)
+            if response.status_code != 200:
+                print('Download failed for form index.', response.status_code)
+                return None
+            data = response.content
+            if cache is not None:
+                cache.put(cache_key(url), data, response.headers.get('ETag'))
+    start, end = start_date.isoformat(), end_date.isoformat()
+    return [(path, date) for path, date in parse_form_index(data, '13F-HR') if start <= date <= end]
+
+
+def form_index_line(data: bytes, pos: int) -> Tuple[int, int]:
+    # Bounds of the line containing pos
+    line_start = data.rfind(b'\n', 0, pos) + 1
+    line_end = data.find(b'\n', pos)
+    return line_start, len(data) if line_end < 0 else line_end
+
+
+def parse_form_index(data: bytes, form_type: str = '13F-HR') -> List[Tuple[str, str]]:
+    """
+    Return (path, date filed) of every `form_type` row in a full-index form.idx. Rows are sorted by form type, so
+    instead of parsing the whole file the first matching row is binary searched for and only the block of matching
+    rows is read. Rows are fixed width with the form type first and the date filed and file name last.
+    """
+    target = form_type.encode('ascii')
+    header_end = data.find(b'\n---')
+    body_start = 0 if header_end < 0 else data.find(b'\n', header_end + 1) + 1
+    # Find the first line whose form type is >= target
+    low, high = body_start, len(data)
+    while low < high:
+        mid = (low + high) // 2
+        line_start, line_end = form_index_line(data, mid)
+        fields = data[line_start:line_end].split()
+        if fields and fields[0] < target:
+            low = line_end + 1
+        else:
+            high = line_start
+    res = []
+    pos = low
+    while pos < len(data):
+        line_start, line_end = form_index_line(data, pos)
+        fields = data[line_start:line_end].split()
+        pos = line_end + 1
+        if not fields:
+            continue
+        if fields[0] != target:
+            break
+        res.append(('/Archives/' + fields[-1].decode('ascii'), fields[-2].decode('ascii')))
+    if not res and body_start < len(data):
+        # Not where the sort order says it should be, fall back to checking every row
+        for line in data[body_start:].splitlines():
+            fields = line.split()
+            if fields and fields[0] == target:
+                res.append(('/Archives/' + fields[-1].decode('ascii'), fields[-2].decode('ascii')))
+    return res
+
+
+@timed('http_request')
+def edgar_get(url: str):
+    # Includes the time spent waiting on the rate governor, and retries requests refused with 429 or 503
+    for attempt in range(governor.retries + 1):
+        if attempt > 0:
+            METRICS.count('retries')
+        governor.acquire()
+        response = session.get(url, headers={'User-Agent': 'Neo4j andreas.kollegger@neo4j.com'})
+        METRICS.count('bytes_downloaded', len(response.content))
+        if not governor.throttled(response.status_code, response.headers.get('Retry-After')):
+            break
+    return response
+
+
+def download_form13(path, cache: FilingCache = None, base_url: str = DEFAULT_EDGAR_URL):
+    url = base_url + path
+    if cache is not None:
+        cached = cache.get(cache_key(url))
+        if cached is not None:
+            print('cached ' + url)
+            METRICS.count('cache_hits')
+            return cached.decode('utf-8', errors='replace')
     # conn = http.client.HTTPSConnection('www.sec.gov')
     # conn.request('GET', path, headers={'User-Agent': 'Neo4j sales@neo4j.com'})
     # response = conn.getresponse()
     # data = response.read()
     # conn.close()
-    response = session.get('https://www.sec.gov/' + path, headers={'User-Agent': 'Neo4j andreas.kollegger@neo4j.com'})
+    response = edgar_get(url)
 
-    if response.status_code == 200: # and response.reason == 'OK':
-        print('http://sec.gov' + path)
+    if response.status_code == 404:
+        # Gone for good, returned empty like a missing index so it is not downloaded again
+        print('Form13 file not found: ' + url)
+        return ''
+    elif response.status_code == 200: # and response.reason == 'OK':
+        print(url)
         # text = data.decode('utf-8')
-        text = response.text
+        text = response.content.decode('utf-8', errors='replace')
+        if cache is not None:
+            cache.put(cache_key(url), response.content, response.headers.get('ETag'))
         file = io.StringIO(text)
         contents = file.read()
         file.close()
         return contents
     else:
         print('Download failed for form13 file: HTTP ', response.status_code)
-        return []
+        return None
 
 
 if __name__ == "__main__":
@@ -1,11 +1,23 @@
 import argparse
+import io
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
-from typing import List, Dict
+from itertools import repeat
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
 
 import pandas as pd
 import os
 import re
 import xmltodict
+from lxml import etree
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from metrics import METRICS, add_metrics_arguments, path_bytes, run_with_metrics, timed
 
 FILING_MANAGER_ADDRESS_COL = 'managerAddress'
 FILING_MANAGER_NAME_COL = 'managerName'
@@ -17,18 +29,62 @@ COMPANY_NAME_COL = 'companyName'
 SOURCE_ID_COL = 'source'
 VALUE_COL = 'value'
 SHARES_COL = 'shares'
+MANAGER_KEY_COL = 'managerKey'
+COMPANY_KEY_COL = 'companyKey'
+
+DEFAULT_XML_ENGINE = 'iterparse'
+# infoTable fields used by filter_and_format, the rest of each row is never built
+INFO_TABLE_FIELDS = {'nameOfIssuer', 'titleOfClass', 'cusip', 'value'}
+SHARES_FIELDS = {'sshPrnamt', 'sshPrnamtType'}
+DEFAULT_SHARD_DIRECTORY = 'data/form13-shards/'
+DEFAULT_FILES_PER_SHARD = 500
+OUTPUT_FORMATS = ['csv', 'parquet']
 
 
 def main() -> int:
     args = parse_args()
-    filings_df, failures = parse_from_dir(args.input_directory)
-    stg_df = aggregate_data(filings_df)
-    if args.top_periods is not None:
-        stg_df = filter_data(stg_df, args.top_periods)
-    stg_df.to_csv(args.output_file, index=False)
+    return run_with_metrics('f13-parse-and-format', args, run, args)
+
+
+def run(args) -> int:
+    output_file = args.output_file or f'data/form13.{args.output_format}'
+    if args.output_format == 'parquet' and not args.incremental and not replaceable_dataset(output_file):
+        # Checked before parsing, rather than failing once the parse is done
+        print(f'{output_file} exists and is not a form 13 parquet dataset, refusing to replace it')
+        return 2
+    if args.incremental:
+        failures = parse_incremental(args.input_directory, output_file, args.workers, args.files_per_shard,
+                                     args.xml_engine)
+    elif args.workers > 1:
+        # Shards go to a new directory of their own, so nothing else under --shard-directory is ever deleted
+        os.makedirs(args.shard_directory, exist_ok=True)
+        shard_directory = tempfile.mkdtemp(prefix='shards-', dir=args.shard_directory)
+        try:
+            shards, failures = parse_from_dir_parallel(args.input_directory, shard_directory, args.workers,
+                                                       args.files_per_shard, args.xml_engine)
+            combine_shards(shards, output_file, args.top_periods, args.output_format)
+        finally:
+            shutil.rmtree(shard_directory, ignore_errors=True)
+    else:
+        filings_df, failures = parse_from_dir(args.input_directory, args.xml_engine)
+        if args.normalized:
+            tables = normalize_data(filings_df)
+            if args.top_periods is not None:
+                tables = filter_tables(*tables, args.top_periods)
+            write_tables(*tables, output_file)
+        if not args.normalized or args.wide:
+            stg_df = aggregate_data(filings_df)
+            if args.top_periods is not None:
+                stg_df = filter_data(stg_df, args.top_periods)
+            if args.output_format == 'parquet':
+                write_parquet(stg_df, output_file)
+            else:
+                stg_df.to_csv(output_file, index=False)
+    if not args.incremental and (not args.normalized or args.wide):
+        METRICS.count('bytes_written', path_bytes(output_file))
     print(f'===== Had {len(failures)} failed file parsings ====')
-    for failure in failures:
-        print(failure)
+    for file_name, error in failures:
+        print(f'{file_name}: {error}')
     return 0
 
 
@@ -37,11 +93,39 @@ def parse_args():
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-i', '--input-directory', required=False, default='data/form13-raw/',
                         help='Directory containing raw EDGAR files')
-    parser.add_argument('-o', '--output-file', required=False, default='data/form13.csv',
-                        help='Local path + file name to write formatted csv too')
+    parser.add_argument('-o', '--output-file', required=False,
+                        help='Local path + file name to write formatted csv too, or the directory of the parquet '
+                             'dataset. Defaults to data/form13.csv or data/form13.parquet')
+    parser.add_argument('-f', '--output-format', choices=OUTPUT_FORMATS, default='csv',
+                        help='Write a single csv, or a parquet dataset partitioned by report period')
     parser.add_argument('-p', '--top-periods', required=False, type=int,
                         help='Only include data from `n` most recent report quarters')
+    parser.add_argument('-x', '--xml-engine', choices=['iterparse', 'xmltodict'], default=DEFAULT_XML_ENGINE,
+                        help='Stream information tables with lxml iterparse, or convert them to dicts with xmltodict')
+    parser.add_argument('-w', '--workers', required=False, type=int, default=1,
+                        help='Number of processes to parse with. Above 1, each process writes aggregated csv shards '
+                             'that are combined into the output file at the end')
+    parser.add_argument('-s', '--shard-directory', required=False, default=DEFAULT_SHARD_DIRECTORY,
+                        help='Directory for intermediate shards when parsing with more than one worker. Each run '
+                             'writes them to a new subdirectory and removes only that')
+    parser.add_argument('-fs', '--files-per-shard', required=False, type=int, default=DEFAULT_FILES_PER_SHARD,
+                        help='Number of raw filings parsed into each shard')
+    parser.add_argument('-inc', '--incremental', action='store_true',
+                        help='Only parse filings that are new or changed since the last incremental run and update '
+                             'the affected report periods of the parquet dataset in place')
+    parser.add_argument('-n', '--normalized', action='store_true',
+                        help='Write manager, company and holdings tables joined by integer keys next to the output '
+                             'file, e.g. data/form13-managers.csv, instead of the wide file')
+    parser.add_argument('-wd', '--wide', action='store_true',
+                        help='With --normalized, also write the wide output file')
+    add_metrics_arguments(parser)
     args = parser.parse_args()
+    if args.normalized and (args.workers > 1 or args.incremental or args.output_format != 'csv'):
+        parser.error('--normalized builds its keys over all filings at once, so it needs --output-format csv, '
+                     'one worker and no --incremental')
+    if args.incremental and (args.output_format != 'parquet' or args.top_periods is not None):
+        parser.error('--incremental updates a parquet dataset per report period, so it needs --output-format parquet '
+                     'and no --top-periods')
     return args
 
 
@@ -59,18 +143,97 @@ def strip_ns(x):
 
 
 def extract_submission_info(contents: str) -> str:
+    return parse_submission_info(contents[1].split('</XML>')[0])
+
+
+@timed()
+def parse_submission_info(xml: str) -> Dict:
     namespaces = {
         'http://www.sec.gov/edgar/common/': None, # skip this namespace
     }
-    xml = contents[1].split('</XML>')[0].strip()
-    return strip_ns(xmltodict.parse(xml, process_namespaces=True, namespaces=namespaces))['edgarSubmission']
+    return strip_ns(xmltodict.parse(xml.strip(), process_namespaces=True, namespaces=namespaces))['edgarSubmission']
 
 
+@timed()
 def extract_investment_info(contents: str) -> str:
     xml = contents[2].split('</XML>')[0].strip()
     return strip_ns(xmltodict.parse(xml))['informationTable']['infoTable']
 
 
+def local_name(tag: str) -> str:
+    # Drop both resolved '{uri}' namespaces and undeclared 'ns1:' style prefixes
+    return tag.rpartition('}')[2].rpartition(':')[2]
+
+
+def element_text(element) -> Optional[str]:
+    # Same as xmltodict: surrounding whitespace stripped and empty elements as None
+    text = (element.text or '').strip()
+    return text if text else None
+
+
+def iter_info_tables(xml_chunks: Iterable[str]) -> Iterator[Dict]:
+    """
+    Incrementally parse an informationTable from chunks of XML text and yield one compact row per infoTable, shaped
+    like the xmltodict output filter_and_format expects but holding only the fields it reads. Each infoTable is
+    cleared once yielded, so memory stays constant however many holdings a filer reports.
+    """
+    # Only infoTable elements raise events, in any namespace
+    parser = etree.XMLPullParser(events=('end',), tag=('{*}infoTable', 'infoTable'), recover=True, huge_tree=True)
+    started = False
+    for chunk in xml_chunks:
+        if not started:
+            # Nothing may come before the XML declaration
+            chunk = chunk.lstrip()
+            if not chunk:
+                continue
+            started = True
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            row = {'shrsOrPrnAmt': {}}
+            for child in element:
+                name = local_name(child.tag)
+                if name in INFO_TABLE_FIELDS:
+                    row[name] = element_text(child)
+                elif name == 'shrsOrPrnAmt':
+                    for amount in child:
+                        amount_name = local_name(amount.tag)
+                        if amount_name in SHARES_FIELDS:
+                            row['shrsOrPrnAmt'][amount_name] = element_text(amount)
+            yield row
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    parser.close()
+
+
+def iter_xml_blocks(lines: Iterable[str]) -> Iterator[Iterator[str]]:
+    # Split a filing into the text of its <XML>...</XML> blocks without reading it all into memory. Each block must
+    # be consumed before moving on to the next
+    lines = iter(lines)
+    pending = ''
+    while True:
+        while '<XML>' not in pending:
+            pending = next(lines, None)
+            if pending is None:
+                return
+        pending = pending.split('<XML>', 1)[1]
+
+        def block():
+            nonlocal pending
+            while True:
+                if '</XML>' in pending:
+                    text, pending = pending.split('</XML>', 1)
+                    yield text
+                    return
+                yield pending
+                pending = next(lines, None)
+                if pending is None:
+                    pending = ''
+                    return
+
+        yield block()
+
+
 def estimate_cusip6(cusip: str) -> str:
     # Padding of 3 zeros is suspect - likely has a padded zero. This is inconsistent among form13 filers
     if cusip.startswith('000'):
@@ -113,57 +276,427 @@ def filter_and_format(info_tables: str, manager_address: str, manager_cik: str,
     return res
 
 
-def extract_dicts(txt: str) -> List[Dict]:
-    contents = txt.split('<XML>')
-    submt_dict = extract_submission_info(contents)
+def extract_manager_info(submt_dict: Dict) -> Tuple[str, str, str, str]:
     mng_cik = submt_dict['headerData']['filerInfo']['filer']['credentials']['cik']
     mng_name = submt_dict['formData']['coverPage']['filingManager']['name']
+    address = submt_dict['formData']['coverPage']['filingManager'].get('address')
     try:
-        mng_address = ", ".join(list(submt_dict['formData']['coverPage']['filingManager']['address'].values()))
-    except:
-        print(submt_dict['formData']['coverPage']['filingManager']['address'])
-        exit()
+        mng_address = ", ".join(list(address.values()))
+    except Exception:
+        raise ValueError(f'Could not parse filing manager address {address!r}')
     report_period = submt_dict['formData']['coverPage']['reportCalendarOrQuarter']
+    return mng_cik, mng_name, mng_address, report_period
+
+
+def extract_dicts(txt: str, xml_engine: str = DEFAULT_XML_ENGINE) -> List[Dict]:
+    if xml_engine == 'iterparse':
+        return stream_dicts(io.StringIO(txt))
+    contents = txt.split('<XML>')
+    submt_dict = extract_submission_info(contents)
+    mng_cik, mng_name, mng_address, report_period = extract_manager_info(submt_dict)
     info_dict = extract_investment_info(contents)
     return filter_and_format(info_dict, mng_address, mng_cik, mng_name, report_period)
 
 
-def parse_from_dir(directory_path: str):
-    # Go through all files and concatenate to dataframe
-    print(f'=== Begin Parsing from {directory_path} ===')
+def stream_dicts(file: TextIO) -> List[Dict]:
+    # Same rows as extract_dicts, but the filing is read line by line and its information table streamed through
+    # iter_info_tables rather than held in memory as text and nested dicts
+    blocks = iter_xml_blocks(file)
+    submt_dict = parse_submission_info(''.join(next(blocks)))
+    mng_cik, mng_name, mng_address, report_period = extract_manager_info(submt_dict)
+    return filter_and_format(iter_info_tables(next(blocks)), mng_address, mng_cik, mng_name, report_period)
+
+
+def source_url(file_name: str) -> str:
+    return 'https://sec.gov' + file_name.replace('_', '/')
+
+
+def list_filings(directory_path: str) -> List[str]:
+    # Ordered by source url, the leading groupby key of aggregate_data
+    return sorted((x for x in os.listdir(directory_path) if x.endswith('.txt')), key=source_url)
+
+
+def parse_file(directory_path: str, file_name: str, xml_engine: str = DEFAULT_XML_ENGINE) -> pd.DataFrame:
+    with open(os.path.join(directory_path, file_name), 'r') as file:
+        if xml_engine == 'iterparse':
+            filing = stream_dicts(file)
+        else:
+            filing = extract_dicts(file.read(), xml_engine)
+    filing_df = pd.DataFrame(filing)
+    filing_df[SOURCE_ID_COL] = source_url(file_name)
+    return filing_df
+
+
+def parse_files(directory_path: str, file_names: List[str],
+                xml_engine: str = DEFAULT_XML_ENGINE) -> Tuple[pd.DataFrame, List[Tuple[str, str]]]:
     filing_dfs = []
     failures = []
-    for file_name in os.listdir(directory_path):
-        if file_name.endswith('.txt'):
-            print(f'parsing {file_name}')
-            file_path = os.path.join(directory_path, file_name)
-            try:
-                with open(file_path, 'r') as file:
-                    filing = extract_dicts(file.read())
-                    tmp_filing_df = pd.DataFrame(filing)
-                    tmp_filing_df[SOURCE_ID_COL] = 'https://sec.gov' + file_name.replace('_', '/')
-                    filing_dfs.append(tmp_filing_df)
-            except Exception as e:
-                print(e)
-                failures.append(file_name)
-    filing_df = pd.concat(filing_dfs, ignore_index=True)
+    for file_name in file_names:
+        start = time.perf_counter()
+        try:
+            filing_dfs.append(parse_file(directory_path, file_name, xml_engine))
+        except Exception as e:
+            failures.append((file_name, repr(e)))
+            continue
+        METRICS.observe('filing_parses', file_name, time.perf_counter() - start)
+        METRICS.count('bytes_read', os.path.getsize(os.path.join(directory_path, file_name)))
+    filing_df = pd.concat(filing_dfs, ignore_index=True) if filing_dfs else pd.DataFrame(
+        columns=[FILING_MANAGER_CIK_COL, FILING_MANAGER_NAME_COL, FILING_MANAGER_ADDRESS_COL, REPORT_PERIOD_COL,
+                 COMPANY_CUSIP_COL, COMPANY_CUSIP6_COL, COMPANY_NAME_COL, VALUE_COL, SHARES_COL, SOURCE_ID_COL])
     filing_df[REPORT_PERIOD_COL] = pd.to_datetime(filing_df[REPORT_PERIOD_COL]).dt.date
     filing_df[VALUE_COL] = filing_df[VALUE_COL].astype(float)
     filing_df[SHARES_COL] = filing_df[SHARES_COL].astype(int)
     return filing_df, failures
 
 
+def parse_from_dir(directory_path: str, xml_engine: str = DEFAULT_XML_ENGINE):
+    # Go through all files and concatenate to dataframe
+    print(f'=== Begin Parsing from {directory_path} ===')
+    filing_df, failures = parse_files(directory_path, list_filings(directory_path), xml_engine)
+    return filing_df, failures
+
+
+def parse_shard(directory_path: str, file_names: List[str], shard_path: str,
+                xml_engine: str = DEFAULT_XML_ENGINE) -> Tuple[List[str], List[Tuple[str, str]], Dict]:
+    """
+    Parse and aggregate one slice of the raw filings into a csv shard. Aggregating per shard gives the same rows as
+    aggregating everything at once since every group is keyed by source, i.e. lies within a single filing.
+    Returns the report periods in the shard along with any failures and the worker's metrics.
+    """
+    filing_df, failures = parse_files(directory_path, file_names, xml_engine)
+    stg_df = aggregate_data(filing_df, verbose=False)
+    stg_df.to_csv(shard_path, index=False)
+    periods = sorted({period.isoformat() for period in stg_df[REPORT_PERIOD_COL]})
+    return periods, failures, METRICS.drain()
+
+
+def parse_from_dir_parallel(directory_path: str, shard_directory: str, workers: int,
+                            files_per_shard: int = DEFAULT_FILES_PER_SHARD,
+                            xml_engine: str = DEFAULT_XML_ENGINE) -> Tuple[List[Tuple[str, List[str]]], List]:
+    # Split the directory listing across worker processes, each writing aggregated shards. Returns (shard path, report
+    # periods) for every shard in listing order, and the failures gathered from all workers
+    file_names = list_filings(directory_path)
+    os.makedirs(shard_directory, exist_ok=True)
+    slices = [file_names[i:i + files_per_shard] for i in range(0, len(file_names), files_per_shard)]
+    print(f'=== Begin Parsing {len(file_names):,} filings from {directory_path} into {len(slices):,} shards with '
+          f'{workers} workers ===')
+    shards = [None] * len(slices)
+    failures = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for i, names in enumerate(slices):
+            shard_path = os.path.join(shard_directory, f'shard-{i:05d}.csv')
+            futures[executor.submit(parse_shard, directory_path, names, shard_path, xml_engine)] = (i, shard_path)
+        for done, future in enumerate(as_completed(futures), 1):
+            i, shard_path = futures[future]
+            try:
+                periods, shard_failures, shard_metrics = future.result()
+                METRICS.merge(shard_metrics)
+            except Exception as e:
+                # A shard that failed as a whole, e.g. a killed worker, fails all of its filings
+                periods, shard_failures = None, [(file_name, repr(e)) for file_name in slices[i]]
+            failures.extend(shard_failures)
+            if periods is not None:
+                shards[i] = (shard_path, periods)
+            print(f'--- Parsed {done:,} of {len(slices):,} shards, {len(failures):,} failures so far')
+    return [shard for shard in shards if shard is not None], failures
+
+
+@timed()
+def combine_shards(shards: List[Tuple[str, List[str]]], output_file: str, top_n_periods: Optional[int] = None,
+                   output_format: str = 'csv'):
+    # Stream the shards one at a time into the output file, applying the same period filter as filter_data
+    print(f'=== Combining {len(shards):,} shards into {output_file} ===')
+    periods = sorted({period for shard_path, shard_periods in shards for period in shard_periods})
+    if top_n_periods is not None:
+        periods = periods[-top_n_periods:] if top_n_periods > 0 else []
+    periods = set(periods)
+    if output_format == 'parquet':
+        remove_dataset(output_file)
+        for i, (shard_path, shard_periods) in enumerate(shards):
+            if periods.intersection(shard_periods):
+                shard_df = pd.read_csv(shard_path, dtype=str, keep_default_na=False)
+                shard_df = shard_df[shard_df[REPORT_PERIOD_COL].isin(periods)]
+                shard_df[REPORT_PERIOD_COL] = pd.to_datetime(shard_df[REPORT_PERIOD_COL]).dt.date
+                write_parquet(shard_df, output_file, f'shard-{i:05d}')
+        return
+    header = True
+    with open(output_file, 'w', newline='') as file:
+        for shard_path, shard_periods in shards:
+            if header or periods.intersection(shard_periods):
+                # Read everything as text so values are written back exactly as they were
+                shard_df = pd.read_csv(shard_path, dtype=str, keep_default_na=False)
+                shard_df[shard_df[REPORT_PERIOD_COL].isin(periods)].to_csv(file, index=False, header=header)
+                header = False
+
+
+class ParseState:
+    """
+    sqlite record of the raw filings an incremental run has parsed into a parquet dataset: the size and mtime each
+    file had, the report periods its rows went to and whether it failed. A file is parsed again only when it is new,
+    its size or mtime changed, or it failed last time.
+    """
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path, timeout=60)
+        with self.db:
+            self.db.execute('''CREATE TABLE IF NOT EXISTS files (
+                file_name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                periods TEXT NOT NULL,
+                row_count INTEGER NOT NULL,
+                error TEXT,
+                parsed_at REAL NOT NULL)''')
+
+    def files(self) -> Dict[str, Tuple[int, int, str, List[str]]]:
+        # file name -> (size, mtime_ns, status, report periods)
+        return {file_name: (size, mtime_ns, status, periods.split(',') if periods else [])
+                for file_name, size, mtime_ns, status, periods in
+                self.db.execute('SELECT file_name, size, mtime_ns, status, periods FROM files')}
+
+    def record(self, entries: List[Tuple[str, int, int, str, List[str], int, Optional[str]]]):
+        now = time.time()
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                [(file_name, size, mtime_ns, status, ','.join(periods), row_count, error, now)
+                                 for file_name, size, mtime_ns, status, periods, row_count, error in entries])
+
+    def remove(self, file_names: List[str]):
+        with self.db:
+            self.db.executemany('DELETE FROM files WHERE file_name = ?', [(x,) for x in file_names])
+
+    def close(self):
+        self.db.close()
+
+
+def parse_changed(directory_path: str, file_names: List[str], workers: int,
+                  files_per_shard: int = DEFAULT_FILES_PER_SHARD, xml_engine: str = DEFAULT_XML_ENGINE):
+    if workers <= 1 or len(file_names) <= files_per_shard:
+        return parse_files(directory_path, file_names, xml_engine)
+    slices = [file_names[i:i + files_per_shard] for i in range(0, len(file_names), files_per_shard)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(parse_slice, repeat(directory_path), slices, repeat(xml_engine)))
+    for df, fails, slice_metrics in results:
+        METRICS.merge(slice_metrics)
+    return pd.concat([df for df, _, _ in results], ignore_index=True), [x for _, fails, _ in results for x in fails]
+
+
+def parse_slice(directory_path: str, file_names: List[str], xml_engine: str = DEFAULT_XML_ENGINE):
+    # parse_files in a worker process, returning the worker's metrics along with its results
+    return (*parse_files(directory_path, file_names, xml_engine), METRICS.drain())
+
+
+def parse_incremental(directory_path: str, dataset_path: str, workers: int = 1,
+                      files_per_shard: int = DEFAULT_FILES_PER_SHARD,
+                      xml_engine: str = DEFAULT_XML_ENGINE) -> List[Tuple[str, str]]:
+    """
+    Bring the parquet dataset at dataset_path up to date with the raw filings in directory_path. Only new, changed
+    and previously failed files are parsed, and only the report period partitions they and any removed files touch
+    are rewritten. The first run against a dataset parses everything.
+    """
+    state = ParseState(dataset_path.rstrip('/') + '.state.sqlite')
+    known = state.files()
+    fingerprints = {}
+    for file_name in list_filings(directory_path):
+        stat = os.stat(os.path.join(directory_path, file_name))
+        fingerprints[file_name] = (stat.st_size, stat.st_mtime_ns)
+    changed = [x for x in fingerprints if x not in known or known[x][:2] != fingerprints[x] or known[x][2] != 'done']
+    removed = [x for x in known if x not in fingerprints]
+    print(f'=== Begin Parsing {len(changed):,} new or changed filings of {len(fingerprints):,} from {directory_path}, '
+          f'{len(removed):,} removed ===')
+    if not changed and not removed:
+        state.close()
+        return []
+
+    filing_df, failures = parse_changed(directory_path, changed, workers, files_per_shard, xml_engine)
+    stg_df = aggregate_data(filing_df)
+    # Rows of changed and removed files are replaced wherever they were, so the periods they had before count too
+    stale_sources = {source_url(x) for x in changed + removed}
+    periods = set(stg_df[REPORT_PERIOD_COL])
+    periods.update(datetime.strptime(period, '%Y-%m-%d').date() for x in changed + removed if x in known
+                   for period in known[x][3])
+    print(f'=== Updating {len(periods):,} report periods in {dataset_path} ===')
+    for period in sorted(periods):
+        update_partition(dataset_path, period, stg_df[stg_df[REPORT_PERIOD_COL] == period], stale_sources)
+
+    # Only recorded once the partitions are written, so an interrupted run parses the same files again
+    errors = dict(failures)
+    file_periods = stg_df.groupby(SOURCE_ID_COL)[REPORT_PERIOD_COL].unique()
+    file_rows = stg_df.groupby(SOURCE_ID_COL).size()
+    entries = []
+    for file_name in changed:
+        source = source_url(file_name)
+        entries.append((file_name, *fingerprints[file_name], 'failed' if file_name in errors else 'done',
+                        sorted(x.isoformat() for x in file_periods.get(source, [])), int(file_rows.get(source, 0)),
+                        errors.get(file_name)))
+    state.record(entries)
+    state.remove(removed)
+    state.close()
+    return failures
+
+
+@timed()
+def update_partition(dataset_path: str, period: datetime.date, rows_df: pd.DataFrame, stale_sources: set):
+    # Replace the rows of stale sources in one report period partition with rows_df, as a single part file
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    partition_directory = os.path.join(dataset_path, f'{REPORT_PERIOD_COL}={period.isoformat()}')
+    old_files = sorted(x for x in os.listdir(partition_directory) if x.endswith('.parquet')) \
+        if os.path.isdir(partition_directory) else []
+    schema = form13_schema()
+    schema = schema.remove(schema.get_field_index(REPORT_PERIOD_COL))
+    # Table.drop rather than drop_columns, which needs pyarrow 14
+    tables = [to_arrow_table(rows_df).drop([REPORT_PERIOD_COL]).cast(schema)]
+    for file_name in old_files:
+        table = pq.read_table(os.path.join(partition_directory, file_name), partitioning=None).cast(schema)
+        stale = pc.is_in(table[SOURCE_ID_COL].cast(pa.string()), value_set=pa.array(sorted(stale_sources), pa.string()))
+        tables.append(table.filter(pc.invert(stale)))
+    table = pa.concat_tables(tables)
+    if table.num_rows == 0:
+        shutil.rmtree(partition_directory, ignore_errors=True)
+        return
+    os.makedirs(partition_directory, exist_ok=True)
+    # Dot files are skipped by dataset readers, so a half written part is never read
+    tmp_path = os.path.join(partition_directory, '.part-0.parquet.tmp')
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, os.path.join(partition_directory, 'part-0.parquet'))
+    METRICS.count('bytes_written', os.path.getsize(os.path.join(partition_directory, 'part-0.parquet')))
+    for file_name in old_files:
+        if file_name != 'part-0.parquet':
+            os.remove(os.path.join(partition_directory, file_name))
+
+
+def form13_schema():
+    # pyarrow is only needed for parquet output, so it is imported on first use
+    import pyarrow as pa
+
+    # The repeated per filing and per manager strings are dictionary encoded so they read back as pandas categoricals,
+    # and the report period is the partition key, stored in the directory names
+    string_dict = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        (SOURCE_ID_COL, string_dict),
+        (FILING_MANAGER_CIK_COL, pa.int64()),
+        (FILING_MANAGER_ADDRESS_COL, string_dict),
+        (FILING_MANAGER_NAME_COL, string_dict),
+        (REPORT_PERIOD_COL, pa.date32()),
+        (COMPANY_CUSIP6_COL, string_dict),
+        (COMPANY_CUSIP_COL, string_dict),
+        (COMPANY_NAME_COL, string_dict),
+        (VALUE_COL, pa.float64()),
+        (SHARES_COL, pa.int64()),
+    ])
+
+
+def to_arrow_table(stg_df: pd.DataFrame):
+    import pyarrow as pa
+
+    schema = form13_schema()
+    df = stg_df[schema.names].copy()
+    df[FILING_MANAGER_CIK_COL] = df[FILING_MANAGER_CIK_COL].astype('int64')
+    df[VALUE_COL] = df[VALUE_COL].astype(float)
+    df[SHARES_COL] = df[SHARES_COL].astype('int64')
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def replaceable_dataset(path: str) -> bool:
+    # Nothing there yet, or a directory holding only the report period partitions write_parquet writes. Dot files
+    # are skipped like dataset readers skip them
+    if not os.path.exists(path):
+        return True
+    return os.path.isdir(path) and all(
+        x.startswith('.') or (x.startswith(f'{REPORT_PERIOD_COL}=') and os.path.isdir(os.path.join(path, x)))
+        for x in os.listdir(path))
+
+
+def remove_dataset(path: str):
+    if not replaceable_dataset(path):
+        raise ValueError(f'{path} exists and is not a form 13 parquet dataset, refusing to replace it')
+    shutil.rmtree(path, ignore_errors=True)
+
+
+@timed()
+def write_parquet(stg_df: pd.DataFrame, output_directory: str, part_name: Optional[str] = None):
+    """
+    Write aggregated rows as a parquet dataset partitioned by report period, one reportCalendarOrQuarter=YYYY-MM-DD
+    directory per quarter. Without a part_name the dataset is replaced, with one the files are added alongside
+    those already written.
+    """
+    import pyarrow.parquet as pq
+
+    if part_name is None:
+        remove_dataset(output_directory)
+        part_name = 'part'
+    pq.write_to_dataset(to_arrow_table(stg_df), output_directory, partition_cols=[REPORT_PERIOD_COL],
+                        basename_template=part_name + '-{i}.parquet', existing_data_behavior='overwrite_or_ignore')
+
+
 # This data contains duplicates where an asset is reported more than once for the same filing manager within the same
 # report calendar/quarter.
 # See for example https://www.sec.gov/Archives/edgar/data/1962636/000139834423009400/0001398344-23-009400.txt
 # for our intents and purposes we will sum over values and shares to aggregate the duplicates out
-def aggregate_data(filings_df: pd.DataFrame) -> pd.DataFrame:
-    print(f'=== Aggregating Parsed Data ===')
+@timed()
+def aggregate_data(filings_df: pd.DataFrame, verbose: bool = True) -> pd.DataFrame:
+    if verbose:
+        print(f'=== Aggregating Parsed Data ===')
     return filings_df.groupby([SOURCE_ID_COL, FILING_MANAGER_CIK_COL, FILING_MANAGER_ADDRESS_COL, FILING_MANAGER_NAME_COL, REPORT_PERIOD_COL,
                                COMPANY_CUSIP6_COL, COMPANY_CUSIP_COL]) \
         .agg({COMPANY_NAME_COL: 'first', VALUE_COL: "sum", SHARES_COL: "sum"}).reset_index()
 
 
+@timed()
+def normalize_data(filings_df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Split parsed rows into a manager dimension keyed by managerCik and report period, a company dimension keyed by
+    cusip, and a holdings fact table referencing both by integer key. Duplicate holdings are summed like in
+    aggregate_data, but grouped on integer codes only. Managers take the name and address of their first filing in
+    the period and companies the first name reported for their cusip.
+    """
+    print(f'=== Normalizing Parsed Data ===')
+    filings_df = filings_df.dropna(subset=[SOURCE_ID_COL, FILING_MANAGER_CIK_COL, REPORT_PERIOD_COL, COMPANY_CUSIP_COL])
+    cik_codes, ciks = pd.factorize(filings_df[FILING_MANAGER_CIK_COL], sort=True)
+    period_codes, periods = pd.factorize(filings_df[REPORT_PERIOD_COL], sort=True)
+    manager_keys = pd.factorize(cik_codes.astype('int64') * len(periods) + period_codes, sort=True)[0]
+    company_keys = pd.factorize(filings_df[COMPANY_CUSIP_COL], sort=True)[0]
+    source_codes, sources = pd.factorize(filings_df[SOURCE_ID_COL], sort=True)
+    keyed_df = filings_df.assign(**{MANAGER_KEY_COL: manager_keys, COMPANY_KEY_COL: company_keys})
+
+    managers_df = keyed_df.drop_duplicates(MANAGER_KEY_COL).sort_values(MANAGER_KEY_COL)[
+        [MANAGER_KEY_COL, FILING_MANAGER_CIK_COL, REPORT_PERIOD_COL, FILING_MANAGER_NAME_COL,
+         FILING_MANAGER_ADDRESS_COL]].reset_index(drop=True)
+    companies_df = keyed_df.drop_duplicates(COMPANY_KEY_COL).sort_values(COMPANY_KEY_COL)[
+        [COMPANY_KEY_COL, COMPANY_CUSIP_COL, COMPANY_CUSIP6_COL, COMPANY_NAME_COL]].reset_index(drop=True)
+    holdings_df = keyed_df[[VALUE_COL, SHARES_COL]] \
+        .groupby([source_codes, manager_keys, company_keys]).sum() \
+        .rename_axis([SOURCE_ID_COL, MANAGER_KEY_COL, COMPANY_KEY_COL]).reset_index() \
+        .astype({MANAGER_KEY_COL: 'int32', COMPANY_KEY_COL: 'int32'})
+    holdings_df[SOURCE_ID_COL] = pd.Categorical.from_codes(holdings_df[SOURCE_ID_COL], categories=sources)
+    return managers_df, companies_df, holdings_df
+
+
+def filter_tables(managers_df: pd.DataFrame, companies_df: pd.DataFrame, holdings_df: pd.DataFrame,
+                  top_n_periods: int) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    # Same as filter_data for the normalized tables
+    print(f'=== Filtering Data ===')
+    periods = sorted(managers_df[REPORT_PERIOD_COL].unique())
+    top_periods = periods[-min(len(periods), top_n_periods):] if top_n_periods > 0 else []
+    managers_df = managers_df[managers_df[REPORT_PERIOD_COL].isin(top_periods)]
+    holdings_df = holdings_df[holdings_df[MANAGER_KEY_COL].isin(managers_df[MANAGER_KEY_COL])]
+    companies_df = companies_df[companies_df[COMPANY_KEY_COL].isin(holdings_df[COMPANY_KEY_COL])]
+    return managers_df, companies_df, holdings_df
+
+
+def write_tables(managers_df: pd.DataFrame, companies_df: pd.DataFrame, holdings_df: pd.DataFrame, output_file: str):
+    stem = os.path.splitext(output_file)[0]
+    for name, df in [('managers', managers_df), ('companies', companies_df), ('holdings', holdings_df)]:
+        print(f'Writing {df.shape[0]:,} rows to {stem}-{name}.csv')
+        df.to_csv(f'{stem}-{name}.csv', index=False)
+        METRICS.count('bytes_written', os.path.getsize(f'{stem}-{name}.csv'))
+
+
 def filter_data(filings_df: pd.DataFrame, top_n_periods: int) -> pd.DataFrame:
     print(f'=== Filtering Data ===')
     periods_df = filings_df[[REPORT_PERIOD_COL, VALUE_COL]] \
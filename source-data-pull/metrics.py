@@ -0,0 +1,248 @@
+import contextlib
+import cProfile
+import functools
+import heapq
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional
+
+try:
+    import pyinstrument
+except ImportError:  # pyinstrument is optional, cProfile is always available
+    pyinstrument = None
+
+DEFAULT_SLOWEST = 20
+PROFILERS = ['cprofile', 'pyinstrument']
+PROMETHEUS_PREFIX = 'sec_edgar'
+# Exit status of a script that finished but left failed items a later run may still get, e.g. after a network
+# error. run-pipeline.py runs such a stage again next time without blocking the stages after it
+RETRY_EXIT_CODE = 3
+
+
+class Metrics:
+    """
+    Thread-safe counters, timers and the slowest items of a run. Counters are plain totals such as bytes downloaded.
+    Timers keep the call count, total and max seconds of a stage or function. The slowest items, e.g. filings, are
+    kept per kind in a bounded heap.
+
+    Process pool workers have their own registry. They return drain() from their task and the parent merge()s it.
+    """
+
+    def __init__(self, slowest: int = DEFAULT_SLOWEST):
+        self.lock = threading.Lock()
+        self.slowest_count = slowest
+        self.counters = {}
+        self.timers = {}
+        self.slowest = {}
+
+    def count(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, name: str, seconds: float):
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    def observe(self, kind: str, item: str, seconds: float):
+        """Time one item of a kind, e.g. a filing, and keep it if it is among the slowest."""
+        self.add_time(kind, seconds)
+        with self.lock:
+            heap = self.slowest.setdefault(kind, [])
+            if len(heap) < self.slowest_count:
+                heapq.heappush(heap, (seconds, item))
+            elif seconds > heap[0][0]:
+                heapq.heapreplace(heap, (seconds, item))
+
+    @contextlib.contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {'counters': dict(self.counters),
+                    'timers': {name: list(timer) for name, timer in self.timers.items()},
+                    'slowest': {kind: list(heap) for kind, heap in self.slowest.items()}}
+
+    def drain(self) -> Dict:
+        """Snapshot and reset, so a worker process reports each task's metrics once."""
+        with self.lock:
+            snapshot = {'counters': self.counters, 'timers': self.timers, 'slowest': self.slowest}
+            self.counters, self.timers, self.slowest = {}, {}, {}
+        return snapshot
+
+    def merge(self, snapshot: Optional[Dict]):
+        if not snapshot:
+            return
+        for name, value in snapshot['counters'].items():
+            self.count(name, value)
+        with self.lock:
+            for name, (calls, seconds, max_seconds) in snapshot['timers'].items():
+                timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+                timer[0] += calls
+                timer[1] += seconds
+                timer[2] = max(timer[2], max_seconds)
+        for kind, items in snapshot['slowest'].items():
+            with self.lock:
+                heap = self.slowest.setdefault(kind, [])
+                for item in items:
+                    if len(heap) < self.slowest_count:
+                        heapq.heappush(heap, tuple(item))
+                    elif item[0] > heap[0][0]:
+                        heapq.heapreplace(heap, tuple(item))
+
+    def report(self, script: str, wall_seconds: float) -> Dict:
+        snapshot = self.snapshot()
+        return {
+            'script': script,
+            'argv': sys.argv[1:],
+            'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'wall_seconds': round(wall_seconds, 3),
+            'counters': snapshot['counters'],
+            'timers': {name: {'calls': calls, 'seconds': round(seconds, 6), 'max_seconds': round(max_seconds, 6),
+                              'mean_seconds': round(seconds / calls, 6) if calls else 0.0}
+                       for name, (calls, seconds, max_seconds) in sorted(snapshot['timers'].items())},
+            'slowest': {kind: [{'item': item, 'seconds': round(seconds, 3)} for seconds, item in sorted(heap, reverse=True)]
+                        for kind, heap in snapshot['slowest'].items()},
+        }
+
+
+# One registry per process, shared by every module of a script
+METRICS = Metrics()
+
+
+def timed(name: str = None) -> Callable:
+    """Decorator adding each call's time to a timer named after the function unless `name` is given."""
+
+    def decorator(func: Callable) -> Callable:
+        timer_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                METRICS.add_time(timer_name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def metric_name(*parts: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', '_'.join(parts)).lower()
+
+
+def prometheus_text(report: Dict) -> str:
+    # Textfile collector format, one gauge per counter and a count, sum and max per timer, labelled by script
+    labels = f'{{script="{report["script"]}"}}'
+    lines = [f'# TYPE {PROMETHEUS_PREFIX}_run_wall_seconds gauge',
+             f'{PROMETHEUS_PREFIX}_run_wall_seconds{labels} {report["wall_seconds"]}',
+             f'# TYPE {PROMETHEUS_PREFIX}_run_finished_timestamp_seconds gauge',
+             f'{PROMETHEUS_PREFIX}_run_finished_timestamp_seconds{labels} {time.time():.0f}']
+    for name, value in sorted(report['counters'].items()):
+        metric = metric_name(PROMETHEUS_PREFIX, name)
+        lines.extend([f'# TYPE {metric} gauge', f'{metric}{labels} {value}'])
+    for name, timer in report['timers'].items():
+        metric = metric_name(PROMETHEUS_PREFIX, name)
+        lines.extend([f'# TYPE {metric}_calls gauge', f'{metric}_calls{labels} {timer["calls"]}',
+                      f'# TYPE {metric}_seconds gauge', f'{metric}_seconds{labels} {timer["seconds"]}',
+                      f'# TYPE {metric}_max_seconds gauge', f'{metric}_max_seconds{labels} {timer["max_seconds"]}'])
+    return '\n'.join(lines) + '\n'
+
+
+def path_bytes(path: str) -> int:
+    """Size of a file, or of all files under a directory such as a parquet dataset."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, x)) for root, dirs, files in os.walk(path) for x in files)
+
+
+def write_atomic(path: str, text: str):
+    # The textfile collector may read at any moment, so never leave a partial file under the final name
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.part', 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(path + '.part', path)
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument('-mr', '--metrics-report', required=False,
+                        help='Write a json report of stage timers, counters and the slowest items to this path')
+    parser.add_argument('-mp', '--metrics-textfile', required=False,
+                        help='Write the metrics in Prometheus textfile format to this path, e.g. a .prom file in '
+                             'the node exporter textfile directory')
+    parser.add_argument('-pr', '--profile', required=False, choices=PROFILERS,
+                        help='Profile the main thread of the run and print the hottest functions')
+    parser.add_argument('-po', '--profile-output', required=False,
+                        help='Also save the profile here, pstats for cprofile and html for pyinstrument')
+
+
+@contextlib.contextmanager
+def profiled(profiler: Optional[str], output: str = None) -> Iterator[None]:
+    if profiler is None:
+        yield
+        return
+    if profiler == 'pyinstrument':
+        if pyinstrument is None:
+            raise RuntimeError('pyinstrument is not installed, pip install pyinstrument or use --profile cprofile')
+        profile = pyinstrument.Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            print(profile.output_text(unicode=False, color=False))
+            if output is not None:
+                write_atomic(output, profile.output_html())
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(30)
+        print(stream.getvalue())
+        if output is not None:
+            profile.dump_stats(output)
+
+
+def run_with_metrics(script: str, args, run: Callable, *run_args) -> int:
+    """Run a script's main work under the --profile hook and write the --metrics-* outputs once it finishes."""
+    start = time.perf_counter()
+    try:
+        with profiled(args.profile, args.profile_output):
+            return run(*run_args)
+    finally:
+        report = METRICS.report(script, time.perf_counter() - start)
+        print_summary(report)
+        if args.metrics_report is not None:
+            write_atomic(args.metrics_report, json.dumps(report, indent=2) + '\n')
+        if args.metrics_textfile is not None:
+            write_atomic(args.metrics_textfile, prometheus_text(report))
+
+
+def print_summary(report: Dict, slowest: int = 5):
+    print(f'=== {report["script"]} metrics over {report["wall_seconds"]:,.1f}s ===')
+    for name, timer in sorted(report['timers'].items(), key=lambda x: -x[1]['seconds']):
+        print(f'{name}: {timer["calls"]:,} calls, {timer["seconds"]:,.2f}s total, {timer["mean_seconds"] * 1000:,.1f}ms '
+              f'mean, {timer["max_seconds"]:,.2f}s max')
+    for name, value in sorted(report['counters'].items()):
+        print(f'{name}: {value:,.0f}')
+    for kind, items in report['slowest'].items():
+        print(f'--- Slowest {kind}: ' + ', '.join(f'{x["item"]} ({x["seconds"]:,.2f}s)' for x in items[:slowest]))
@@ -0,0 +1,329 @@
+import argparse
+import datetime
+import functools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import synthetic_filings
+from edgar_cache import FilingCache, cache_key
+
+# Synthetic 13F filers have ciks from here on, synthetic_filings gives manager `seed` this cik plus the seed
+MANAGER_CIK_BASE = 2000000
+FIRST_FILING_YEAR = 2015
+STATS_PATH = '/__stats'
+SUBMISSIONS_ROUTE = re.compile(r'^/submissions/CIK(\d{10})\.json$')
+DAILY_INDEX_ROUTE = re.compile(r'^/Archives/edgar/daily-index/(\d{4})/QTR([1-4])/master\.(\d{8})\.idx$')
+FORM_INDEX_ROUTE = re.compile(r'^/Archives/edgar/full-index/(\d{4})/QTR([1-4])/form\.idx$')
+# 10-Ks are fetched by the folder path the submissions API leads to, 13Fs by the flat path the indexes list
+FORM10K_ROUTE = re.compile(r'^/Archives/edgar/data/(\d+)/\d{18}/\d{10}-(\d{2})-\d{6}\.txt$')
+FORM13_ROUTE = re.compile(r'^/Archives/edgar/data/(\d+)/\d{10}-(\d{2})-(\d{3})(\d{3})\.txt$')
+
+
+class Faults:
+    """
+    Misbehaviour injected into responses, drawn from a seeded random generator so a run can be repeated: latency
+    with jitter, 429 or 503 errors carrying Retry-After, and bodies cut off halfway. With max_requests_per_second set,
+    requests beyond it within any one second are refused with 429 like EDGAR's fair access limit.
+    """
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0,
+                 error_statuses: List[int] = (429, 503), retry_after: int = 1, truncate_rate: float = 0,
+                 max_requests_per_second: float = None, seed: int = 0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.error_statuses = list(error_statuses)
+        self.retry_after = retry_after
+        self.truncate_rate = truncate_rate
+        self.max_requests_per_second = max_requests_per_second
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent = deque()
+
+    def plan(self) -> Tuple[float, Optional[int], bool]:
+        """(seconds to wait, error status or None, whether to truncate the body) of the next response."""
+        with self.lock:
+            delay = max(self.latency + self.rng.uniform(-self.jitter, self.jitter), 0.0)
+            status = self.rng.choice(self.error_statuses) if self.rng.random() < self.error_rate else None
+            truncate = self.rng.random() < self.truncate_rate
+            if self.max_requests_per_second is not None:
+                now = time.monotonic()
+                while self.recent and self.recent[0] <= now - 1:
+                    self.recent.popleft()
+                if len(self.recent) >= self.max_requests_per_second:
+                    status = 429
+                else:
+                    self.recent.append(now)
+        return delay, status, truncate
+
+
+class SyntheticEdgar:
+    """
+    Deterministic EDGAR content built from synthetic_filings: the submissions API, daily and quarterly form indexes
+    and the 10-K and 13F-HR submissions they point to. With a recorded filing cache, responses recorded there by
+    the downloaders are served instead wherever they exist.
+    """
+
+    def __init__(self, size_10k_mb: float = 2, rows_13f: int = 500, filings_per_day: int = 20, managers: int = 5000,
+                 companies: int = 5000, recorded: FilingCache = None, recorded_only: bool = False):
+        self.size_10k_bytes = int(size_10k_mb * 1e6)
+        self.rows_13f = rows_13f
+        self.filings_per_day = min(filings_per_day, 999)
+        self.managers = managers
+        self.companies = companies
+        self.recorded = recorded
+        self.recorded_only = recorded_only
+
+    def response(self, path: str) -> Optional[Tuple[bytes, str]]:
+        """(body, content type) of a path, None if EDGAR would answer 404."""
+        if self.recorded is not None:
+            for host in ['www.sec.gov', 'data.sec.gov']:
+                body = self.recorded.get(cache_key(host + path))
+                if body is not None:
+                    return body, 'application/json' if path.endswith('.json') else 'text/plain'
+            if self.recorded_only:
+                return None
+        match = SUBMISSIONS_ROUTE.match(path)
+        if match:
+            return self.submissions(int(match.group(1))), 'application/json'
+        match = DAILY_INDEX_ROUTE.match(path)
+        if match:
+            date = datetime.datetime.strptime(match.group(3), '%Y%m%d').date()
+            # No index is published for weekends
+            return (self.daily_index(date), 'text/plain') if date.weekday() < 5 else None
+        match = FORM_INDEX_ROUTE.match(path)
+        if match:
+            return self.form_index(int(match.group(1)), int(match.group(2))), 'text/plain'
+        match = FORM10K_ROUTE.match(path)
+        if match:
+            return self.form10k(int(match.group(1)), int(match.group(2))), 'text/plain'
+        match = FORM13_ROUTE.match(path)
+        if match and int(match.group(1)) >= MANAGER_CIK_BASE:
+            filed = datetime.date(2000 + int(match.group(2)), 1, 1) + datetime.timedelta(days=int(match.group(3)) - 1)
+            return self.form13(int(match.group(1)), filed), 'text/plain'
+        return None
+
+    def day_filings(self, date: datetime.date) -> List[Tuple[int, str]]:
+        # (cik, path) of the 13F-HRs filed on a weekday, a rotating subset of the managers
+        filings = []
+        for i in range(self.filings_per_day):
+            cik = MANAGER_CIK_BASE + (date.toordinal() * self.filings_per_day + i) % self.managers
+            filings.append((cik, f'edgar/data/{cik}/{cik:010d}-{date:%y}-{date.timetuple().tm_yday:03d}{i:03d}.txt'))
+        return filings
+
+    @functools.lru_cache(maxsize=256)
+    def submissions(self, cik: int) -> bytes:
+        # A 10-K every year plus 10-Qs and 8-Ks, newest first like the submissions API
+        recent = {'accessionNumber': [], 'filingDate': [], 'form': [], 'primaryDocument': []}
+        today = datetime.date.today()
+        for year in range(today.year, FIRST_FILING_YEAR - 1, -1):
+            form10k_filed = datetime.date(year, 2, 1) + datetime.timedelta(days=cik % 50)
+            filings = [('8-K', datetime.date(year, 11, 20)), ('10-Q', datetime.date(year, 11, 1)),
+                       ('10-Q', datetime.date(year, 8, 1)), ('8-K', datetime.date(year, 6, 15)),
+                       ('10-Q', datetime.date(year, 5, 1)), ('10-K', form10k_filed)]
+            for sequence, (form, filed) in enumerate(filings, 1):
+                if filed > today:
+                    continue
+                recent['accessionNumber'].append(f'{cik:010d}-{filed:%y}-{sequence:06d}')
+                recent['filingDate'].append(filed.isoformat())
+                recent['form'].append(form)
+                recent['primaryDocument'].append(f'syn-{filed:%Y%m%d}.htm')
+        return json.dumps({'cik': str(cik), 'name': synthetic_filings.company_name(cik),
+                           'filings': {'recent': recent, 'files': []}}).encode('utf-8')
+
+    @functools.lru_cache(maxsize=256)
+    def daily_index(self, date: datetime.date) -> bytes:
+        lines = ['Description:           Daily Index of EDGAR Dissemination Feed by Company Name',
+                 f'Last Data Received:    {date:%B %d, %Y}', 'Comments:              webmaster@sec.gov', '', '',
+                 'CIK|Company Name|Form Type|Date Filed|Filename', '-' * 80]
+        for cik, path in self.day_filings(date):
+            lines.append(f'{cik}|SYNTHETIC MANAGER {cik - MANAGER_CIK_BASE} LLC|13F-HR|{date:%Y%m%d}|{path}')
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+    @functools.lru_cache(maxsize=64)
+    def form_index(self, year: int, quarter: int) -> bytes:
+        # Fixed width rows sorted by form type, with 10-Ks and 8-Ks around the 13F-HRs as in the real index
+        rows = []
+        date = datetime.date(year, quarter * 3 - 2, 1)
+        while date.month <= quarter * 3 and date.year == year and date <= datetime.date.today():
+            if date.weekday() < 5:
+                for cik, path in self.day_filings(date):
+                    rows.append(('13F-HR', f'SYNTHETIC MANAGER {cik - MANAGER_CIK_BASE} LLC', cik, date, path))
+                for form in ['10-K', '8-K']:
+                    cik = 1000000 + date.toordinal() % self.companies
+                    rows.append((form, synthetic_filings.company_name(cik), cik, date,
+                                 f'edgar/data/{cik}/{cik:010d}-{date:%y}-{date.timetuple().tm_yday:06d}.txt'))
+            date += datetime.timedelta(days=1)
+        lines = ['Description:           Master Index of EDGAR Dissemination Feed by Form Type',
+                 f'Last Data Received:    {min(date, datetime.date.today()):%B %d, %Y}', '',
+                 f'{"Form Type":<12}{"Company Name":<62}{"CIK":<12}{"Date Filed":<12}File Name', '-' * 140]
+        for form, name, cik, filed, path in sorted(rows):
+            lines.append(f'{form:<12}{name:<62}{cik:<12}{filed.isoformat():<12}{path}')
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+    @functools.lru_cache(maxsize=32)
+    def form10k(self, cik: int, year: int) -> bytes:
+        return synthetic_filings.synthetic_10k_submission(cik * 100 + year, self.size_10k_bytes)
+
+    @functools.lru_cache(maxsize=256)
+    def form13(self, cik: int, filed: datetime.date) -> bytes:
+        # Filed for the quarter that ended before the filing date
+        report_period = datetime.date(filed.year, (filed.month - 1) // 3 * 3 + 1, 1) - datetime.timedelta(days=1)
+        return synthetic_filings.synthetic_13f_submission(cik - MANAGER_CIK_BASE, self.rows_13f, self.companies,
+                                                          report_period).encode('utf-8')
+
+
+class ServerStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.statuses = Counter()
+        self.bytes_sent = 0
+
+    def record(self, status: int, bytes_sent: int):
+        with self.lock:
+            self.statuses[status] += 1
+            self.bytes_sent += bytes_sent
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            seconds = time.monotonic() - self.start
+            requests = sum(self.statuses.values())
+            return {'requests': requests, 'statuses': {str(k): v for k, v in sorted(self.statuses.items())},
+                    'bytes_sent': self.bytes_sent, 'seconds': round(seconds, 3),
+                    'requests_per_second': round(requests / max(seconds, 1e-9), 3)}
+
+
+class EdgarHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive like www.sec.gov, which the 10-K downloader's connection pool relies on
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, which Nagle's algorithm would hold back for a delayed ack each time
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        # Requests may carry an absolute url, and EDGAR tolerates doubled slashes
+        path = re.sub('/+', '/', urlsplit(self.path).path)
+        if path == STATS_PATH:
+            self.send_body(200, json.dumps(self.server.stats.snapshot()).encode('utf-8'), 'application/json')
+            return
+        delay, status, truncate = self.server.faults.plan()
+        if delay > 0:
+            time.sleep(delay)
+        if status is not None:
+            reason = self.responses.get(status, ('Error',))[0]
+            self.send_body(status, f'{status} {reason}\n'.encode('utf-8'), 'text/plain',
+                           {'Retry-After': str(self.server.faults.retry_after)})
+            return
+        response = self.server.edgar.response(path)
+        if response is None:
+            self.send_body(404, b'Not Found\n', 'text/plain')
+            return
+        self.send_body(200, *response, truncate=truncate)
+
+    def send_body(self, status: int, body: bytes, content_type: str, headers: Dict[str, str] = None,
+                  truncate: bool = False):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if truncate:
+            # Promise the whole body but send half of it and hang up, as a dropped connection would
+            body = body[:len(body) // 2]
+            self.close_connection = True
+        self.wfile.write(body)
+        self.server.stats.record(status, len(body))
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(args) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((args.host, args.port), EdgarHandler)
+    server.daemon_threads = True
+    recorded = None if args.recorded_cache is None else FilingCache(args.recorded_cache)
+    server.edgar = SyntheticEdgar(args.size_10k_mb, args.rows_13f, args.filings_per_day, args.managers,
+                                  args.companies, recorded, args.recorded_only)
+    server.faults = Faults(args.latency_ms, args.jitter_ms, args.error_rate, args.error_statuses, args.retry_after,
+                           args.truncate_rate, args.max_requests_per_second, args.seed)
+    server.stats = ServerStats()
+    server.verbose = args.verbose
+    return server
+
+
+def main() -> int:
+    args = parse_args()
+    server = make_server(args)
+    url = f'http://{args.host}:{server.server_address[1]}'
+    print(f'=== Serving mock EDGAR on {url}, point the downloaders at it with --edgar-url {url} --data-url {url} '
+          f'or EDGAR_URL={url} EDGAR_DATA_URL={url} ===')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    stats = server.stats.snapshot()
+    print(f'=== Served {stats["requests"]:,} requests in {stats["seconds"]:,.1f}s '
+          f'({stats["requests_per_second"]:,.1f}/s), {stats["bytes_sent"] / 1e6:,.1f} MB ===')
+    for status, count in stats['statuses'].items():
+        print(f'{status}: {count:,}')
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='serve synthetic or recorded EDGAR submissions, indexes and filings locally, with injected '
+                    'latency, errors and truncated bodies, to load test the downloaders offline',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-H', '--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('-p', '--port', type=int, default=8000, help='Port to listen on, 0 for any free port')
+    parser.add_argument('-ks', '--size-10k-mb', type=float, default=2,
+                        help='Size of each synthetic inline XBRL 10-K document in MB, exhibits add half as much')
+    parser.add_argument('-fr', '--rows-13f', type=int, default=500,
+                        help='Number of infoTable rows of each synthetic 13F-HR')
+    parser.add_argument('-fd', '--filings-per-day', type=int, default=20,
+                        help='Number of 13F-HRs in each weekday\'s index, at most 999')
+    parser.add_argument('-m', '--managers', type=int, default=5000,
+                        help='Number of distinct 13F filers the daily filings rotate through')
+    parser.add_argument('-co', '--companies', type=int, default=5000,
+                        help='Number of companies the 13F holdings are drawn from')
+    parser.add_argument('-rc', '--recorded-cache', required=False,
+                        help='Filing cache directory written by the downloaders, whose recorded responses are '
+                             'served in place of synthetic ones')
+    parser.add_argument('-ro', '--recorded-only', action='store_true',
+                        help='Answer 404 for anything not in the recorded cache instead of synthesizing it')
+    parser.add_argument('-l', '--latency-ms', type=float, default=0, help='Delay before each response')
+    parser.add_argument('-j', '--jitter-ms', type=float, default=0,
+                        help='Random extra or lesser delay of up to this much on each response')
+    parser.add_argument('-er', '--error-rate', type=float, default=0,
+                        help='Fraction of requests answered with one of --error-statuses')
+    parser.add_argument('-es', '--error-statuses', type=int, nargs='+', default=[429, 503],
+                        help='Error statuses to answer with, each with a Retry-After header')
+    parser.add_argument('-ra', '--retry-after', type=int, default=1,
+                        help='Whole seconds sent in the Retry-After header of errors, the only number the header '
+                             'allows')
+    parser.add_argument('-tr', '--truncate-rate', type=float, default=0,
+                        help='Fraction of responses whose connection is dropped halfway through the body')
+    parser.add_argument('-mr', '--max-requests-per-second', type=float, required=False,
+                        help='Refuse requests beyond this many in any one second with 429, like EDGAR\'s 10 per '
+                             'second fair access limit')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='Seed of the injected faults')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Log every request')
+    args = parser.parse_args()
+    if args.retry_after < 0:
+        parser.error('--retry-after must be zero or more seconds')
+    return args
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
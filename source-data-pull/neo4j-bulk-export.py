@@ -0,0 +1,228 @@
+import argparse
+import csv
+import importlib.util
+import json
+import os
+from typing import Dict, Iterator, List, Tuple
+
+from metrics import METRICS, add_metrics_arguments, path_bytes, run_with_metrics
+
+# One node file per label and one relationship file per type, with neo4j-admin typed headers. Each label has its own
+# ID space so e.g. a cik can't collide with a chunk id
+NODE_FILES = {
+    'Company': ('companies.csv', ['cusip6:ID(Company)', 'cik:long', 'names:string[]', 'cusip:string[]']),
+    'Manager': ('managers.csv', ['managerCik:ID(Manager)', 'managerName', 'managerAddress']),
+    'Form': ('forms.csv', ['formId:ID(Form)', 'source', 'cik:long', 'cusip6']),
+    'Chunk': ('chunks.csv', ['chunkId:ID(Chunk)', 'formId', 'cik:long', 'cusip6', 'source', 'f10kItem',
+                             'chunkSeqId:int', 'text']),
+}
+RELATIONSHIP_FILES = {
+    'OWNS_STOCK_IN': ('owns-stock-in.csv', [':START_ID(Manager)', ':END_ID(Company)', 'reportCalendarOrQuarter:date',
+                                            'value:double', 'shares:long']),
+    'FILED': ('filed.csv', [':START_ID(Company)', ':END_ID(Form)']),
+    'PART_OF': ('part-of.csv', [':START_ID(Chunk)', ':END_ID(Form)']),
+    'SECTION': ('section.csv', [':START_ID(Form)', ':END_ID(Chunk)', 'f10kItem']),
+    'NEXT': ('next.csv', [':START_ID(Chunk)', ':END_ID(Chunk)']),
+}
+# neo4j-admin's default array delimiter
+ARRAY_DELIMITER = ';'
+
+
+def main() -> int:
+    args = parse_args()
+    return run_with_metrics('neo4j-bulk-export', args, run, args)
+
+
+def run(args) -> int:
+    os.makedirs(args.output_directory, exist_ok=True)
+    exporter = BulkExporter(args.output_directory)
+    failures = export_form10k(exporter, args.form10k_directory)
+    export_form13(exporter, args.form13, args.chunk_rows)
+    if args.chunk_directory is not None:
+        export_chunks(exporter, args.chunk_directory)
+    exporter.close()
+    METRICS.count('bytes_written', path_bytes(args.output_directory))
+
+    print(f'=== Wrote neo4j-admin import files to {args.output_directory} ===')
+    for name, count in exporter.counts.items():
+        print(f'{name}: {count:,}')
+    print(f'===== Skipped {exporter.skipped:,} duplicate or unmatched rows ====')
+    print(f'===== Had {len(failures)} unreadable 10K files ====')
+    for file_name, error in failures:
+        print(f'{file_name}: {error}')
+    print('Import into a new, stopped database with:')
+    print(import_command(args.output_directory, args.database))
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='export the 10k, form 13 and chunk data to csvs for an offline neo4j-admin database import',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-k', '--form10k-directory', required=False, default='form10k/data/form10k-clean',
+                        help='Directory of parsed 10K json files from f10k-download-parse-format.py')
+    parser.add_argument('-f', '--form13', required=False, default='form13/data/form13.csv',
+                        help='Formatted form 13 csv, or directory of a form 13 parquet dataset')
+    parser.add_argument('-c', '--chunk-directory', required=False,
+                        help='Directory of chunk jsonl files. Chunk nodes and relationships are skipped without it')
+    parser.add_argument('-o', '--output-directory', required=False, default='data/neo4j-import',
+                        help='Directory to write the import files to')
+    parser.add_argument('-d', '--database', required=False, default='neo4j',
+                        help='Database name used in the printed neo4j-admin command')
+    parser.add_argument('-cr', '--chunk-rows', required=False, type=int, default=1_000_000,
+                        help='Number of form 13 rows read at a time')
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    return args
+
+
+def load_subset_module():
+    # f10k-f13-subset.py reads both the csv and parquet form 13 outputs. Its name is not a valid module name, so
+    # load it by path
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'f10k-f13-subset.py')
+    spec = importlib.util.spec_from_file_location('f10k_f13_subset', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class BulkExporter:
+    """
+    Writes the node and relationship csvs for neo4j-admin database import. Node files are deduplicated on their ID,
+    first row wins, and relationships are only written once both their end nodes have been, since the import
+    rejects relationships to missing nodes.
+    """
+
+    def __init__(self, output_directory: str):
+        self.files = {}
+        self.writers = {}
+        for name, (file_name, header) in list(NODE_FILES.items()) + list(RELATIONSHIP_FILES.items()):
+            self.files[name] = open(os.path.join(output_directory, file_name), 'w', newline='', encoding='utf-8')
+            self.writers[name] = csv.writer(self.files[name])
+            self.writers[name].writerow(header)
+        self.ids = {label: set() for label in NODE_FILES}
+        self.counts = {name: 0 for name in self.files}
+        self.skipped = 0
+
+    def has_node(self, label: str, node_id: str) -> bool:
+        return node_id in self.ids[label]
+
+    def node(self, label: str, node_id: str, *properties) -> bool:
+        if node_id in self.ids[label]:
+            self.skipped += 1
+            return False
+        self.ids[label].add(node_id)
+        self.writers[label].writerow([node_id, *properties])
+        self.counts[label] += 1
+        return True
+
+    def relationship(self, rel_type: str, start_id: str, end_id: str, *properties):
+        self.writers[rel_type].writerow([start_id, end_id, *properties])
+        self.counts[rel_type] += 1
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+
+
+def to_array(values: List) -> str:
+    # The array delimiter can't be escaped, so it is swapped out of the values
+    return ARRAY_DELIMITER.join(str(x).replace(ARRAY_DELIMITER, ',') for x in values)
+
+
+def to_cik(value) -> str:
+    # CIKs come zero padded from EDGAR and as plain numbers from pandas, ID them by their numeric value
+    return str(int(float(value))) if value is not None and str(value).strip() not in ('', 'nan') else ''
+
+
+def export_form10k(exporter: BulkExporter, directory_path: str) -> List[Tuple[str, str]]:
+    file_names = sorted(x for x in os.listdir(directory_path) if x.endswith('.json'))
+    print(f'=== Exporting {len(file_names):,} 10K forms from {directory_path} ===')
+    failures = []
+    for file_name in file_names:
+        try:
+            with open(os.path.join(directory_path, file_name)) as file:
+                f10_k = json.load(file)
+        except Exception as e:
+            failures.append((file_name, repr(e)))
+            continue
+        form_id = file_name[:-len('.json')]
+        cik = to_cik(f10_k['cik'])
+        cusip6 = str(f10_k['cusip6'])
+        exporter.node('Company', cusip6, cik, to_array(f10_k.get('names', [])), to_array(f10_k.get('cusip', [])))
+        if exporter.node('Form', form_id, f10_k['source'], cik, cusip6):
+            exporter.relationship('FILED', cusip6, form_id)
+    return failures
+
+
+def export_form13(exporter: BulkExporter, form13_path: str, chunk_rows: int):
+    # Holdings are keyed by manager, company and report period. A filing's rows for the share classes of one company,
+    # its cusips under one cusip6, have their value and shares summed like in aggregate_data. When another filing,
+    # i.e. another source, holds the same manager, company and period, the one read last wins. aggregate_data sorts
+    # the input by source, the filing's file name, so that is not the latest filing by date. 13F-HR/A amendments are
+    # not downloaded at all. The relationships are written once all rows are read
+    print(f'=== Exporting form 13 holdings from {form13_path} ===')
+    subset = load_subset_module()
+    holdings = {}
+    for chunk in subset.iter_form13_chunks(form13_path, chunk_rows=chunk_rows):
+        for row in chunk.itertuples(index=False):
+            manager_cik = to_cik(row.managerCik)
+            cusip6 = str(row.cusip6)
+            holding = (manager_cik, cusip6, str(row.reportCalendarOrQuarter))
+            if holding in holdings:
+                exporter.skipped += 1
+                totals = holdings[holding]
+                if totals[0] == row.source:
+                    totals[1] += row.value
+                    totals[2] += row.shares
+                    continue
+            holdings[holding] = [row.source, row.value, row.shares]
+            if not exporter.has_node('Manager', manager_cik):
+                exporter.node('Manager', manager_cik, row.managerName, row.managerAddress)
+            if not exporter.has_node('Company', cusip6):
+                exporter.node('Company', cusip6, '', to_array([row.companyName]), to_array([row.cusip]))
+    for (manager_cik, cusip6, period), (source, value, shares) in holdings.items():
+        exporter.relationship('OWNS_STOCK_IN', manager_cik, cusip6, period, value, shares)
+
+
+def iter_chunk_records(directory_path: str) -> Iterator[Dict]:
+    for file_name in sorted(x for x in os.listdir(directory_path) if x.endswith('.jsonl')):
+        with open(os.path.join(directory_path, file_name)) as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def export_chunks(exporter: BulkExporter, directory_path: str):
+    # Chunk records as made by get_and_split_txt_data in the notebooks. Each section's chunks must come in
+    # chunkSeqId order to be linked with NEXT
+    print(f'=== Exporting chunks from {directory_path} ===')
+    previous = {}
+    for chunk in iter_chunk_records(directory_path):
+        form_id = chunk['formId']
+        if not exporter.has_node('Form', form_id):
+            exporter.skipped += 1
+            continue
+        if not exporter.node('Chunk', chunk['chunkId'], form_id, to_cik(chunk['cik']), chunk['cusip6'],
+                             chunk['source'], chunk['f10kItem'], chunk['chunkSeqId'], chunk['text']):
+            continue
+        exporter.relationship('PART_OF', chunk['chunkId'], form_id)
+        section = (form_id, chunk['f10kItem'])
+        if chunk['chunkSeqId'] == 0:
+            exporter.relationship('SECTION', form_id, chunk['chunkId'], chunk['f10kItem'])
+        elif section in previous:
+            exporter.relationship('NEXT', previous[section], chunk['chunkId'])
+        previous[section] = chunk['chunkId']
+
+
+def import_command(output_directory: str, database: str) -> str:
+    nodes = [f'--nodes={label}={os.path.join(output_directory, file_name)}'
+             for label, (file_name, header) in NODE_FILES.items()]
+    relationships = [f'--relationships={rel_type}={os.path.join(output_directory, file_name)}'
+                     for rel_type, (file_name, header) in RELATIONSHIP_FILES.items()]
+    return ' \\\n    '.join([f'neo4j-admin database import full {database}', '--multiline-fields=true',
+                             f'--array-delimiter="{ARRAY_DELIMITER}"', *nodes, *relationships])
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
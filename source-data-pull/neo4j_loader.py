@@ -0,0 +1,259 @@
+import random
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+
+import pandas as pd
+
+try:
+    from neo4j.exceptions import ServiceUnavailable, SessionExpired, TransientError
+    TRANSIENT_ERRORS = (ServiceUnavailable, SessionExpired, TransientError)
+except ImportError:  # the driver is optional, e.g. when loading through a fake driver
+    TRANSIENT_ERRORS = ()
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_RETRIES = 5
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 30
+
+
+def make_map(x):
+    if type(x) == str:
+        return x, x
+    elif type(x) == tuple:
+        return x
+    else:
+        raise Exception("Entry must of type string or tuple")
+
+
+def make_set_clause(prop_names: Sequence[str], element_name='n', item_name='rec'):
+    clause_list = []
+    for prop_name in prop_names:
+        clause_list.append(f'{element_name}.{prop_name} = {item_name}.{prop_name}')
+    return 'SET ' + ', '.join(clause_list)
+
+
+def make_node_merge_query(node_key_name: str, node_label: str, cols: Sequence[str]):
+    template = f'''UNWIND $recs AS rec\nMERGE(n:{node_label} {{{node_key_name}: rec.{node_key_name}}})'''
+    prop_names = [x for x in cols if x != node_key_name]
+    if len(prop_names) > 0:
+        template = template + '\n' + make_set_clause(prop_names)
+    return template + '\nRETURN count(n) AS nodeLoadedCount'
+
+
+def make_rel_merge_query(source_target_labels: Union[Tuple[str, str], str],
+                         source_node_key: Union[Tuple[str, str], str],
+                         target_node_key: Union[Tuple[str, str], str],
+                         rel_type: str,
+                         cols: Sequence[str],
+                         rel_key: str = None):
+    source_target_label_map = make_map(source_target_labels)
+    source_node_key_map = make_map(source_node_key)
+    target_node_key_map = make_map(target_node_key)
+
+    merge_statement = f'MERGE(s)-[r:{rel_type}]->(t)'
+    if rel_key is not None:
+        merge_statement = f'MERGE(s)-[r:{rel_type} {{{rel_key}: rec.{rel_key}}}]->(t)'
+
+    template = f'''\tUNWIND $recs AS rec
+    MATCH(s:{source_target_label_map[0]} {{{source_node_key_map[0]}: rec.{source_node_key_map[1]}}})
+    MATCH(t:{source_target_label_map[1]} {{{target_node_key_map[0]}: rec.{target_node_key_map[1]}}})\n\t''' + merge_statement
+    prop_names = [x for x in cols if x not in [rel_key, source_node_key_map[1], target_node_key_map[1]]]
+    if len(prop_names) > 0:
+        template = template + '\n\t' + make_set_clause(prop_names, 'r')
+    return template + '\n\tRETURN count(r) AS relLoadedCount'
+
+
+def batches(xs, n=100):
+    n = max(1, n)
+    return [xs[i:i + n] for i in range(0, len(xs), n)]
+
+
+def partition_of(key, partitions: int) -> int:
+    # Stable across processes, unlike hash() of a str
+    return zlib.crc32(str(key).encode('utf-8')) % partitions
+
+
+def is_transient(e: Exception) -> bool:
+    # Driver errors carry a status code, e.g. Neo.TransientError.Transaction.DeadlockDetected, so fake drivers can
+    # raise anything with such a code
+    return isinstance(e, TRANSIENT_ERRORS) or str(getattr(e, 'code', '') or '').startswith('Neo.TransientError')
+
+
+class LoadStats:
+    """Counts and timing of one load_nodes or load_rels call."""
+
+    def __init__(self, name: str, total: int):
+        self.name = name
+        self.total = total
+        self.rows = 0
+        self.loaded = 0
+        self.batches = 0
+        self.retries = 0
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def add_batch(self, rows: int, loaded: int, retries: int):
+        with self.lock:
+            self.rows += rows
+            self.loaded += loaded
+            self.batches += 1
+            self.retries += retries
+            self.seconds = time.perf_counter() - self.start
+            print(f'Loaded {self.rows:,} of {self.total:,} {self.name} ({self.rows_per_second:,.0f} rows/s)')
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+    def __repr__(self):
+        return (f'LoadStats({self.name}: {self.rows:,} rows, {self.loaded:,} loaded, {self.batches:,} batches, '
+                f'{self.retries:,} retries, {self.seconds:,.1f}s, {self.rows_per_second:,.0f} rows/s)')
+
+
+class Neo4jLoader:
+    """
+    Batched, parallel MERGE loading through a neo4j driver. Each batch runs in its own write transaction and is
+    retried with exponential backoff on transient errors such as deadlocks and leader switches.
+
+    Any object with the driver's session(database=...) -> begin_transaction() -> run(query, **params) -> single()
+    interface works, so loads can be run against a fake driver as well as a live database.
+    """
+
+    def __init__(self, driver, database: str = 'neo4j', batch_size: int = DEFAULT_BATCH_SIZE,
+                 workers: int = DEFAULT_WORKERS, max_retries: int = DEFAULT_MAX_RETRIES,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.driver = driver
+        self.database = database
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_retries = max_retries
+        self.sleep = sleep
+
+    def run_batch(self, query: str, recs: List[Dict]) -> Tuple[int, int]:
+        # Returns the count the query returns and the number of retries it took
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.driver.session(database=self.database) as session:
+                    with session.begin_transaction() as tx:
+                        record = tx.run(query, recs=recs).single()
+                        tx.commit()
+                return (record[0] if record is not None else 0), attempt
+            except Exception as e:
+                if not is_transient(e) or attempt == self.max_retries:
+                    raise
+                delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt)
+                self.sleep(delay * random.uniform(0.5, 1.0))
+
+    def run_batches(self, query: str, groups: List[List[List[Dict]]], stats: LoadStats):
+        # Groups run one after the other, with the batches within a group in parallel
+        def run(recs: List[Dict]):
+            loaded, retries = self.run_batch(query, recs)
+            stats.add_batch(len(recs), loaded, retries)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for group in groups:
+                list(executor.map(run, group))
+
+    def load_nodes(self, node_df: pd.DataFrame, node_key_col: str, node_label: str) -> LoadStats:
+        """
+        MERGE one node per distinct node_key_col value, setting the other columns as properties. Keys are deduplicated
+        first, so parallel batches never MERGE the same node and can all run at once.
+        """
+        node_df = node_df.drop_duplicates(subset=[node_key_col], keep='last')
+        query = make_node_merge_query(node_key_col, node_label, list(node_df.columns))
+        print(f'======  loading {node_label} nodes  ======')
+        print(f'\nUsing This Cypher Query:\n```\n{query}\n```\n')
+        stats = LoadStats(f'{node_label} nodes', node_df.shape[0])
+        self.run_batches(query, [batches(node_df.to_dict('records'), self.batch_size)], stats)
+        print(stats)
+        return stats
+
+    def load_rels(self, rel_df: pd.DataFrame,
+                  source_target_labels: Union[Tuple[str, str], str],
+                  source_node_key: Union[Tuple[str, str], str],
+                  target_node_key: Union[Tuple[str, str], str],
+                  rel_type: str,
+                  rel_key: str = None) -> LoadStats:
+        """
+        MERGE relationships between existing nodes, in groups of batches from rel_groups() so that parallel
+        transactions do not lock the same nodes.
+        """
+        source_label, target_label = make_map(source_target_labels)
+        source_col = make_map(source_node_key)[1]
+        target_col = make_map(target_node_key)[1]
+        query = make_rel_merge_query(source_target_labels, source_node_key, target_node_key, rel_type,
+                                     list(rel_df.columns), rel_key)
+        print(f'======  loading {rel_type} relationships  ======')
+        print(f'\nUsing This Cypher Query:\n```\n{query}\n```\n')
+        stats = LoadStats(f'{rel_type} relationships', rel_df.shape[0])
+        groups = rel_groups(rel_df.to_dict('records'), source_col, target_col, self.workers, self.batch_size,
+                            source_label == target_label)
+        self.run_batches(query, groups, stats)
+        print(stats)
+        return stats
+
+
+def pair_rounds(n: int) -> List[List[Tuple[int, int]]]:
+    # Every pair i < j of n partitions exactly once, in rounds where no partition appears twice, by the circle
+    # method of round-robin scheduling. An odd n gets a dummy partition, whose pairs are left out
+    players = list(range(n)) + ([None] if n % 2 else [])
+    m = len(players)
+    rounds = []
+    for r in range(m - 1):
+        pairs = [(players[k], players[m - 1 - k]) for k in range(m // 2)]
+        rounds.append([(min(i, j), max(i, j)) for i, j in pairs if i is not None and j is not None])
+        players = [players[0], players[-1]] + players[1:-1]
+    return rounds
+
+
+def rel_groups(recs: List[Dict], source_col: str, target_col: str, workers: int, batch_size: int,
+               same_label: bool = False) -> List[List[List[Dict]]]:
+    """
+    Split relationship rows into groups of batches to run one group after the other, with the batches within a group
+    in parallel. Rows are placed on a workers x workers grid by the hash of their source and target keys.
+
+    When the source and target labels differ, round r takes cells (i, (i + r) % workers) for every i, so no two
+    batches in a group share a source or a target partition. With the same label on both ends, e.g. NEXT between
+    Chunks, a node can be the source of one row and the target of another, so it is the partitions of both keys
+    together that must not overlap. The diagonal cells (i, i) run as one round, then each pair of cells (i, j) and
+    (j, i) runs as one bucket, in rounds of pairs that share no partition.
+    """
+    n = max(1, workers)
+    grid = [[[] for _ in range(n)] for _ in range(n)]
+    for rec in recs:
+        grid[partition_of(rec[source_col], n)][partition_of(rec[target_col], n)].append(rec)
+    if same_label:
+        rounds = [[grid[i][i] for i in range(n)]]
+        rounds.extend([grid[i][j] + grid[j][i] for i, j in pairs] for pairs in pair_rounds(n))
+    else:
+        rounds = [[grid[i][(i + r) % n] for i in range(n)] for r in range(n)]
+    groups = []
+    for buckets in rounds:
+        # The j-th batches of every bucket run together, so batches of one bucket never run at once
+        bucket_batches = [batches(bucket, batch_size) for bucket in buckets]
+        groups.extend([[x[j] for x in bucket_batches if j < len(x)]
+                       for j in range(max(map(len, bucket_batches), default=0))])
+    return groups
+
+
+def load_nodes(driver, node_df: pd.DataFrame, node_key_col: str, node_label: str,
+               batch_size: int = DEFAULT_BATCH_SIZE, workers: int = DEFAULT_WORKERS,
+               database: str = 'neo4j') -> LoadStats:
+    return Neo4jLoader(driver, database, batch_size, workers).load_nodes(node_df, node_key_col, node_label)
+
+
+def load_rels(driver, rel_df: pd.DataFrame,
+              source_target_labels: Union[Tuple[str, str], str],
+              source_node_key: Union[Tuple[str, str], str],
+              target_node_key: Union[Tuple[str, str], str],
+              rel_type: str,
+              rel_key: str = None,
+              batch_size: int = DEFAULT_BATCH_SIZE, workers: int = DEFAULT_WORKERS,
+              database: str = 'neo4j') -> LoadStats:
+    return Neo4jLoader(driver, database, batch_size, workers).load_rels(
+        rel_df, source_target_labels, source_node_key, target_node_key, rel_type, rel_key)
@@ -0,0 +1,253 @@
+import argparse
+import contextlib
+import gc
+import importlib.util
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import synthetic_filings
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+class Benchmark:
+    """A parser function run over prepared input of `input_bytes` bytes holding `rows` rows, 0 if rows don't apply."""
+
+    def __init__(self, name: str, run: Callable, input_bytes: int, rows: int = 0):
+        self.name = name
+        self.run = run
+        self.input_bytes = input_bytes
+        self.rows = rows
+
+
+def load_script(path: str, name: str):
+    # The scripts' names are not valid module names, so load them by path
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPT_DIRECTORY, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_benchmarks(args, work_directory: str) -> List[Benchmark]:
+    f10k = load_script('form10k/f10k-download-parse-format.py', 'f10k_download_parse_format')
+    f13 = load_script('form13/f13-parse-and-format.py', 'f13_parse_and_format')
+    subset = load_script('f10k-f13-subset.py', 'f10k_f13_subset')
+
+    print(f'=== Generating {args.count_10k} 10-Ks of {args.size_10k_mb} MB, {args.count_13f} 13Fs of {args.rows_13f:,} '
+          f'rows and {args.rows_holdings:,} holdings ===')
+    submissions = [synthetic_filings.synthetic_10k_submission(args.seed + i, int(args.size_10k_mb * 1e6))
+                   for i in range(args.count_10k)]
+    texts = [x.decode('utf-8') for x in submissions]
+    docs = [f10k.extract_10_k(x) for x in texts]
+    filings = [synthetic_filings.synthetic_13f_submission(args.seed + i, args.rows_13f, args.companies)
+               for i in range(args.count_13f)]
+    info_tables = [f13.xmltodict.parse(x.split('<XML>')[2].split('</XML>')[0].strip()) for x in filings]
+    holdings_df = synthetic_filings.holdings_frame(args.rows_holdings, args.companies, args.managers, args.seed)
+    companies_df = synthetic_filings.companies_frame(args.companies, args.seed)
+    holdings_path = os.path.join(work_directory, 'form13.csv')
+    holdings_df.to_csv(holdings_path, index=False)
+    form13_df = subset.get_form13_df(holdings_path)
+    output = os.path.join(work_directory, 'joined')
+
+    submission_bytes = sum(len(x) for x in submissions)
+    doc_bytes = sum(len(x.encode('utf-8')) for x in docs)
+    filing_bytes = sum(len(x.encode('utf-8')) for x in filings)
+    filing_rows = args.count_13f * args.rows_13f
+    holdings_bytes = os.path.getsize(holdings_path)
+    benchmarks = [
+        Benchmark('extract_10_k', lambda: [f10k.extract_10_k(x) for x in texts], submission_bytes),
+        Benchmark('stream_10_k', lambda: [f10k.stream_10_k(io.BytesIO(x)) for x in submissions], submission_bytes),
+    ]
+    for engine in f10k.TEXT_ENGINES:
+        benchmarks.extend([
+            Benchmark(f'beautify_text[{engine}]', lambda e=engine: [f10k.beautify_text(x, e) for x in docs], doc_bytes),
+            Benchmark(f'extract_section_text[{engine}]',
+                      lambda e=engine: [f10k.extract_section_text(x, e) for x in docs], doc_bytes),
+        ])
+    for engine in ['iterparse', 'xmltodict']:
+        benchmarks.append(Benchmark(f'extract_dicts[{engine}]',
+                                    lambda e=engine: [f13.extract_dicts(x, e) for x in filings], filing_bytes,
+                                    filing_rows))
+    benchmarks.extend([
+        Benchmark('strip_ns', lambda: [f13.strip_ns(x) for x in info_tables], filing_bytes, filing_rows),
+        Benchmark('aggregate_data', lambda: f13.aggregate_data(holdings_df, False), holdings_bytes, len(holdings_df)),
+        # The --normalized output, which sums duplicate holdings grouped on integer keys instead of seven columns
+        Benchmark('normalize_data', lambda: f13.normalize_data(holdings_df), holdings_bytes, len(holdings_df)),
+        Benchmark('merge_join', lambda: subset.merge_join(companies_df, form13_df, output + '.10k.csv',
+                                                          output + '.13f.csv'), holdings_bytes, len(holdings_df)),
+        Benchmark('stream_join', lambda: subset.stream_join(companies_df, holdings_path, output + '.10k.csv',
+                                                            output + '.13f.csv', chunk_rows=args.chunk_rows),
+                  holdings_bytes, len(holdings_df)),
+    ])
+    if args.keep_fixtures is not None:
+        synthetic_filings.write_10k_fixtures(os.path.join(args.keep_fixtures, 'form10k-raw'), args.count_10k,
+                                             int(args.size_10k_mb * 1e6), args.seed)
+        synthetic_filings.write_13f_fixtures(os.path.join(args.keep_fixtures, 'form13-raw'), args.count_13f,
+                                             args.rows_13f, args.companies, args.seed)
+        holdings_df.to_csv(os.path.join(args.keep_fixtures, 'form13.csv'), index=False)
+        companies_df.to_csv(os.path.join(args.keep_fixtures, 'cik-10k-urls.csv'), index=False)
+        print(f'--- Saved the fixtures to {args.keep_fixtures}')
+    return benchmarks
+
+
+def measure(benchmark: Benchmark, repeat: int) -> Dict:
+    """
+    Time `repeat` runs after one warm-up run, then measure peak memory in one more run under tracemalloc, which
+    slows the code down and so is never timed. tracemalloc sees Python and numpy allocations but not those made
+    inside lxml or pyarrow.
+    """
+    seconds = []
+    # The functions print progress, which would otherwise flood the output and be timed with them
+    with contextlib.redirect_stdout(io.StringIO()):
+        benchmark.run()
+        for _ in range(repeat):
+            gc.collect()
+            start = time.perf_counter()
+            benchmark.run()
+            seconds.append(time.perf_counter() - start)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            benchmark.run()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    median = statistics.median(seconds)
+    return {
+        'median_seconds': round(median, 6),
+        'min_seconds': round(min(seconds), 6),
+        'max_seconds': round(max(seconds), 6),
+        'input_bytes': benchmark.input_bytes,
+        'rows': benchmark.rows,
+        'mb_per_second': round(benchmark.input_bytes / 1e6 / max(median, 1e-9), 3),
+        'rows_per_second': round(benchmark.rows / max(median, 1e-9), 1) if benchmark.rows else None,
+        'peak_mb': round(peak_bytes / 1e6, 3),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIRECTORY, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fixture_parameters(args) -> Dict:
+    # Results are only comparable with a baseline measured on the same fixtures
+    return {name: getattr(args, name) for name in ['seed', 'count_10k', 'size_10k_mb', 'count_13f', 'rows_13f',
+                                                   'rows_holdings', 'companies', 'managers', 'chunk_rows']}
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Print each benchmark's change against the baseline and return those slower by more than `threshold`."""
+    if baseline['fixtures'] != results['fixtures']:
+        print(f'--- Baseline fixtures {baseline["fixtures"]} differ from {results["fixtures"]}, timings are not '
+              f'comparable')
+    print(f'=== Compared with the baseline of {baseline["finished_at"]}, commit {baseline["commit"]} ===')
+    regressions = []
+    for name, result in results['benchmarks'].items():
+        before = baseline['benchmarks'].get(name)
+        if before is None:
+            print(f'{name}: not in the baseline')
+            continue
+        change = result['median_seconds'] / max(before['median_seconds'], 1e-9) - 1
+        memory_change = result['peak_mb'] - before['peak_mb']
+        print(f'{name}: {before["median_seconds"] * 1000:,.1f}ms -> {result["median_seconds"] * 1000:,.1f}ms '
+              f'({change:+.1%}), peak {before["peak_mb"]:,.1f} -> {result["peak_mb"]:,.1f} MB ({memory_change:+,.1f})')
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main() -> int:
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as work_directory:
+        benchmarks = make_benchmarks(args, work_directory)
+        if args.benchmarks:
+            benchmarks = [x for x in benchmarks if any(x.name.startswith(name) for name in args.benchmarks)]
+        print(f'=== Running {len(benchmarks)} benchmarks, {args.repeat} runs each ===')
+        results = {}
+        for benchmark in benchmarks:
+            results[benchmark.name] = result = measure(benchmark, args.repeat)
+            rows = f', {result["rows_per_second"]:,.0f} rows/s' if result['rows_per_second'] else ''
+            print(f'{benchmark.name}: {result["median_seconds"] * 1000:,.1f}ms median, '
+                  f'{result["mb_per_second"]:,.1f} MB/s{rows}, {result["peak_mb"]:,.1f} MB peak')
+
+    results = {
+        'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'fixtures': fixture_parameters(args),
+        'benchmarks': results,
+    }
+    regressions = []
+    if args.compare is not None:
+        with open(os.path.join(args.baseline_directory, args.compare + '.json')) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        print(f'===== Had {len(regressions)} benchmarks more than {args.threshold:.0%} slower than the baseline ====')
+        for name in regressions:
+            print(name)
+    if args.save is not None:
+        path = os.path.join(args.baseline_directory, args.save + '.json')
+        os.makedirs(args.baseline_directory, exist_ok=True)
+        with open(path + '.part', 'w') as file:
+            json.dump(results, file, indent=2)
+        os.replace(path + '.part', path)
+        print(f'=== Saved the results as baseline {path} ===')
+    return 1 if regressions else 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='benchmark the 10k and form 13 parsers and the subset join on deterministic synthetic filings',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-b', '--benchmarks', required=False, nargs='+',
+                        help='Only run the benchmarks whose names start with these, e.g. extract_dicts merge_join')
+    parser.add_argument('-r', '--repeat', required=False, type=int, default=5,
+                        help='Number of timed runs of each benchmark, the median is reported')
+    parser.add_argument('-sd', '--seed', required=False, type=int, default=0,
+                        help='Seed of the synthetic filings, the same seed always gives the same filings')
+    parser.add_argument('-kc', '--count-10k', required=False, type=int, default=3,
+                        help='Number of synthetic 10-K submissions')
+    parser.add_argument('-ks', '--size-10k-mb', required=False, type=float, default=5,
+                        help='Size of each synthetic inline XBRL 10-K document in MB, exhibits add half as much')
+    parser.add_argument('-fc', '--count-13f', required=False, type=int, default=20,
+                        help='Number of synthetic 13F-HR submissions')
+    parser.add_argument('-fr', '--rows-13f', required=False, type=int, default=5000,
+                        help='Number of infoTable rows of each 13F-HR submission')
+    parser.add_argument('-hr', '--rows-holdings', required=False, type=int, default=1000000,
+                        help='Number of parsed holdings rows for aggregate_data and the subset joins')
+    parser.add_argument('-co', '--companies', required=False, type=int, default=5000,
+                        help='Number of companies the 13F holdings are drawn from, and of 10-K filers in the joins')
+    parser.add_argument('-m', '--managers', required=False, type=int, default=500,
+                        help='Number of managers of the parsed holdings rows')
+    parser.add_argument('-cr', '--chunk-rows', required=False, type=int, default=100000,
+                        help='Number of form 13 rows per chunk of the stream join')
+    parser.add_argument('-bd', '--baseline-directory', required=False, default='data/benchmarks',
+                        help='Directory of saved baselines')
+    parser.add_argument('-s', '--save', required=False,
+                        help='Save the results as a baseline of this name, e.g. the branch or commit')
+    parser.add_argument('-c', '--compare', required=False,
+                        help='Compare the results with the saved baseline of this name, exiting with 1 if any '
+                             'benchmark got slower than --threshold')
+    parser.add_argument('-t', '--threshold', required=False, type=float, default=0.1,
+                        help='Fraction by which a benchmark\'s median may grow before it counts as a regression')
+    parser.add_argument('-k', '--keep-fixtures', required=False,
+                        help='Also write the synthetic filings to this directory, as form10k-raw and form13-raw '
+                             'directories of submissions and form13.csv and cik-10k-urls.csv, to run the scripts on')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
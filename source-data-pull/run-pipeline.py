@@ -0,0 +1,254 @@
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List
+
+from edgar_cache import DEFAULT_CACHE_DIRECTORY
+from edgar_rate import DEFAULT_REQUESTS_PER_SECOND
+from edgar_urls import DEFAULT_DATA_URL, DEFAULT_EDGAR_URL
+from metrics import RETRY_EXIT_CODE
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = 'pipeline-state.json'
+# Stage results that let the stages after it run
+FINISHED_RESULTS = ('ran', 'skipped', 'planned', 'retry')
+
+
+class Stage:
+    """
+    One step of the pipeline: a script run with `args`, reading `inputs` and writing `outputs`. A stage is skipped
+    when its outputs exist and neither its command nor the size and mtime of anything under its inputs changed since
+    it last succeeded. A script exiting with RETRY_EXIT_CODE finished but left failed items to retry, so its stage is
+    run again next time, while the stages after it still run on what it did get.
+    """
+
+    def __init__(self, name: str, script: str, args: List[str], inputs: List[str], outputs: List[str],
+                 after: List[str] = ()):
+        self.name = name
+        self.script = script
+        self.args = args
+        self.inputs = inputs
+        self.outputs = outputs
+        self.after = list(after)
+
+    @property
+    def command(self) -> List[str]:
+        return [sys.executable, '-u', os.path.join(SCRIPT_DIRECTORY, self.script), *self.args]
+
+    def fingerprint(self) -> str:
+        digest = hashlib.sha256(json.dumps(self.command[2:]).encode('utf-8'))
+        for path in self.inputs:
+            for entry in path_entries(path):
+                digest.update(json.dumps(entry).encode('utf-8'))
+        return digest.hexdigest()
+
+
+def path_entries(path: str) -> List:
+    # (path, size, mtime_ns) of a file or of every file under a directory, cheap enough for tens of thousands of
+    # raw filings since no file is read
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return [(path, stat.st_size, stat.st_mtime_ns)]
+    entries = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file_name in sorted(files):
+            stat = os.stat(os.path.join(root, file_name))
+            entries.append((os.path.relpath(os.path.join(root, file_name), path), stat.st_size, stat.st_mtime_ns))
+    return entries
+
+
+def make_stages(args) -> List[Stage]:
+    # The 10-K and form 13 branches only meet at the subset join, so they run side by side
+    data = os.path.abspath(args.data_directory)
+    urls = os.path.join(data, 'cik-10k-urls.csv')
+    form10k = os.path.join(data, 'form10k-clean')
+    form13_raw = os.path.join(data, 'form13-raw')
+    form13 = os.path.join(data, f'form13.{args.form13_format}')
+    user = ['--user-name', args.user_name, '--user-email', args.user_email]
+    cache = ['--no-cache'] if args.no_cache else ['--cache-directory', os.path.abspath(args.cache_directory)]
+    # The downloaders running side by side share one request budget per server through the governor's state file
+    edgar = ['--edgar-url', args.edgar_url, '--requests-per-second', str(args.requests_per_second)]
+    return [
+        Stage('10k-urls', 'form10k/f10k-get-urls.py',
+              ['--input-file', os.path.abspath(args.mapping_file), '--output-file', urls,
+               '--start-date', args.start_date_10k, '--end-date', args.end_date_10k, *user, *cache, *edgar,
+               '--data-url', args.data_url],
+              inputs=[os.path.abspath(args.mapping_file)], outputs=[urls]),
+        Stage('10k-download', 'form10k/f10k-download-parse-format.py',
+              ['--input-file', urls, '--output-directory', form10k, '--workers', str(args.workers),
+               '--pipeline', *user, *cache, *edgar],
+              inputs=[urls], outputs=[form10k], after=['10k-urls']),
+        Stage('13f-download', 'form13/f13-download.py',
+              ['--output-directory', form13_raw + '/', '--start-date', args.start_date_13f,
+               '--end-date', args.end_date_13f, '--workers', str(args.workers), *cache, *edgar],
+              inputs=[], outputs=[form13_raw]),
+        Stage('13f-parse', 'form13/f13-parse-and-format.py',
+              ['--input-directory', form13_raw + '/', '--output-file', form13, '--output-format', args.form13_format,
+               '--workers', str(args.parse_workers), '--shard-directory', os.path.join(data, 'form13-shards')],
+              inputs=[form13_raw], outputs=[form13], after=['13f-download']),
+        Stage('subset', 'f10k-f13-subset.py',
+              ['--left-10k', urls, '--right-13', form13, '--join-mode', 'stream'],
+              inputs=[urls, form13], outputs=[urls + '.joined.csv', form13 + '.joined.csv'],
+              after=['10k-urls', '13f-parse']),
+    ]
+
+
+class PipelineState:
+    """Fingerprint of each stage's last successful run, kept as json next to the data."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stages = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                self.stages = json.load(file)
+
+    def is_current(self, stage: Stage, fingerprint: str) -> bool:
+        with self.lock:
+            recorded = self.stages.get(stage.name, {}).get('fingerprint')
+        return recorded == fingerprint and all(os.path.exists(x) for x in stage.outputs)
+
+    def record(self, stage: Stage, fingerprint: str, seconds: float):
+        with self.lock:
+            self.stages[stage.name] = {'fingerprint': fingerprint, 'seconds': round(seconds, 3),
+                                       'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+            with open(self.path + '.part', 'w') as file:
+                json.dump(self.stages, file, indent=2)
+            os.replace(self.path + '.part', self.path)
+
+
+def run_stage(stage: Stage, state: PipelineState, force: bool, dry_run: bool) -> str:
+    fingerprint = stage.fingerprint()
+    if not force and state.is_current(stage, fingerprint):
+        print(f'--- [{stage.name}] inputs unchanged, skipping')
+        return 'skipped'
+    print(f'=== [{stage.name}] {" ".join(stage.command[2:])} ===')
+    if dry_run:
+        return 'planned'
+    start = time.perf_counter()
+    # Each script resolves its default paths against its own directory, as when run by hand
+    with subprocess.Popen(stage.command, cwd=os.path.dirname(os.path.join(SCRIPT_DIRECTORY, stage.script)),
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1) as process:
+        for line in process.stdout:
+            print(f'[{stage.name}] {line}', end='')
+    seconds = time.perf_counter() - start
+    if process.returncode == RETRY_EXIT_CODE:
+        # Not recorded, so the next run tries the failed items again
+        print(f'=== [{stage.name}] done in {seconds:,.1f}s with failures to retry ===')
+        return 'retry'
+    if process.returncode != 0:
+        raise RuntimeError(f'{stage.script} exited with {process.returncode}')
+    state.record(stage, fingerprint, seconds)
+    print(f'=== [{stage.name}] done in {seconds:,.1f}s ===')
+    return 'ran'
+
+
+def run_pipeline(stages: List[Stage], state: PipelineState, force: List[str] = (), dry_run: bool = False) -> Dict:
+    """
+    Run stages as soon as every stage they come after has finished, independent ones in parallel. A failed stage
+    stops only the stages that come after it, one that finished with failures to retry does not. Returns each stage's
+    result: ran, skipped, planned, retry, blocked, or the error it failed with.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+        running = {}
+        while len(results) < len(stages):
+            for stage in stages:
+                if stage.name in results or stage.name in running.values():
+                    continue
+                upstream = [results.get(x) for x in stage.after]
+                if any(x is not None and x not in FINISHED_RESULTS for x in upstream):
+                    results[stage.name] = 'blocked'
+                elif all(x is not None for x in upstream):
+                    # A stage whose upstream ran is fingerprinted against the new outputs, so it can still skip. In
+                    # a dry run those outputs don't exist yet, so it is planned as well
+                    stage_force = 'all' in force or stage.name in force or (dry_run and 'planned' in upstream)
+                    running[executor.submit(run_stage, stage, state, stage_force, dry_run)] = stage.name
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    results[name] = repr(e)
+    return {name: results[name] for name in by_name}
+
+
+def main() -> int:
+    args = parse_args()
+    os.makedirs(args.data_directory, exist_ok=True)
+    stages = make_stages(args)
+    unknown = set(args.force) - {stage.name for stage in stages} - {'all'}
+    if unknown:
+        print(f'Unknown stages to force: {", ".join(sorted(unknown))}')
+        return 2
+    state = PipelineState(os.path.join(args.data_directory, STATE_FILE))
+    start = time.perf_counter()
+    results = run_pipeline(stages, state, args.force, args.dry_run)
+
+    print(f'=== Pipeline finished in {time.perf_counter() - start:,.1f}s ===')
+    for name, result in results.items():
+        print(f'{name}: {result}')
+    failures = [name for name, result in results.items() if result not in FINISHED_RESULTS]
+    retries = [name for name, result in results.items() if result == 'retry']
+    print(f'===== Had {len(failures)} failed or blocked stages, {len(retries)} with failures to retry ====')
+    if failures:
+        return 1
+    return RETRY_EXIT_CODE if retries else 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='run the 10k and form 13 pulls and the subset join as one pipeline, skipping unchanged stages',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-m', '--mapping-file', required=False,
+                        default=os.path.join(SCRIPT_DIRECTORY, 'form10k', 'cik-sample-mapping.csv'),
+                        help='CIK-CUSIP mapping csv to pull 10Ks for')
+    parser.add_argument('-d', '--data-directory', required=False, default='data/pipeline',
+                        help='Directory all stage outputs and the pipeline state are written to')
+    parser.add_argument('-ks', '--start-date-10k', default='2022-01-01', help='10K start date, yyyy-mm-dd')
+    parser.add_argument('-ke', '--end-date-10k', default='2023-01-01', help='10K end date, yyyy-mm-dd')
+    parser.add_argument('-fs', '--start-date-13f', default='2022-12-31', help='Form 13 start date, yyyy-mm-dd')
+    parser.add_argument('-fe', '--end-date-13f', default='2023-12-22', help='Form 13 end date, yyyy-mm-dd')
+    parser.add_argument('-ff', '--form13-format', choices=['csv', 'parquet'], default='csv',
+                        help='Output format of the parsed form 13 data')
+    parser.add_argument('-w', '--workers', type=int, default=8,
+                        help='Concurrent downloads per downloader, all sharing the --requests-per-second cap')
+    parser.add_argument('-r', '--requests-per-second', type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help='Cap on requests per second to SEC EDGAR, shared by every downloader running at once')
+    parser.add_argument('-pw', '--parse-workers', type=int, default=os.cpu_count(),
+                        help='Number of processes parsing form 13 filings')
+    parser.add_argument('-un', '--user-name', default='Neo4j',
+                        help='Name to use for user agent in SEC EDGAR calls')
+    parser.add_argument('-ue', '--user-email', default='sales@neo4j.com',
+                        help='Email address to use for user agent in SEC EDGAR calls')
+    parser.add_argument('-c', '--cache-directory', default=DEFAULT_CACHE_DIRECTORY,
+                        help='Directory of the compressed EDGAR filing cache shared by the downloaders')
+    parser.add_argument('-nc', '--no-cache', action='store_true',
+                        help='Always download from EDGAR and do not cache responses')
+    parser.add_argument('-eu', '--edgar-url', default=DEFAULT_EDGAR_URL,
+                        help='Base url of EDGAR filings and indexes, e.g. http://localhost:8000 for '
+                             'mock-edgar-server.py')
+    parser.add_argument('-du', '--data-url', default=DEFAULT_DATA_URL,
+                        help='Base url of the EDGAR submissions API')
+    parser.add_argument('-f', '--force', nargs='+', default=[],
+                        help='Stages to run even if their inputs are unchanged, or all')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='Print the stages that would run without running them')
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
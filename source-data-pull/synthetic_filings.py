@@ -0,0 +1,281 @@
+import datetime
+import os
+import random
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Sections of a 10-K in filing order, with the share of the document's size each gets
+SECTION_SHARES = [('1', 0.15), ('1A', 0.2), ('1B', 0.01), ('2', 0.02), ('3', 0.02), ('4', 0.01), ('5', 0.03),
+                  ('6', 0.01), ('7', 0.2), ('7A', 0.03), ('8', 0.27), ('9', 0.01), ('9A', 0.02), ('9B', 0.01)]
+WORDS = ('the company our revenue net income operating results fiscal year increase decrease compared to prior '
+         'period primarily due higher lower costs customers products services market risk interest rate foreign '
+         'currency exchange debt credit facility cash flows liquidity capital resources segment growth demand '
+         'supply chain regulatory environment competition may could adversely affect business financial condition '
+         'and of in for with on as by from which were was').split()
+XBRL_CONCEPTS = ['us-gaap:Revenues', 'us-gaap:CostOfRevenue', 'us-gaap:OperatingIncomeLoss', 'us-gaap:NetIncomeLoss',
+                 'us-gaap:Assets', 'us-gaap:Liabilities', 'us-gaap:StockholdersEquity',
+                 'us-gaap:CashAndCashEquivalentsAtCarryingValue']
+TITLES_OF_CLASS = ['COM', 'COM', 'COM', 'COM NEW', 'CL A', 'CLASS A', 'ORD SHS', 'SHS', 'COMMON STOCK', 'SPONSORED ADR',
+                   'PUT', 'CALL', 'NOTE 2.500% 6/1', 'UNIT 99/99/9999']
+# Filers declare the information table namespace in different ways, iter_info_tables and xmltodict must read all
+INFO_TABLE_NAMESPACES = [('ns1:', 'xmlns:ns1'), ('', 'xmlns'), ('n1:', 'xmlns:n1')]
+INFO_TABLE_URI = 'http://www.sec.gov/edgar/document/thirteenf/informationtable'
+STYLE = "color:#000000;font-family:'Times New Roman',sans-serif;font-size:10pt;font-weight:{};line-height:120%"
+
+
+def company_cusip(i: int) -> str:
+    # 6 character issuer, 2 character issue and a check digit. 7919 and 999983 are coprime, so issuers are unique for
+    # the first 999983 companies
+    return f'{(i * 7919 + 100003) % 999983:06d}10{i % 10}'
+
+
+def company_cik(i: int) -> int:
+    return 1000000 + i
+
+
+def company_name(i: int) -> str:
+    return f'SYNTHETIC {i} CORP'
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def paragraph(rng: random.Random) -> str:
+    text = ' '.join(sentence(rng, rng.randint(8, 30)) for _ in range(rng.randint(2, 6)))
+    if rng.random() < 0.05:
+        # Word's broken cross reference marker, which extract_text removes
+        text += ' Error! Bookmark not defined.'
+    return (f'<div style="margin-top:12pt;text-align:justify"><span style="{STYLE.format(400)}">'
+            f'{text.replace(" ", "&#160;", 1)}</span></div>\n')
+
+
+def xbrl_table(rng: random.Random, fact_id: int) -> Tuple[str, int]:
+    rows = []
+    for concept in rng.sample(XBRL_CONCEPTS, rng.randint(3, len(XBRL_CONCEPTS))):
+        cells = []
+        for context in ('c-1', 'c-2', 'c-3'):
+            fact_id += 1
+            cells.append(f'<td style="padding:2px 1pt;text-align:right;vertical-align:bottom">'
+                         f'<span style="{STYLE.format(400)}"><ix:nonFraction unitRef="usd" contextRef="{context}" '
+                         f'decimals="-6" name="{concept}" format="ixt:num-dot-decimal" scale="6" id="f-{fact_id}">'
+                         f'{rng.randint(1, 99999):,}</ix:nonFraction></span></td>')
+        rows.append(f'<tr><td style="padding:2px 1pt;vertical-align:bottom"><span style="{STYLE.format(400)}">'
+                    f'{concept.split(":")[1]}</span></td>{"".join(cells)}</tr>')
+    return f'<div><table style="border-collapse:collapse;width:100%">{"".join(rows)}</table></div>\n', fact_id
+
+
+def item_heading(rng: random.Random, number: str) -> str:
+    # Headings vary between filers like the real ones, e.g. 'Item 1A.' or 'ITEM 1A.', with a regular or a
+    # non-breaking space
+    item = rng.choice(['Item', 'ITEM'])
+    space = rng.choice([' ', '&#160;', '&nbsp;'])
+    return (f'<div style="margin-top:18pt" id="item{number.lower()}"><span style="{STYLE.format(700)}">'
+            f'{item}{space}{number}.</span><span style="{STYLE.format(700)}"> {sentence(rng, 4)}</span></div>\n')
+
+
+def synthetic_10k_document(seed: int, size_bytes: int) -> str:
+    """
+    An inline XBRL 10-K document of about `size_bytes`, shaped like a real one: heavily styled html with a table of
+    contents linking every Item, each Item's heading and paragraphs, and ix:nonFraction facts in tables, mostly in
+    Item 8. The same seed always gives the same document.
+    """
+    rng = random.Random(seed)
+    parts = ['<?xml version="1.0" encoding="utf-8"?>\n'
+             '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:ix="http://www.xbrl.org/2013/inlineXBRL" '
+             'xmlns:xbrli="http://www.xbrl.org/2003/instance" xmlns:us-gaap="http://fasb.org/us-gaap/2022" '
+             'xmlns:ixt="http://www.xbrl.org/inlineXBRL/transformation/2020-02-12">'
+             f'<head><title>syn-{seed}-20221231</title></head><body>\n'
+             '<div style="display:none"><ix:header><ix:resources>'
+             + ''.join(f'<xbrli:context id="c-{i}"><xbrli:entity><xbrli:identifier scheme="http://www.sec.gov/CIK">'
+                       f'{company_cik(seed):010d}</xbrli:identifier></xbrli:entity></xbrli:context>' for i in (1, 2, 3))
+             + '</ix:resources></ix:header></div>\n<div><table>']
+    for number, share in SECTION_SHARES:
+        parts.append(f'<tr><td><a href="#item{number.lower()}" style="{STYLE.format(400)}">Item {number}.</a></td>'
+                     f'<td>{sentence(rng, 3)}</td></tr>')
+    parts.append('</table></div>\n')
+    fact_id = 0
+    for number, share in SECTION_SHARES:
+        parts.append(item_heading(rng, number))
+        section_bytes = 0
+        while section_bytes < size_bytes * share:
+            if number in ('7', '8') and rng.random() < (0.5 if number == '8' else 0.15):
+                part, fact_id = xbrl_table(rng, fact_id)
+            else:
+                part = paragraph(rng)
+            parts.append(part)
+            section_bytes += len(part)
+    parts.append('</body></html>\n')
+    return ''.join(parts)
+
+
+def uuencoded(rng: random.Random, size_bytes: int) -> str:
+    # Binary attachments such as graphics are uuencoded in the submission, in 61 character lines
+    lines = ['begin 644 logo.jpg']
+    alphabet = ''.join(chr(x) for x in range(33, 96))
+    for _ in range(max(size_bytes // 62, 1)):
+        lines.append('M' + ''.join(rng.choices(alphabet, k=60)))
+    lines.extend(['`', 'end'])
+    return '\n'.join(lines) + '\n'
+
+
+def sec_header(accession: str, form_type: str, cik: int, name: str, documents: int, filed: datetime.date) -> str:
+    return (f'<SEC-DOCUMENT>{accession}.txt : {filed:%Y%m%d}\n<SEC-HEADER>{accession}.hdr.sgml : {filed:%Y%m%d}\n'
+            f'ACCESSION NUMBER:\t\t{accession}\nCONFORMED SUBMISSION TYPE:\t{form_type}\n'
+            f'PUBLIC DOCUMENT COUNT:\t\t{documents}\nFILED AS OF DATE:\t\t{filed:%Y%m%d}\n\nFILER:\n\n'
+            f'\tCOMPANY DATA:\t\n\t\tCOMPANY CONFORMED NAME:\t\t\t{name}\n\t\tCENTRAL INDEX KEY:\t\t\t{cik:010d}\n'
+            '</SEC-HEADER>\n')
+
+
+def document(number: int, doc_type: str, file_name: str, text: str) -> str:
+    return (f'<DOCUMENT>\n<TYPE>{doc_type}\n<SEQUENCE>{number}\n<FILENAME>{file_name}\n<TEXT>\n{text}'
+            f'</TEXT>\n</DOCUMENT>\n')
+
+
+def synthetic_10k_submission(seed: int, size_bytes: int, exhibit_bytes: int = None) -> bytes:
+    """
+    A full EDGAR 10-K submission .txt: the SEC header, the inline XBRL 10-K of about `size_bytes`, then exhibits, an
+    XBRL schema and a uuencoded graphic of about `exhibit_bytes` in total, half of `size_bytes` unless given.
+    """
+    rng = random.Random(-seed - 1)
+    exhibit_bytes = size_bytes // 2 if exhibit_bytes is None else exhibit_bytes
+    accession = f'{company_cik(seed):010d}-23-{seed % 1000000:06d}'
+    doc = synthetic_10k_document(seed, size_bytes)
+    exhibit = ''.join(paragraph(rng) for _ in range(max(exhibit_bytes // 4 // 600, 1)))
+    schema = ''.join(f'<xs:element id="{concept.replace(":", "_")}_{i}" name="{concept.split(":")[1]}{i}" '
+                     f'type="xbrli:monetaryItemType" substitutionGroup="xbrli:item"/>\n'
+                     for i in range(max(exhibit_bytes // 4 // 150, 1)) for concept in XBRL_CONCEPTS[:1])
+    parts = [sec_header(accession, '10-K', company_cik(seed), company_name(seed), 5, datetime.date(2023, 3, 1)),
+             document(1, '10-K', f'syn-{seed}-20221231.htm', f'<XBRL>\n{doc}</XBRL>\n'),
+             document(2, 'EX-21.1', 'ex21.htm', f'<html><body>{exhibit}</body></html>\n'),
+             document(3, 'EX-31.1', 'ex31.htm', f'<html><body>{exhibit}</body></html>\n'),
+             document(4, 'EX-101.SCH', f'syn-{seed}-20221231.xsd',
+                      f'<XBRL>\n<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">\n{schema}</xs:schema>\n'
+                      '</XBRL>\n'),
+             document(5, 'GRAPHIC', 'logo.jpg', uuencoded(rng, exhibit_bytes // 4)),
+             '</SEC-DOCUMENT>\n']
+    return ''.join(parts).encode('utf-8')
+
+
+def info_table_row(rng: random.Random, prefix: str, company: int) -> str:
+    title = rng.choice(TITLES_OF_CLASS)
+    put_call = f'<{prefix}putCall>{title.title()}</{prefix}putCall>' if title in ('PUT', 'CALL') else ''
+    cusip = company_cusip(company)
+    if rng.random() < 0.02:
+        # Some filers pad cusips with leading zeros, estimate_cusip6 drops one
+        cusip = '000' + cusip[:6]
+    return (f'<{prefix}infoTable><{prefix}nameOfIssuer>{company_name(company)} &amp; CO</{prefix}nameOfIssuer>'
+            f'<{prefix}titleOfClass>{title}</{prefix}titleOfClass><{prefix}cusip>{cusip}</{prefix}cusip>'
+            f'<{prefix}value>{rng.randint(1, 999999)}</{prefix}value><{prefix}shrsOrPrnAmt>'
+            f'<{prefix}sshPrnamt>{rng.randint(1, 9999999)}</{prefix}sshPrnamt>'
+            f'<{prefix}sshPrnamtType>{"SH" if rng.random() < 0.9 else "PRN"}</{prefix}sshPrnamtType>'
+            f'</{prefix}shrsOrPrnAmt>{put_call}<{prefix}investmentDiscretion>{rng.choice(["SOLE", "DFND", "OTR"])}'
+            f'</{prefix}investmentDiscretion><{prefix}votingAuthority><{prefix}Sole>{rng.randint(0, 99999)}'
+            f'</{prefix}Sole><{prefix}Shared>0</{prefix}Shared><{prefix}None>0</{prefix}None>'
+            f'</{prefix}votingAuthority></{prefix}infoTable>\n')
+
+
+def synthetic_13f_submission(seed: int, rows: int, companies: int = 5000,
+                             report_period: datetime.date = datetime.date(2023, 3, 31)) -> str:
+    """
+    A full EDGAR 13F-HR submission .txt of manager `seed` holding `rows` infoTable rows of `companies` companies. As
+    in real filings a company can appear on several rows, e.g. once per investment discretion, and options and
+    non-common classes are mixed in for filter_and_format to skip.
+    """
+    rng = random.Random(seed)
+    cik = 2000000 + seed
+    accession = f'{cik:010d}-23-{seed % 1000000:06d}'
+    prefix, declaration = INFO_TABLE_NAMESPACES[seed % len(INFO_TABLE_NAMESPACES)]
+    primary = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<edgarSubmission xmlns="http://www.sec.gov/edgar/thirteenffiler" '
+               'xmlns:com="http://www.sec.gov/edgar/common">\n'
+               f'<headerData><submissionType>13F-HR</submissionType><filerInfo><filer><credentials><cik>{cik:010d}'
+               f'</cik><ccc>XXXXXXXX</ccc></credentials></filer><periodOfReport>{report_period:%m-%d-%Y}'
+               '</periodOfReport></filerInfo></headerData>\n'
+               f'<formData><coverPage><reportCalendarOrQuarter>{report_period:%m-%d-%Y}</reportCalendarOrQuarter>'
+               f'<filingManager><name>SYNTHETIC MANAGER {seed} LLC</name><address><com:street1>{seed} Main St'
+               '</com:street1><com:city>NEW YORK</com:city><com:stateOrCountry>NY</com:stateOrCountry>'
+               '<com:zipCode>10001</com:zipCode></address></filingManager></coverPage>'
+               f'<summaryPage><tableEntryTotal>{rows}</tableEntryTotal></summaryPage></formData>\n'
+               '</edgarSubmission>\n')
+    held = [rng.randrange(companies) for _ in range(max(rows * 4 // 5, 1))]
+    info_table = (f'<?xml version="1.0" encoding="UTF-8"?>\n<informationTable {declaration}="{INFO_TABLE_URI}">\n'
+                  + ''.join(info_table_row(rng, prefix, rng.choice(held)) for _ in range(rows))
+                  + '</informationTable>\n')
+    return (sec_header(accession, '13F-HR', cik, f'SYNTHETIC MANAGER {seed} LLC', 2, datetime.date(2023, 5, 15))
+            + document(1, '13F-HR', 'primary_doc.xml', f'<XML>\n{primary}</XML>\n')
+            + document(2, 'INFORMATION TABLE', 'infotable.xml', f'<XML>\n{info_table}</XML>\n')
+            + '</SEC-DOCUMENT>\n')
+
+
+def synthetic_13f_file_name(seed: int) -> str:
+    # Named like f13-download.py names its files, so f13-parse-and-format.py derives the same source url
+    cik = 2000000 + seed
+    return f'_Archives_edgar_data_{cik}_{cik:010d}-23-{seed % 1000000:06d}.txt'
+
+
+def write_10k_fixtures(directory: str, count: int, size_bytes: int, seed: int = 0) -> List[str]:
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(seed, seed + count):
+        paths.append(os.path.join(directory, f'syn-10k-{i}.txt'))
+        with open(paths[-1], 'wb') as file:
+            file.write(synthetic_10k_submission(i, size_bytes))
+    return paths
+
+
+def write_13f_fixtures(directory: str, count: int, rows: int, companies: int = 5000, seed: int = 0) -> List[str]:
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(seed, seed + count):
+        paths.append(os.path.join(directory, synthetic_13f_file_name(i)))
+        with open(paths[-1], 'w') as file:
+            file.write(synthetic_13f_submission(i, rows, companies))
+    return paths
+
+
+def holdings_frame(rows: int, companies: int = 5000, managers: int = 500, seed: int = 0) -> pd.DataFrame:
+    """
+    `rows` parsed holdings with the columns f13-parse-and-format.py writes, before aggregation, so managers hold some
+    companies on more than one row. Built with numpy rather than by parsing filings, so millions of rows take seconds.
+    """
+    rng = np.random.default_rng(seed)
+    manager = rng.integers(0, managers, rows)
+    company = rng.integers(0, companies, rows)
+    quarter = rng.integers(0, 4, rows)
+    cusips = np.array([company_cusip(i) for i in range(companies)], dtype=object)
+    periods = np.array([datetime.date(2023, 3, 31), datetime.date(2023, 6, 30), datetime.date(2023, 9, 30),
+                        datetime.date(2023, 12, 31)], dtype=object)
+    manager_ciks = np.array([f'{2000000 + i:010d}' for i in range(managers)], dtype=object)
+    return pd.DataFrame({
+        'source': np.array([f'https://sec.gov/Archives/edgar/data/{2000000 + i}/{i}-23-{q}.txt'
+                            for i in range(managers) for q in range(4)], dtype=object)[manager * 4 + quarter],
+        'managerCik': manager_ciks[manager],
+        'managerAddress': np.array([f'{i} Main St, NEW YORK, NY, 10001' for i in range(managers)],
+                                   dtype=object)[manager],
+        'managerName': np.array([f'SYNTHETIC MANAGER {i} LLC' for i in range(managers)], dtype=object)[manager],
+        'reportCalendarOrQuarter': periods[quarter],
+        'cusip6': np.array([x[:6] for x in cusips], dtype=object)[company],
+        'cusip': cusips[company],
+        'companyName': np.array([company_name(i) + ' & CO' for i in range(companies)], dtype=object)[company],
+        'value': rng.integers(1, 999999, rows) * 1000,
+        'shares': rng.integers(1, 9999999, rows),
+    })
+
+
+def companies_frame(companies: int, seed: int = 0, held_share: float = 0.5) -> pd.DataFrame:
+    """
+    The cik-10k-urls.csv of `companies` 10-K filers, shaped as f10k-f13-subset.py reads it. About `held_share` of them
+    are among the companies holdings_frame() draws from, the rest are held by no manager.
+    """
+    rng = np.random.default_rng(seed + 1)
+    ids = np.where(rng.random(companies) < held_share, rng.permutation(companies), companies + np.arange(companies))
+    return pd.DataFrame({
+        'cusip6': [company_cusip(i)[:6] for i in ids],
+        'cik': [company_cik(i) for i in ids],
+        'names': [f"['{company_name(i)}']" for i in ids],
+        'cusip': [f"['{company_cusip(i)}']" for i in ids],
+        'form10KUrls': [f"['https://www.sec.gov/Archives/edgar/data/{company_cik(i)}/{i}.txt']" for i in ids],
+    })
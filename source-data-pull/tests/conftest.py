@@ -0,0 +1,14 @@
+import importlib.util
+import os
+import sys
+
+SCRIPT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SCRIPT_DIRECTORY)
+
+
+def load_script(path: str, name: str):
+    # The scripts' names are not valid module names, so load them by path
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPT_DIRECTORY, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
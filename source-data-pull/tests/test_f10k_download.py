@@ -0,0 +1,102 @@
+import http.client
+import http.server
+import threading
+
+import pandas as pd
+import pytest
+
+from conftest import load_script
+from edgar_cache import FilingCache, cache_key
+from synthetic_filings import synthetic_10k_submission
+
+f10k = load_script('form10k/f10k-download-parse-format.py', 'f10k_download_parse_format')
+
+SUBMISSION = synthetic_10k_submission(seed=1, size_bytes=200_000)
+
+
+class SubmissionHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        # /truncated sends the full Content-Length but only half the body, like a connection dropped mid-download
+        body = SUBMISSION[:len(SUBMISSION) // 2] if self.path.startswith('/truncated') else SUBMISSION
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(SUBMISSION)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def server_url():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), SubmissionHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_complete_submission_is_cached(server_url, tmp_path):
+    cache = FilingCache(str(tmp_path / 'cache'))
+    url = server_url + '/complete/0000000001-22-000001.txt'
+    doc = f10k.download_10_k(url, 'test test@example.com', cache=cache)
+    assert doc == f10k.extract_10_k(SUBMISSION.decode('utf-8'))
+    assert cache.get(cache_key(url)) == SUBMISSION
+    cache.close()
+
+
+def test_truncated_submission_is_not_cached(server_url, tmp_path):
+    cache = FilingCache(str(tmp_path / 'cache'))
+    url = server_url + '/truncated/0000000001-22-000001.txt'
+    with pytest.raises(http.client.IncompleteRead):
+        f10k.download_10_k(url, 'test test@example.com', cache=cache)
+    assert cache.metadata(cache_key(url)) is None
+    assert list(tmp_path.joinpath('cache').glob('.tmp-*')) == []
+    cache.close()
+
+
+def test_truncated_submission_without_cache_fails(server_url):
+    # Half the submission ends before the 10-K does, which must not read as a filing without a 10-K
+    with pytest.raises(http.client.IncompleteRead):
+        f10k.download_10_k(server_url + '/truncated/0000000001-22-000001.txt', 'test test@example.com')
+
+
+class BrokenParseExecutor:
+    # Stands in for a process pool whose workers have died
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def submit(self, *args):
+        raise f10k.BrokenProcessPool('A process in the process pool was terminated abruptly')
+
+
+def filings_df(urls):
+    return pd.DataFrame({'form10KUrls': urls, 'cik': '1', 'cusip6': '123456', 'cusip': '123456789',
+                         'names': 'Example Corp'})
+
+
+def test_pipeline_reports_unexpected_download_errors(monkeypatch, tmp_path):
+    monkeypatch.setattr(f10k, 'download_10_k', lambda *args: None)
+    # A url without a file name fails before download_10_k is called
+    url_df = filings_df(['https://www.sec.gov/Archives/0000000001-22-000001.txt', 'no-file-name'])
+    failures = f10k.run_pipeline(url_df, 'test test@example.com', None, str(tmp_path), None, None, 2, 1, 4)
+    assert sorted(url for url, error in failures) == sorted(url_df.form10KUrls)
+    assert any(error.startswith('download error: ValueError') for url, error in failures)
+
+
+def test_pipeline_finishes_when_parse_pool_breaks(monkeypatch, tmp_path):
+    monkeypatch.setattr(f10k, 'download_10_k', lambda *args: 'ITEM 1. BUSINESS')
+    monkeypatch.setattr(f10k, 'ProcessPoolExecutor', BrokenParseExecutor)
+    url_df = filings_df([f'https://www.sec.gov/Archives/0000000001-22-{i:06d}.txt' for i in range(10)])
+    # A queue smaller than the filings, so downloads block on it unless the broken pool's documents are taken
+    failures = f10k.run_pipeline(url_df, 'test test@example.com', None, str(tmp_path), None, None, 2, 1, 2)
+    assert len(failures) == 10
+    assert all('BrokenProcessPool' in error for url, error in failures)
@@ -0,0 +1,29 @@
+import datetime
+import subprocess
+import sys
+
+import pandas as pd
+
+from conftest import SCRIPT_DIRECTORY, load_script
+
+subset = load_script('f10k-f13-subset.py', 'f10k_f13_subset')
+
+
+def test_csv_only_runs_do_not_import_pyarrow():
+    # A pyarrow that fails to import stands in for one that is not installed
+    code = ('import sys; sys.modules["pyarrow"] = None; sys.path.insert(0, "tests"); '
+            'from conftest import load_script; load_script("f10k-f13-subset.py", "subset")')
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=SCRIPT_DIRECTORY)
+    assert result.returncode == 0, result.stderr
+
+
+def test_parquet_reads_only_the_requested_periods(tmp_path):
+    df = pd.DataFrame({'source': ['a', 'b', 'c'], 'managerCik': [1, 2, 3], 'managerAddress': 'x', 'managerName': 'm',
+                       'cusip6': '123456', 'cusip': '123456789', 'companyName': 'c', 'value': 1.0, 'shares': 1,
+                       'reportCalendarOrQuarter': [datetime.date(2023, 3, 31), datetime.date(2023, 6, 30),
+                                                   datetime.date(2023, 6, 30)]})
+    df.to_parquet(tmp_path / 'form13.parquet', partition_cols=['reportCalendarOrQuarter'])
+    path = str(tmp_path / 'form13.parquet')
+    assert sorted(subset.get_form13_df(path, ['2023-06-30']).source) == ['b', 'c']
+    chunks = list(subset.iter_form13_chunks(path, ['2023-06-30'], chunk_rows=1))
+    assert sorted(pd.concat(chunks).source) == ['b', 'c']
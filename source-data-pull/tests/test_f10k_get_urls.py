@@ -0,0 +1,44 @@
+import http.server
+import threading
+
+import pytest
+
+from conftest import load_script
+from edgar_urls import connect
+
+get_urls = load_script('form10k/f10k-get-urls.py', 'f10k_get_urls')
+
+
+class SubmissionsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        # CIK 1 is unknown to EDGAR, every other cik hits a server error
+        self.send_response(404 if self.path.endswith('CIK0000000001.json') else 500)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def data_url():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), SubmissionsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_unknown_cik_has_no_filings_and_is_not_a_failure(data_url):
+    conn = connect(data_url)
+    assert get_urls.get_filing_history(conn, '1', 'test test@example.com', data_url=data_url) == {}
+    conn.close()
+
+
+def test_server_error_is_a_failure(data_url):
+    conn = connect(data_url)
+    history = get_urls.get_filing_history(conn, '2', 'test test@example.com', retry_limit=1, retry_sleep_sec=0,
+                                          data_url=data_url)
+    assert history is None
+    conn.close()
@@ -0,0 +1,37 @@
+import pytest
+
+from conftest import load_script
+
+f10k = load_script('form10k/f10k-download-parse-format.py', 'f10k_download_parse_format')
+
+HEADINGS = ['1', '1A', '1B', '2', '3', '4', '5', '6', '7', '7A', '8', '9', '9A', '10', '11', '12', '13', '14', '15']
+
+
+def ten_k(headings):
+    # A table of contents, then each Item heading followed by a body naming it
+    contents = ''.join(f'<p>Item {x}.</p>' for x in headings)
+    sections = ''.join(f'<p>Item {x}. Heading</p><p>Body of item{x.lower()}</p>' for x in headings)
+    return f'<html><body>{contents}{sections}<p>SIGNATURES</p></body></html>'
+
+
+@pytest.mark.parametrize('text_engine', list(f10k.TEXT_ENGINES))
+def test_non_default_items_end_at_the_next_heading(text_engine):
+    sections = f10k.extract_section_text(ten_k(HEADINGS), text_engine, ['item2', 'item3', 'item8', 'item15'])
+    assert list(sections) == ['item2', 'item3', 'item8', 'item15']
+    for item, text in sections.items():
+        bodies = [x for x in text.split() if x.startswith('item')]
+        assert bodies == [item], item
+
+
+def test_default_items_end_at_unrequested_headings():
+    sections = f10k.extract_section_text(ten_k(HEADINGS))
+    assert 'Body of item1a' in sections['item1a']
+    assert 'Body of item1b' not in sections['item1a']
+    assert 'Body of item8' not in sections['item7a']
+    assert sorted(x for x, start, end in f10k.index_sections(ten_k(HEADINGS))) == sorted(f10k.DEFAULT_SECTION_ITEMS)
+
+
+def test_item_1_does_not_match_items_10_to_16():
+    sections = f10k.extract_section_text(ten_k(['1', '10', '11']), items=['item1', 'item10'])
+    assert sections['item1'].split()[-1] == 'item1'
+    assert sections['item10'].split()[-1] == 'item10'
@@ -0,0 +1,32 @@
+from conftest import load_script
+
+f13 = load_script('form13/f13-download.py', 'f13_download')
+
+FILINGS = [('/Archives/edgar/data/1/ok.txt', '2023-02-14'), ('/Archives/edgar/data/2/gone.txt', '2023-02-14'),
+           ('/Archives/edgar/data/3/broken.txt', '2023-02-14')]
+
+
+def fake_download_form13(path, cache=None, base_url=None):
+    # One filing downloads, one is a 404 and one always fails
+    if path.endswith('ok.txt'):
+        return '<XML>holdings</XML>'
+    return '' if path.endswith('gone.txt') else None
+
+
+def test_filings_that_fail_for_good_stop_being_retried(monkeypatch, tmp_path):
+    monkeypatch.setattr(f13, 'download_form13', fake_download_form13)
+    manifest = f13.DownloadManifest(str(tmp_path / f13.MANIFEST_FILE_NAME))
+    manifest.record_index('2023-02-14', FILINGS, 'done')
+    f13.download_filings(manifest, str(tmp_path), 1)
+    assert manifest.summary() == {'done': 1, 'missing': 1, 'failed': 1}
+    # Only the filing that failed is retried, until it has had MAX_FILING_ATTEMPTS
+    assert manifest.pending_filings() == ['/Archives/edgar/data/3/broken.txt']
+    assert manifest.retryable() == 1
+    for attempt in range(f13.MAX_FILING_ATTEMPTS - 1):
+        f13.download_filings(manifest, str(tmp_path), 1)
+    assert manifest.pending_filings() == []
+    assert manifest.retryable() == 0
+    failures = dict(manifest.failures())
+    assert failures['/Archives/edgar/data/2/gone.txt'] == 'not found, not retried'
+    assert failures['/Archives/edgar/data/3/broken.txt'].endswith(f'gave up after {f13.MAX_FILING_ATTEMPTS} attempts')
+    manifest.close()
@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+import synthetic_filings
+from conftest import SCRIPT_DIRECTORY
+
+SCRIPT = os.path.join(SCRIPT_DIRECTORY, 'form13', 'f13-parse-and-format.py')
+
+
+@pytest.fixture(scope='module')
+def raw_directory(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('form13-raw')
+    synthetic_filings.write_13f_fixtures(str(directory), 6, 50, 20)
+    return str(directory) + '/'
+
+
+def parse(*args):
+    return subprocess.run([sys.executable, SCRIPT, *args], capture_output=True, text=True, cwd=SCRIPT_DIRECTORY)
+
+
+def test_parallel_parse_only_removes_its_own_shards(raw_directory, tmp_path):
+    shard_directory = tmp_path / 'shards'
+    shard_directory.mkdir()
+    (shard_directory / 'keep.txt').write_text('not a shard')
+    output_file = tmp_path / 'form13.csv'
+    result = parse('-i', raw_directory, '-o', str(output_file), '-w', '2', '-fs', '2', '-s', str(shard_directory))
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert os.listdir(shard_directory) == ['keep.txt']
+    assert len(pd.read_csv(output_file)) > 0
+
+
+@pytest.mark.parametrize('workers', ['1', '2'])
+def test_parquet_output_replaces_only_a_dataset(raw_directory, tmp_path, workers):
+    output_directory = tmp_path / 'form13.parquet'
+    for run in range(2):
+        result = parse('-i', raw_directory, '-o', str(output_directory), '-f', 'parquet', '-w', workers)
+        assert result.returncode == 0, result.stdout + result.stderr
+        assert all(x.startswith('reportCalendarOrQuarter=') for x in os.listdir(output_directory))
+    assert len(pd.read_parquet(output_directory)) > 0
+
+    other_directory = tmp_path / 'data'
+    other_directory.mkdir()
+    (other_directory / 'keep.txt').write_text('not a dataset')
+    result = parse('-i', raw_directory, '-o', str(other_directory), '-f', 'parquet', '-w', workers)
+    assert result.returncode == 2
+    assert os.listdir(other_directory) == ['keep.txt']
@@ -0,0 +1,54 @@
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import SCRIPT_DIRECTORY
+from edgar_rate import retry_after_seconds
+
+SCRIPT = os.path.join(SCRIPT_DIRECTORY, 'mock-edgar-server.py')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_fractional_retry_after_is_rejected():
+    result = subprocess.run([sys.executable, SCRIPT, '--retry-after', '0.5'], capture_output=True, text=True,
+                            timeout=30)
+    assert result.returncode == 2
+    assert '--retry-after' in result.stderr
+
+
+@pytest.fixture
+def erroring_server():
+    port = free_port()
+    process = subprocess.Popen([sys.executable, SCRIPT, '--port', str(port), '--error-rate', '1',
+                                '--retry-after', '2'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        yield port
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def test_retry_after_is_read_by_the_rate_governor(erroring_server):
+    conn = http.client.HTTPConnection('127.0.0.1', erroring_server, timeout=10)
+    conn.request('GET', '/Archives/edgar/daily-index/2023/QTR1/master.20230214.idx')
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    assert response.status in (429, 503)
+    assert retry_after_seconds(response.getheader('Retry-After')) == 2.0
@@ -0,0 +1,30 @@
+import csv
+
+import pandas as pd
+
+from conftest import load_script
+
+export = load_script('neo4j-bulk-export.py', 'neo4j_bulk_export')
+
+
+def holding(source: str, cusip: str, value: float, shares: int) -> dict:
+    return {'source': source, 'managerCik': 1, 'managerAddress': '1 Main St', 'managerName': 'Manager',
+            'reportCalendarOrQuarter': '2023-03-31', 'cusip6': cusip[:6], 'cusip': cusip, 'companyName': 'Company',
+            'value': value, 'shares': shares}
+
+
+def test_form13_holdings_sum_share_classes_and_keep_the_last_filing(tmp_path):
+    rows = [holding('a.txt', '123456100', 1.0, 10), holding('a.txt', '123456200', 2.0, 20),
+            holding('b.txt', '123456100', 5.0, 50), holding('b.txt', '123456200', 6.0, 60),
+            holding('b.txt', '654321100', 7.0, 70)]
+    form13_path = str(tmp_path / 'form13.csv')
+    # Read a row at a time, so one holding spans chunks
+    pd.DataFrame(rows).to_csv(form13_path, index=False)
+    exporter = export.BulkExporter(str(tmp_path))
+    export.export_form13(exporter, form13_path, chunk_rows=1)
+    exporter.close()
+    with open(tmp_path / 'owns-stock-in.csv', newline='') as file:
+        relationships = list(csv.reader(file))[1:]
+    assert sorted(relationships) == [['1', '123456', '2023-03-31', '11.0', '110'],
+                                     ['1', '654321', '2023-03-31', '7.0', '70']]
+    assert exporter.skipped == 3
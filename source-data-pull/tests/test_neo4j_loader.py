@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from neo4j_loader import Neo4jLoader, pair_rounds, rel_groups
+
+
+class FakeTransientError(Exception):
+    code = 'Neo.TransientError.Transaction.DeadlockDetected'
+
+
+class FakeDriver:
+    """
+    Stands in for a neo4j driver. Each transaction locks the nodes its rows touch for a moment, and two transactions
+    holding a lock on the same node at once are recorded as a conflict, as a database would risk a deadlock.
+    """
+
+    def __init__(self, source_col: str, target_col: str, fail_first: int = 0):
+        self.source_col = source_col
+        self.target_col = target_col
+        self.fail_first = fail_first
+        self.lock = threading.Lock()
+        self.locked = {}
+        self.conflicts = []
+        self.rows = []
+
+    def session(self, database: str = None):
+        return FakeSession(self)
+
+
+class FakeSession:
+    def __init__(self, driver: FakeDriver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def begin_transaction(self):
+        return FakeTransaction(self.driver)
+
+
+class FakeTransaction(FakeSession):
+    def run(self, query: str, recs):
+        driver = self.driver
+        nodes = {x[driver.source_col] for x in recs} | {x[driver.target_col] for x in recs}
+        with driver.lock:
+            if driver.fail_first > 0:
+                driver.fail_first -= 1
+                raise FakeTransientError()
+            for node in nodes:
+                if driver.locked.get(node, 0) > 0:
+                    driver.conflicts.append(node)
+                driver.locked[node] = driver.locked.get(node, 0) + 1
+        time.sleep(0.002)
+        with driver.lock:
+            for node in nodes:
+                driver.locked[node] -= 1
+            driver.rows.extend(recs)
+        return self
+
+    def single(self):
+        return [0]
+
+    def commit(self):
+        pass
+
+
+def chain_df(count: int) -> pd.DataFrame:
+    # NEXT relationships between consecutive chunks, where every chunk but the ends is a source and a target
+    return pd.DataFrame({'source': [f'chunk-{i}' for i in range(count)],
+                         'target': [f'chunk-{i + 1}' for i in range(count)]})
+
+
+def test_pair_rounds_cover_every_pair_without_sharing_a_partition():
+    for n in range(1, 9):
+        rounds = pair_rounds(n)
+        pairs = [pair for pairs in rounds for pair in pairs]
+        assert sorted(pairs) == [(i, j) for i in range(n) for j in range(i + 1, n)]
+        for pairs in rounds:
+            partitions = [x for pair in pairs for x in pair]
+            assert len(partitions) == len(set(partitions))
+
+
+@pytest.mark.parametrize('workers', [2, 3, 4])
+def test_same_label_groups_share_no_node(workers):
+    recs = chain_df(500).to_dict('records')
+    groups = rel_groups(recs, 'source', 'target', workers, 20, same_label=True)
+    loaded = [x['source'] for group in groups for batch in group for x in batch]
+    assert sorted(loaded) == sorted(x['source'] for x in recs)
+    for group in groups:
+        nodes = [{x['source'] for x in batch} | {x['target'] for x in batch} for batch in group]
+        for i in range(len(nodes)):
+            for j in range(i + 1, len(nodes)):
+                assert not nodes[i] & nodes[j]
+
+
+def test_different_label_groups_share_no_source_or_target():
+    rel_df = pd.DataFrame({'source': [f'manager-{i % 37}' for i in range(500)],
+                           'target': [f'company-{i % 53}' for i in range(500)]})
+    groups = rel_groups(rel_df.to_dict('records'), 'source', 'target', 4, 20)
+    for group in groups:
+        for col in ['source', 'target']:
+            keys = [{x[col] for x in batch} for batch in group]
+            assert sum(map(len, keys)) == len(set().union(*keys))
+
+
+def test_load_rels_same_label_has_no_concurrent_conflicts():
+    driver = FakeDriver('source', 'target')
+    stats = Neo4jLoader(driver, batch_size=10, workers=4).load_rels(
+        chain_df(400), 'Chunk', ('chunkId', 'source'), ('chunkId', 'target'), 'NEXT')
+    assert driver.conflicts == []
+    assert len(driver.rows) == stats.rows == 400
+
+
+def test_load_nodes_retries_transient_errors():
+    driver = FakeDriver('chunkId', 'chunkId', fail_first=2)
+    node_df = pd.DataFrame({'chunkId': [f'chunk-{i}' for i in range(50)], 'text': ['x'] * 50})
+    stats = Neo4jLoader(driver, batch_size=10, workers=2, sleep=lambda seconds: None).load_nodes(
+        node_df, 'chunkId', 'Chunk')
+    assert stats.retries == 2
+    assert sorted(x['chunkId'] for x in driver.rows) == sorted(node_df.chunkId)
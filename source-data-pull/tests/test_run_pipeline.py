@@ -0,0 +1,36 @@
+from conftest import load_script
+from metrics import RETRY_EXIT_CODE
+
+pipeline = load_script('run-pipeline.py', 'run_pipeline')
+
+
+def script_stage(tmp_path, name: str, exit_code: int, after=()):
+    # A stage whose script writes its output and exits with exit_code
+    script = tmp_path / f'{name}.py'
+    output = tmp_path / f'{name}.out'
+    script.write_text(f'open({str(output)!r}, "w").close()\nraise SystemExit({exit_code})\n')
+    return pipeline.Stage(name, str(script), [], inputs=[], outputs=[str(output)], after=after)
+
+
+def test_failed_stage_is_not_recorded(tmp_path):
+    state = pipeline.PipelineState(str(tmp_path / 'state.json'))
+    stages = [script_stage(tmp_path, 'download', 1), script_stage(tmp_path, 'ok', 0),
+              script_stage(tmp_path, 'parse', 0, after=['download'])]
+    results = pipeline.run_pipeline(stages, state)
+    assert results['download'].startswith('RuntimeError')
+    assert results['ok'] == 'ran'
+    assert results['parse'] == 'blocked'
+    assert 'download' not in state.stages
+    # The failed stage runs again, the one that succeeded is current
+    results = pipeline.run_pipeline(stages[:2], state)
+    assert results['download'].startswith('RuntimeError')
+    assert results['ok'] == 'skipped'
+
+
+def test_stage_with_failures_to_retry_runs_again_without_blocking(tmp_path):
+    state = pipeline.PipelineState(str(tmp_path / 'state.json'))
+    stages = [script_stage(tmp_path, 'download', RETRY_EXIT_CODE),
+              script_stage(tmp_path, 'parse', 0, after=['download'])]
+    assert pipeline.run_pipeline(stages, state) == {'download': 'retry', 'parse': 'ran'}
+    assert 'download' not in state.stages
+    assert pipeline.run_pipeline(stages, state) == {'download': 'retry', 'parse': 'skipped'}